@@ -2,6 +2,7 @@
 
 import os
 import sys
+import asyncio
 import logging
 
 # Keep /app first so local packages like "models" resolve correctly.
@@ -9,7 +10,8 @@ sys.path.append("/app/shared")
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from shared.middleware import CorrelationMiddleware, RBACMiddleware, MetricsMiddleware
+from shared.middleware import CorrelationMiddleware, RBACMiddleware, MetricsMiddleware, metrics_writer
+from shared.http_clients import http_clients
 
 logging.basicConfig(
     level=os.environ.get("LOG_LEVEL", "INFO"),
@@ -43,8 +45,21 @@ async def startup():
     for d in ["ledger", "vault", "providers", "settlement", "metrics",
               "outbox", "idempotency", "reconciliation"]:
         os.makedirs(os.path.join(data_dir, d), exist_ok=True)
+    # Pooled keep-alive clients for the payment hot path
+    http_clients.open("vault")
+    http_clients.open("provider")
+    metrics_writer.start()
+    from services.idempotency import run_eviction_loop
+    app.state.idempotency_evictor = asyncio.create_task(run_eviction_loop())
     logging.getLogger("payrail").info("API Gateway started, data dirs initialized")
 
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.idempotency_evictor.cancel()
+    await http_clients.aclose()
+    await metrics_writer.close()
+
 # Import and mount routers
 from routers import payments, refunds, disputes, webhooks, health, audit
 
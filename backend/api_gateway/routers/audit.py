@@ -2,11 +2,14 @@
 
 import os
 import logging
+from contextlib import closing
+from itertools import islice
 from typing import Optional
 
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, HTTPException, Query
 
 from shared.file_store import FileStore
+from shared.settlement_manifest import SettlementManifest
 from services.ledger import LedgerService
 
 logger = logging.getLogger("payrail.audit")
@@ -14,6 +17,8 @@ router = APIRouter()
 
 DATA_DIR = os.environ.get("DATA_DIR", "/app/data")
 ledger = LedgerService()
+settlements = SettlementManifest(os.path.join(DATA_DIR, "settlement"))
+SETTLEMENT_COLUMNS = ["payment_id", "provider_ref", "amount", "currency", "type", "status", "settled_at", "provider"]
 
 
 @router.get("/payments")
@@ -61,9 +66,9 @@ async def audit_disputes(
 @router.get("/vault-access")
 async def audit_vault_access(limit: int = Query(100, le=500)):
     access_log_path = os.path.join(DATA_DIR, "vault", "access_log.jsonl")
-    entries = FileStore.read_jsonl(access_log_path)
+    entries = FileStore.tail_jsonl(access_log_path, limit)
     entries.reverse()
-    return {"entries": entries[:limit], "total": len(entries)}
+    return {"entries": entries, "total": FileStore.count_jsonl(access_log_path)}
 
 
 @router.get("/export")
@@ -93,20 +98,20 @@ async def get_reconciliation_reports():
 
 @router.get("/settlements")
 async def get_settlements():
-    settlement_dir = os.path.join(DATA_DIR, "settlement")
-    if not os.path.exists(settlement_dir):
-        return {"settlements": []}
+    # Answered from the manifest; rows are fetched per file
+    return {"settlements": settlements.entries()}
 
-    settlements = []
-    import glob
-    for path in sorted(glob.glob(os.path.join(settlement_dir, "*.csv")), reverse=True):
-        rows = FileStore.read_csv(path)
-        filename = os.path.basename(path)
-        total_amount = sum(int(r.get("amount", 0)) for r in rows)
-        settlements.append({
-            "file": filename,
-            "rows": len(rows),
-            "total_amount": total_amount,
-            "data": rows,
-        })
-    return {"settlements": settlements}
+
+@router.get("/settlements/{file_name}")
+async def get_settlement_rows(
+    file_name: str,
+    limit: int = Query(100, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    entry = settlements.read().get(file_name)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Settlement file {file_name} not found")
+    rows = FileStore.iter_csv_columns(os.path.join(settlements.settlement_dir, file_name), SETTLEMENT_COLUMNS)
+    with closing(rows):
+        page = [dict(zip(SETTLEMENT_COLUMNS, row)) for row in islice(rows, offset, offset + limit)]
+    return {**entry, "data": page, "limit": limit, "offset": offset}
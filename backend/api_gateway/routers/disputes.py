@@ -1,47 +1,38 @@
 """Disputes router - open, review, and resolve disputes."""
 
-import os
 import logging
 from datetime import datetime
 from typing import Optional
 
-from fastapi import APIRouter, HTTPException, Header, Query
+from fastapi import APIRouter, Depends, HTTPException, Header, Query
 from fastapi.responses import JSONResponse
 
 from shared.models import Dispute, DisputeState, LedgerEntry
-from shared.file_store import FileStore
 from shared.correlation import get_correlation_id
 from models.requests import CreateDisputeRequest, SubmitEvidenceRequest, ResolveDisputeRequest
 from services.ledger import LedgerService
 from services.state_machine import validate_dispute_transition, InvalidTransitionError
-from services.idempotency import IdempotencyService, IdempotencyConflictError
+from services.idempotency import (
+    IdempotencyService, IdempotencyConflictError, IdempotencyInProgressError, idempotency_scope,
+)
+from services.stores import payments_store, disputes_store
 
 logger = logging.getLogger("payrail.disputes")
-router = APIRouter()
-
-DATA_DIR = os.environ.get("DATA_DIR", "/app/data")
-DISPUTES_STORE = os.path.join(DATA_DIR, "idempotency", "disputes_store.json")
-PAYMENTS_STORE = os.path.join(DATA_DIR, "idempotency", "payments_store.json")
+router = APIRouter(dependencies=[Depends(idempotency_scope)])
 
 ledger = LedgerService()
 idempotency = IdempotencyService()
 
 
-def _load_disputes() -> dict:
-    return FileStore.read_json(DISPUTES_STORE, default={})
-
-
 def _save_dispute(dispute: dict):
-    disputes = _load_disputes()
-    disputes[dispute["id"]] = dispute
-    FileStore.write_json(DISPUTES_STORE, disputes)
+    disputes_store.put(dispute["id"], dispute)
 
 
 def _get_dispute(dispute_id: str) -> dict:
-    disputes = _load_disputes()
-    if dispute_id not in disputes:
+    dispute = disputes_store.get(dispute_id)
+    if dispute is None:
         raise HTTPException(status_code=404, detail=f"Dispute {dispute_id} not found")
-    return disputes[dispute_id]
+    return dispute
 
 
 @router.post("", status_code=201)
@@ -56,15 +47,16 @@ async def create_dispute(
         **req.model_dump(),
     })
     try:
-        cached = idempotency.check(idempotency_key, request_hash)
+        cached = await idempotency.check(idempotency_key, request_hash)
         if cached:
             return JSONResponse(cached.response, status_code=cached.status_code)
     except IdempotencyConflictError as e:
         raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
     # Verify payment exists
-    payments = FileStore.read_json(PAYMENTS_STORE, default={})
-    payment = payments.get(req.payment_id)
+    payment = payments_store.get(req.payment_id)
     if not payment:
         raise HTTPException(status_code=404, detail=f"Payment {req.payment_id} not found")
 
@@ -95,10 +87,10 @@ async def create_dispute(
 
     # Mark payment as chargeback if captured
     if payment["state"] in ("captured", "settled"):
-        payment["state"] = "chargeback"
-        payment["updated_at"] = datetime.utcnow().isoformat()
-        payments[req.payment_id] = payment
-        FileStore.write_json(PAYMENTS_STORE, payments)
+        payments_store.update(req.payment_id, {
+            "state": "chargeback",
+            "updated_at": datetime.utcnow().isoformat(),
+        })
 
     logger.info(f"Dispute {dispute.id} opened for payment {req.payment_id}")
 
@@ -113,8 +105,7 @@ async def list_disputes(
     limit: int = Query(50, le=200),
     offset: int = Query(0, ge=0),
 ):
-    disputes = _load_disputes()
-    items = list(disputes.values())
+    items = disputes_store.values()
 
     if state:
         items = [d for d in items if d.get("state") == state]
@@ -149,11 +140,13 @@ async def submit_evidence(
         **req.model_dump(),
     })
     try:
-        cached = idempotency.check(idempotency_key, request_hash)
+        cached = await idempotency.check(idempotency_key, request_hash)
         if cached:
             return JSONResponse(cached.response, status_code=cached.status_code)
     except IdempotencyConflictError as e:
         raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
     dispute = _get_dispute(dispute_id)
 
@@ -199,11 +192,13 @@ async def resolve_dispute(
         **req.model_dump(),
     })
     try:
-        cached = idempotency.check(idempotency_key, request_hash)
+        cached = await idempotency.check(idempotency_key, request_hash)
         if cached:
             return JSONResponse(cached.response, status_code=cached.status_code)
     except IdempotencyConflictError as e:
         raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
     dispute = _get_dispute(dispute_id)
 
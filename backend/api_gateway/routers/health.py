@@ -2,11 +2,21 @@
 
 import os
 import logging
+from typing import Optional
 
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse
 
 from shared.file_store import FileStore
+from shared.http_clients import http_clients
+from shared.middleware import metrics_writer, METRICS_RAW_SAMPLE_RATE
+from shared.request_metrics import request_metrics
+from shared.spans import spans
 from services.circuit_breaker import CircuitBreaker
+from services.idempotency import key_store
+from services.provider_stats import provider_stats
+from services.routing import RoutingEngine
+from services.routing_rules import routing_rules
 
 logger = logging.getLogger("payrail.health")
 router = APIRouter()
@@ -34,17 +44,78 @@ async def provider_health():
             "total_requests": state.get("total_requests", 0),
             "last_failure_at": state.get("last_failure_at"),
             "last_success_at": state.get("last_success_at"),
+            "opened_at": state.get("opened_at"),
+            "trip_reason": state.get("trip_reason"),
+            "window": cb.get_window_stats(),
             "can_execute": cb.can_execute(),
         })
     return {"providers": providers}
 
 
+@router.get("/providers/routing")
+async def provider_routing():
+    # Stats are per worker process, so this reflects the worker serving the request
+    engine = RoutingEngine()
+    scores = engine.score_providers()
+    for row in scores:
+        row.update(provider_stats.snapshot(row["provider"]))
+    return {"mode": engine.mode, "rules": routing_rules.current().describe(), "providers": scores}
+
+
 @router.get("/metrics")
 async def get_metrics(limit: int = Query(100, le=1000)):
     metrics_path = os.path.join(DATA_DIR, "metrics", "service_metrics.jsonl")
-    entries = FileStore.read_jsonl(metrics_path)
+    entries = FileStore.tail_jsonl(metrics_path, limit)
     entries.reverse()
-    return {"entries": entries[:limit], "total": len(entries)}
+    return {
+        "entries": entries,
+        "total": FileStore.count_jsonl(metrics_path),
+        "raw_sample_rate": METRICS_RAW_SAMPLE_RATE,
+    }
+
+
+@router.get("/metrics/summary")
+async def metrics_summary(window: list[int] = Query(None)):
+    # Per worker process, like the provider stats
+    return {"windows": request_metrics.summaries(window) if window else request_metrics.summaries()}
+
+
+@router.get("/metrics/prometheus", response_class=PlainTextResponse)
+async def metrics_prometheus():
+    return PlainTextResponse(request_metrics.exposition(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/metrics/http-pools")
+async def http_pool_stats():
+    return {"pools": http_clients.stats()}
+
+
+@router.get("/metrics/log-writer")
+async def log_writer_stats():
+    return metrics_writer.stats()
+
+
+@router.get("/metrics/idempotency")
+async def idempotency_store_stats():
+    return key_store.stats()
+
+
+@router.get("/metrics/stages")
+async def stage_timings(operation: Optional[str] = Query(None)):
+    return {"operations": spans.stage_summary(operation)}
+
+
+@router.get("/traces")
+async def list_traces(limit: int = Query(50, le=1000), operation: Optional[str] = Query(None)):
+    return {"traces": spans.recent(limit, operation)}
+
+
+@router.get("/traces/{correlation_id}")
+async def get_trace(correlation_id: str):
+    trace = spans.get(correlation_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"No trace for {correlation_id} on this worker")
+    return trace
 
 
 @router.get("/ledger/{ref_id}")
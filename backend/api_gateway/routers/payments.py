@@ -5,26 +5,29 @@ import logging
 from datetime import datetime
 from typing import Optional
 
-from fastapi import APIRouter, HTTPException, Header, Query
+from fastapi import APIRouter, Depends, HTTPException, Header, Query
 from fastapi.responses import JSONResponse
 import httpx
 
 from shared.models import PaymentIntent, PaymentState, LedgerEntry
-from shared.file_store import FileStore
 from shared.correlation import get_correlation_id
+from shared.http_clients import http_clients
+from shared.spans import spans
 from models.requests import CreatePaymentRequest, AuthorizePaymentRequest
-from services.idempotency import IdempotencyService, IdempotencyConflictError
+from services.idempotency import (
+    IdempotencyService, IdempotencyConflictError, IdempotencyInProgressError, idempotency_scope,
+)
 from services.ledger import LedgerService
 from services.routing import RoutingEngine
-from services.provider_client import ProviderClient, ProviderError, ProviderUnavailableError
+from services.provider_client import ProviderClient, ProviderError, ProviderBusyError, ProviderUnavailableError
 from services.state_machine import validate_payment_transition, InvalidTransitionError
+from services.stores import payments_store
 
 logger = logging.getLogger("payrail.payments")
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(idempotency_scope)])
 
 DATA_DIR = os.environ.get("DATA_DIR", "/app/data")
 VAULT_SERVICE_URL = os.environ.get("VAULT_SERVICE_URL", "http://vault-service:8027")
-PAYMENTS_STORE = os.path.join(DATA_DIR, "idempotency", "payments_store.json")
 
 ledger = LedgerService()
 idempotency = IdempotencyService()
@@ -32,21 +35,15 @@ routing = RoutingEngine()
 provider_client = ProviderClient()
 
 
-def _load_payments() -> dict:
-    return FileStore.read_json(PAYMENTS_STORE, default={})
-
-
 def _save_payment(payment: dict):
-    payments = _load_payments()
-    payments[payment["id"]] = payment
-    FileStore.write_json(PAYMENTS_STORE, payments)
+    payments_store.put(payment["id"], payment)
 
 
 def _get_payment(payment_id: str) -> dict:
-    payments = _load_payments()
-    if payment_id not in payments:
+    payment = payments_store.get(payment_id)
+    if payment is None:
         raise HTTPException(status_code=404, detail=f"Payment {payment_id} not found")
-    return payments[payment_id]
+    return payment
 
 
 @router.post("", status_code=201)
@@ -58,11 +55,13 @@ async def create_payment(
     # Check idempotency
     request_hash = idempotency.compute_hash(req.model_dump())
     try:
-        cached = idempotency.check(idempotency_key, request_hash)
+        cached = await idempotency.check(idempotency_key, request_hash)
         if cached:
             return JSONResponse(cached.response, status_code=cached.status_code)
     except IdempotencyConflictError as e:
         raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
     # Create payment intent
     payment = PaymentIntent(
@@ -112,8 +111,7 @@ async def list_payments(
     limit: int = Query(50, le=200),
     offset: int = Query(0, ge=0),
 ):
-    payments = _load_payments()
-    items = list(payments.values())
+    items = payments_store.values()
 
     if state:
         items = [p for p in items if p.get("state") == state]
@@ -148,13 +146,17 @@ async def authorize_payment(
         **req.model_dump(),
     })
     try:
-        cached = idempotency.check(idempotency_key, request_hash)
+        with spans.span("authorize", "idempotency_check"):
+            cached = await idempotency.check(idempotency_key, request_hash)
         if cached:
             return JSONResponse(cached.response, status_code=cached.status_code)
     except IdempotencyConflictError as e:
         raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
-    payment = _get_payment(payment_id)
+    with spans.span("authorize", "load_payment"):
+        payment = _get_payment(payment_id)
 
     # Validate state transition
     try:
@@ -170,7 +172,8 @@ async def authorize_payment(
     if req.pan and req.expiry:
         # Tokenize the card via vault
         try:
-            async with httpx.AsyncClient() as client:
+            client = http_clients.get("vault")
+            with spans.span("authorize", "vault"):
                 vault_resp = await client.post(
                     f"{VAULT_SERVICE_URL}/tokenize",
                     json={
@@ -185,7 +188,10 @@ async def authorize_payment(
                 raise HTTPException(status_code=502, detail="Vault tokenization failed")
             vault_data = vault_resp.json()
             token = vault_data["token"]
-        except httpx.ConnectError:
+        except httpx.PoolTimeout:
+            # Every pooled vault connection is busy; shed load rather than queue longer
+            raise HTTPException(status_code=503, detail="Vault service busy, retry later")
+        except (httpx.ConnectError, httpx.TimeoutException):
             raise HTTPException(status_code=502, detail="Vault service unavailable")
 
         pan = req.pan
@@ -193,7 +199,8 @@ async def authorize_payment(
     elif token:
         # Retrieve card from vault for provider
         try:
-            async with httpx.AsyncClient() as client:
+            client = http_clients.get("vault")
+            with spans.span("authorize", "vault"):
                 vault_resp = await client.post(
                     f"{VAULT_SERVICE_URL}/charge-token",
                     json={"token": token, "requester": "api-gateway", "purpose": "authorization"},
@@ -204,36 +211,28 @@ async def authorize_payment(
             card_data = vault_resp.json()
             pan = card_data["pan"]
             expiry = card_data["expiry"]
-        except httpx.ConnectError:
+        except httpx.PoolTimeout:
+            # Every pooled vault connection is busy; shed load rather than queue longer
+            raise HTTPException(status_code=503, detail="Vault service busy, retry later")
+        except (httpx.ConnectError, httpx.TimeoutException):
             raise HTTPException(status_code=502, detail="Vault service unavailable")
     else:
         raise HTTPException(status_code=400, detail="Either pan+expiry or token required")
 
     # Select provider via routing engine
-    provider_id = routing.select_provider(
-        amount=payment["amount"],
-        currency=payment["currency"],
-    )
-
-    # Call provider to authorize
-    try:
-        result = await provider_client.authorize(
-            provider_id=provider_id,
-            payment_id=payment_id,
+    with spans.span("authorize", "routing"):
+        decision = routing.decide(
             amount=payment["amount"],
             currency=payment["currency"],
-            pan=pan,
-            expiry=expiry,
-            merchant_id=x_merchant_id,
+            bin_prefix=pan[:8] if pan else None,
         )
-    except ProviderUnavailableError:
-        # Try failover
-        failover_id = os.environ.get("FAILOVER_PROVIDER", "providerB")
-        if failover_id == provider_id:
-            failover_id = os.environ.get("DEFAULT_PROVIDER", "providerA")
-        try:
+    provider_id = decision["provider"]
+
+    # Call provider to authorize
+    try:
+        with spans.span("authorize", "provider"):
             result = await provider_client.authorize(
-                provider_id=failover_id,
+                provider_id=provider_id,
                 payment_id=payment_id,
                 amount=payment["amount"],
                 currency=payment["currency"],
@@ -241,7 +240,28 @@ async def authorize_payment(
                 expiry=expiry,
                 merchant_id=x_merchant_id,
             )
+    except ProviderBusyError:
+        raise HTTPException(status_code=503, detail="Provider connections busy, retry later")
+    except ProviderUnavailableError:
+        # Try failover
+        failover_id = os.environ.get("FAILOVER_PROVIDER", "providerB")
+        if failover_id == provider_id:
+            failover_id = os.environ.get("DEFAULT_PROVIDER", "providerA")
+        try:
+            with spans.span("authorize", "provider_failover"):
+                result = await provider_client.authorize(
+                    provider_id=failover_id,
+                    payment_id=payment_id,
+                    amount=payment["amount"],
+                    currency=payment["currency"],
+                    pan=pan,
+                    expiry=expiry,
+                    merchant_id=x_merchant_id,
+                )
             provider_id = failover_id
+            decision["failover_to"] = failover_id
+        except ProviderBusyError:
+            raise HTTPException(status_code=503, detail="Provider connections busy, retry later")
         except Exception as e:
             raise HTTPException(status_code=502, detail=f"All providers failed: {e}")
     except ProviderError as e:
@@ -260,10 +280,12 @@ async def authorize_payment(
     payment["provider_ref"] = result.get("provider_ref")
     payment["updated_at"] = now
 
+    payment["metadata"]["routing"] = decision
     if not result.get("success"):
         payment["metadata"]["decline_reason"] = result.get("decline_reason")
 
-    _save_payment(payment)
+    with spans.span("authorize", "save_payment"):
+        _save_payment(payment)
 
     # Write ledger entry
     event_type = "payment.authorized" if result.get("success") else "payment.declined"
@@ -277,12 +299,14 @@ async def authorize_payment(
         correlation_id=get_correlation_id(),
         metadata=payment,
     )
-    ledger.write_entry(entry)
-    ledger.emit_outbox_event(event_type, payment)
+    with spans.span("authorize", "ledger"):
+        ledger.write_entry(entry)
+        ledger.emit_outbox_event(event_type, payment)
 
     logger.info(f"Payment {payment_id} -> {new_state} via {provider_id}")
 
-    idempotency.store(idempotency_key, request_hash, payment, 200)
+    with spans.span("authorize", "idempotency_store"):
+        idempotency.store(idempotency_key, request_hash, payment, 200)
     return payment
 
 
@@ -298,13 +322,17 @@ async def capture_payment(
         "payment_id": payment_id,
     })
     try:
-        cached = idempotency.check(idempotency_key, request_hash)
+        with spans.span("capture", "idempotency_check"):
+            cached = await idempotency.check(idempotency_key, request_hash)
         if cached:
             return JSONResponse(cached.response, status_code=cached.status_code)
     except IdempotencyConflictError as e:
         raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
-    payment = _get_payment(payment_id)
+    with spans.span("capture", "load_payment"):
+        payment = _get_payment(payment_id)
 
     try:
         validate_payment_transition(payment["state"], PaymentState.CAPTURED.value)
@@ -317,19 +345,23 @@ async def capture_payment(
         raise HTTPException(status_code=400, detail="Payment not yet authorized with a provider")
 
     try:
-        result = await provider_client.capture(
-            provider_id=provider_id,
-            payment_id=payment_id,
-            provider_ref=provider_ref,
-            amount=payment["amount"],
-        )
+        with spans.span("capture", "provider"):
+            result = await provider_client.capture(
+                provider_id=provider_id,
+                payment_id=payment_id,
+                provider_ref=provider_ref,
+                amount=payment["amount"],
+            )
+    except ProviderBusyError:
+        raise HTTPException(status_code=503, detail="Provider connections busy, retry later")
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"Capture failed: {e}")
 
     now = datetime.utcnow().isoformat()
     payment["state"] = PaymentState.CAPTURED.value
     payment["updated_at"] = now
-    _save_payment(payment)
+    with spans.span("capture", "save_payment"):
+        _save_payment(payment)
 
     entry = LedgerEntry(
         type="payment.captured",
@@ -341,12 +373,14 @@ async def capture_payment(
         correlation_id=get_correlation_id(),
         metadata=payment,
     )
-    ledger.write_entry(entry)
-    ledger.emit_outbox_event("payment.captured", payment)
+    with spans.span("capture", "ledger"):
+        ledger.write_entry(entry)
+        ledger.emit_outbox_event("payment.captured", payment)
 
     logger.info(f"Captured payment {payment_id}")
 
-    idempotency.store(idempotency_key, request_hash, payment, 200)
+    with spans.span("capture", "idempotency_store"):
+        idempotency.store(idempotency_key, request_hash, payment, 200)
     return payment
 
 
@@ -362,11 +396,13 @@ async def cancel_payment(
         "payment_id": payment_id,
     })
     try:
-        cached = idempotency.check(idempotency_key, request_hash)
+        cached = await idempotency.check(idempotency_key, request_hash)
         if cached:
             return JSONResponse(cached.response, status_code=cached.status_code)
     except IdempotencyConflictError as e:
         raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
     payment = _get_payment(payment_id)
 
@@ -1,49 +1,41 @@
 """Refunds router - maker-checker workflow with approval chain."""
 
-import os
 import logging
 from datetime import datetime
 from typing import Optional
 
-from fastapi import APIRouter, HTTPException, Header, Query
+from fastapi import APIRouter, Depends, HTTPException, Header, Query
 from fastapi.responses import JSONResponse
 
 from shared.models import Refund, RefundState, LedgerEntry
-from shared.file_store import FileStore
 from shared.correlation import get_correlation_id
+from shared.spans import spans
 from models.requests import CreateRefundRequest
 from services.ledger import LedgerService
-from services.provider_client import ProviderClient
+from services.provider_client import ProviderClient, ProviderBusyError
 from services.state_machine import validate_refund_transition, InvalidTransitionError
-from services.idempotency import IdempotencyService, IdempotencyConflictError
+from services.idempotency import (
+    IdempotencyService, IdempotencyConflictError, IdempotencyInProgressError, idempotency_scope,
+)
+from services.stores import payments_store, refunds_store
 
 logger = logging.getLogger("payrail.refunds")
-router = APIRouter()
-
-DATA_DIR = os.environ.get("DATA_DIR", "/app/data")
-REFUNDS_STORE = os.path.join(DATA_DIR, "idempotency", "refunds_store.json")
-PAYMENTS_STORE = os.path.join(DATA_DIR, "idempotency", "payments_store.json")
+router = APIRouter(dependencies=[Depends(idempotency_scope)])
 
 ledger = LedgerService()
 provider_client = ProviderClient()
 idempotency = IdempotencyService()
 
 
-def _load_refunds() -> dict:
-    return FileStore.read_json(REFUNDS_STORE, default={})
-
-
 def _save_refund(refund: dict):
-    refunds = _load_refunds()
-    refunds[refund["id"]] = refund
-    FileStore.write_json(REFUNDS_STORE, refunds)
+    refunds_store.put(refund["id"], refund)
 
 
 def _get_refund(refund_id: str) -> dict:
-    refunds = _load_refunds()
-    if refund_id not in refunds:
+    refund = refunds_store.get(refund_id)
+    if refund is None:
         raise HTTPException(status_code=404, detail=f"Refund {refund_id} not found")
-    return refunds[refund_id]
+    return refund
 
 
 @router.post("", status_code=201)
@@ -58,15 +50,16 @@ async def create_refund(
         **req.model_dump(),
     })
     try:
-        cached = idempotency.check(idempotency_key, request_hash)
+        cached = await idempotency.check(idempotency_key, request_hash)
         if cached:
             return JSONResponse(cached.response, status_code=cached.status_code)
     except IdempotencyConflictError as e:
         raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
     # Verify payment exists and is captured/settled
-    payments = FileStore.read_json(PAYMENTS_STORE, default={})
-    payment = payments.get(req.payment_id)
+    payment = payments_store.get(req.payment_id)
     if not payment:
         raise HTTPException(status_code=404, detail=f"Payment {req.payment_id} not found")
     if payment["state"] not in ("captured", "settled"):
@@ -116,8 +109,7 @@ async def list_refunds(
     limit: int = Query(50, le=200),
     offset: int = Query(0, ge=0),
 ):
-    refunds = _load_refunds()
-    items = list(refunds.values())
+    items = refunds_store.values()
 
     if state:
         items = [r for r in items if r.get("state") == state]
@@ -153,13 +145,17 @@ async def approve_refund(
         "role": x_role,
     })
     try:
-        cached = idempotency.check(idempotency_key, request_hash)
+        with spans.span("refund_approve", "idempotency_check"):
+            cached = await idempotency.check(idempotency_key, request_hash)
         if cached:
             return JSONResponse(cached.response, status_code=cached.status_code)
     except IdempotencyConflictError as e:
         raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
-    refund = _get_refund(refund_id)
+    with spans.span("refund_approve", "load_refund"):
+        refund = _get_refund(refund_id)
 
     # Maker-checker: approver must be different from requester
     if refund.get("requested_by") == x_merchant_id and x_role != "admin":
@@ -179,21 +175,25 @@ async def approve_refund(
     refund["updated_at"] = now
 
     # Process the refund via provider
-    payments = FileStore.read_json(PAYMENTS_STORE, default={})
-    payment = payments.get(refund["payment_id"])
+    with spans.span("refund_approve", "load_payment"):
+        payment = payments_store.get(refund["payment_id"])
 
     if payment and payment.get("provider") and payment.get("provider_ref"):
         try:
-            result = await provider_client.refund(
-                provider_id=payment["provider"],
-                payment_id=refund["payment_id"],
-                provider_ref=payment["provider_ref"],
-                amount=refund["amount"],
-            )
+            with spans.span("refund_approve", "provider"):
+                result = await provider_client.refund(
+                    provider_id=payment["provider"],
+                    payment_id=refund["payment_id"],
+                    provider_ref=payment["provider_ref"],
+                    amount=refund["amount"],
+                )
             if result.get("success"):
                 refund["state"] = RefundState.SUCCEEDED.value
             else:
                 refund["state"] = RefundState.FAILED.value
+        except ProviderBusyError:
+            # Local overload: leave the refund pending so the approval can be retried
+            raise HTTPException(status_code=503, detail="Provider connections busy, retry later")
         except Exception as e:
             logger.error(f"Provider refund failed: {e}")
             refund["state"] = RefundState.FAILED.value
@@ -201,7 +201,8 @@ async def approve_refund(
         refund["state"] = RefundState.SUCCEEDED.value
 
     refund["updated_at"] = datetime.utcnow().isoformat()
-    _save_refund(refund)
+    with spans.span("refund_approve", "save_refund"):
+        _save_refund(refund)
 
     entry = LedgerEntry(
         type=f"refund.{refund['state']}",
@@ -213,12 +214,14 @@ async def approve_refund(
         correlation_id=get_correlation_id(),
         metadata=refund,
     )
-    ledger.write_entry(entry)
-    ledger.emit_outbox_event(f"refund.{refund['state']}", refund)
+    with spans.span("refund_approve", "ledger"):
+        ledger.write_entry(entry)
+        ledger.emit_outbox_event(f"refund.{refund['state']}", refund)
 
     logger.info(f"Refund {refund_id} -> {refund['state']}")
 
-    idempotency.store(idempotency_key, request_hash, refund, 200)
+    with spans.span("refund_approve", "idempotency_store"):
+        idempotency.store(idempotency_key, request_hash, refund, 200)
     return refund
 
 
@@ -235,11 +238,13 @@ async def reject_refund(
         "merchant_id": x_merchant_id,
     })
     try:
-        cached = idempotency.check(idempotency_key, request_hash)
+        cached = await idempotency.check(idempotency_key, request_hash)
         if cached:
             return JSONResponse(cached.response, status_code=cached.status_code)
     except IdempotencyConflictError as e:
         raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
     refund = _get_refund(refund_id)
 
@@ -12,6 +12,7 @@ from fastapi import APIRouter, HTTPException, Request, Header
 from shared.file_store import FileStore
 from shared.correlation import get_correlation_id, set_correlation_id
 from services.ledger import LedgerService
+from services.stores import payments_store
 from shared.models import LedgerEntry
 
 logger = logging.getLogger("payrail.webhooks")
@@ -19,7 +20,6 @@ router = APIRouter()
 
 DATA_DIR = os.environ.get("DATA_DIR", "/app/data")
 WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "whsec_payrail_demo_secret_key_2026")
-PAYMENTS_STORE = os.path.join(DATA_DIR, "idempotency", "payments_store.json")
 PROCESSED_WEBHOOKS = os.path.join(DATA_DIR, "outbox", "processed_webhooks.json")
 
 ledger = LedgerService()
@@ -63,29 +63,25 @@ async def receive_webhook(
     # Process based on event type
     payment_id = data.get("payment_id")
     if payment_id:
-        payments = FileStore.read_json(PAYMENTS_STORE, default={})
-        payment = payments.get(payment_id)
+        payment = payments_store.get(payment_id)
 
         if payment:
             if event_type == "payment.authorized" and payment["state"] == "created":
                 payment["state"] = "authorized"
                 payment["provider_ref"] = data.get("provider_ref")
                 payment["updated_at"] = datetime.utcnow().isoformat()
-                payments[payment_id] = payment
-                FileStore.write_json(PAYMENTS_STORE, payments)
+                payments_store.put(payment_id, payment)
 
             elif event_type == "payment.captured" and payment["state"] == "authorized":
                 payment["state"] = "captured"
                 payment["updated_at"] = datetime.utcnow().isoformat()
-                payments[payment_id] = payment
-                FileStore.write_json(PAYMENTS_STORE, payments)
+                payments_store.put(payment_id, payment)
 
             elif event_type == "payment.declined" and payment["state"] == "created":
                 payment["state"] = "declined"
                 payment["updated_at"] = datetime.utcnow().isoformat()
                 payment.setdefault("metadata", {})["decline_reason"] = data.get("decline_reason")
-                payments[payment_id] = payment
-                FileStore.write_json(PAYMENTS_STORE, payments)
+                payments_store.put(payment_id, payment)
 
             elif event_type == "payment.refunded":
                 logger.info(f"Webhook: payment {payment_id} refunded")
@@ -1,11 +1,263 @@
-"""File-backed circuit breaker for provider failover."""
+"""Shared-memory circuit breaker for provider failover.
+
+Breaker state lives in an mmap-backed table shared by every worker process.
+Reads are lock-free (seqlock); writes take a brief flock on the table. The
+per-provider JSON file is only written on state transitions and at most once
+per CB_PERSIST_INTERVAL otherwise, and seeds the table after a restart.
+
+Every slot also carries a rolling window of time buckets with outcome counts
+and a latency histogram. With CB_MODE=sliding_window the breaker trips on the
+window's error rate or p95/p99 latency instead of consecutive failures.
+"""
 
 import os
-from datetime import datetime, timedelta
+import mmap
+import time
+import fcntl
+import struct
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Optional
 from shared.file_store import FileStore
 from shared.models import CircuitState
 
+logger = logging.getLogger("payrail.circuit_breaker")
+
 DATA_DIR = os.environ.get("DATA_DIR", "/app/data")
+_DEFAULT_SHM = "/dev/shm/payrail_circuit_breakers" if os.path.isdir("/dev/shm") \
+    else os.path.join(DATA_DIR, "providers", "circuit_breakers.shm")
+CB_SHM_PATH = os.environ.get("CB_SHM_PATH", _DEFAULT_SHM)
+CB_PERSIST_INTERVAL = float(os.environ.get("CB_PERSIST_INTERVAL", 10))
+CB_WINDOW_SECONDS = int(os.environ.get("CB_WINDOW_SECONDS", 60))
+CB_WINDOW_BUCKETS = int(os.environ.get("CB_WINDOW_BUCKETS", 12))
+_BUCKET_SECONDS = max(CB_WINDOW_SECONDS / CB_WINDOW_BUCKETS, 0.001)
+# Optimistic read attempts before falling back to the table lock
+CB_READ_SPINS = int(os.environ.get("CB_READ_SPINS", 1000))
+
+_STATES = [CircuitState.CLOSED.value, CircuitState.OPEN.value, CircuitState.HALF_OPEN.value]
+
+_TRIP_REASONS = ["", "consecutive_failures", "error_rate", "p95_latency", "p99_latency", "half_open_probe"]
+
+# Header: magic, layout version, slot count, window buckets per slot
+_HEADER = struct.Struct("<4sIII")
+_MAGIC = b"PRCB"
+_VERSION = 3
+_MAX_SLOTS = 64
+# Slot: seq, provider_id, circuit_state, trip_reason, failure_count,
+# success_count, half_open_calls, total_requests, last_failure_at,
+# last_success_at, opened_at, persisted_at (epoch seconds, 0 = unset)
+_SLOT = struct.Struct("<I32sBBIIIIdddd")
+_FIELDS = ("circuit_state", "trip_reason", "failure_count", "success_count", "half_open_calls",
+           "total_requests", "last_failure_at", "last_success_at", "opened_at", "persisted_at")
+_TIME_FIELDS = ("last_failure_at", "last_success_at", "opened_at")
+
+# Latency histogram upper bounds; the extra last bin counts anything slower
+_LATENCY_BOUNDS_MS = (5, 10, 25, 50, 75, 100, 150, 200, 300, 500, 750, 1000, 2000, 5000, 10000)
+# Window bucket: bucket epoch (now // bucket seconds), successes, failures, latency bins.
+# The epoch is 64-bit: with sub-second buckets it passes 2**32 within the current era.
+_BUCKET = struct.Struct(f"<QII{len(_LATENCY_BOUNDS_MS) + 1}I")
+
+
+def _to_iso(ts: float) -> Optional[str]:
+    if not ts:
+        return None
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None).isoformat()
+
+
+def _from_iso(value: Optional[str]) -> float:
+    if not value:
+        return 0.0
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+
+def _observe(window: list[list[int]], now: float, ok: bool, latency_ms: Optional[float]):
+    epoch = int(now // _BUCKET_SECONDS)
+    bucket = window[epoch % len(window)]
+    if bucket[0] != epoch:
+        bucket[:] = [epoch] + [0] * (len(bucket) - 1)
+    bucket[1 if ok else 2] += 1
+    if latency_ms is not None:
+        bucket[3 + bisect_left(_LATENCY_BOUNDS_MS, latency_ms)] += 1
+
+
+def _clear(window: list[list[int]]):
+    for bucket in window:
+        bucket[:] = [0] * len(bucket)
+
+
+def _hist_percentile(hist: list[int], pct: float) -> Optional[int]:
+    """Upper bound of the histogram bin holding the pct-th sample (nearest rank)."""
+    total = sum(hist)
+    if not total:
+        return None
+    rank = max(1, -(-total * pct // 100))
+    seen = 0
+    for i, count in enumerate(hist):
+        seen += count
+        if seen >= rank:
+            return _LATENCY_BOUNDS_MS[min(i, len(_LATENCY_BOUNDS_MS) - 1)]
+    return _LATENCY_BOUNDS_MS[-1]
+
+
+def _window_stats(window: list[list[int]], now: float) -> dict:
+    epoch = int(now // _BUCKET_SECONDS)
+    live = [b for b in window if epoch - len(window) < b[0] <= epoch]
+    successes = sum(b[1] for b in live)
+    errors = sum(b[2] for b in live)
+    hist = [sum(col) for col in zip(*(b[3:] for b in live))] or [0] * (len(_LATENCY_BOUNDS_MS) + 1)
+    requests = successes + errors
+    return {
+        "window_seconds": CB_WINDOW_SECONDS,
+        "buckets": len(live),
+        "requests": requests,
+        "errors": errors,
+        "error_rate": round(errors / requests, 4) if requests else 0.0,
+        "p50_ms": _hist_percentile(hist, 50),
+        "p95_ms": _hist_percentile(hist, 95),
+        "p99_ms": _hist_percentile(hist, 99),
+    }
+
+
+class SharedBreakerTable:
+
+    def __init__(self, path: str, slots: int = _MAX_SLOTS, buckets: int = CB_WINDOW_BUCKETS):
+        self.path = path
+        self.slots = slots
+        self.buckets = buckets
+        self.stride = _SLOT.size + buckets * _BUCKET.size
+        self.size = _HEADER.size + slots * self.stride
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._pid = os.getpid()
+        with self._flock():
+            if os.fstat(self._fd).st_size != self.size:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self.size)
+            self._mm = mmap.mmap(self._fd, self.size)
+            layout = (_MAGIC, _VERSION, slots, buckets)
+            if _HEADER.unpack_from(self._mm, 0) != layout:
+                self._mm[:] = bytes(self.size)
+                _HEADER.pack_into(self._mm, 0, *layout)
+        self._slot_of: dict[str, int] = {}
+
+    @contextmanager
+    def _flock(self):
+        if os.getpid() != self._pid:
+            # flock is per open file description, which a forked child shares
+            # with its parent; take locks through a descriptor of our own.
+            self._fd = os.open(self.path, os.O_RDWR)
+            self._pid = os.getpid()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _offset(self, slot: int) -> int:
+        return _HEADER.size + slot * self.stride
+
+    def _unpack(self, slot: int) -> tuple:
+        return _SLOT.unpack_from(self._mm, self._offset(slot))
+
+    def slot_for(self, provider_id: str, load_seed: Callable[[], dict]) -> int:
+        """Find the provider's slot, claiming and seeding a free one if needed."""
+        if provider_id in self._slot_of:
+            return self._slot_of[provider_id]
+        key = provider_id.encode()[:32]
+        with self._flock():
+            free = None
+            for slot in range(self.slots):
+                name = self._unpack(slot)[1].rstrip(b"\0")
+                if name == key:
+                    self._slot_of[provider_id] = slot
+                    return slot
+                if not name and free is None:
+                    free = slot
+            if free is None:
+                raise RuntimeError(f"Circuit breaker table {self.path} is full")
+            self._write(free, key, load_seed())
+            self._slot_of[provider_id] = free
+            return free
+
+    def _unpack_window(self, slot: int) -> list[list[int]]:
+        base = self._offset(slot) + _SLOT.size
+        return [list(_BUCKET.unpack_from(self._mm, base + i * _BUCKET.size)) for i in range(self.buckets)]
+
+    def read(self, slot: int, window: bool = False) -> dict:
+        """Lock-free consistent read; retries while a writer is mid-update.
+
+        After CB_READ_SPINS attempts it takes the table lock instead: a seq
+        that stays odd means a writer died mid-update, which only a locked
+        read can repair.
+        """
+        for _ in range(CB_READ_SPINS):
+            values = self._unpack(slot)
+            buckets = self._unpack_window(slot) if window else None
+            if values[0] % 2 == 0 and struct.unpack_from("<I", self._mm, self._offset(slot))[0] == values[0]:
+                return self._decode(values, buckets)
+        with self._flock():
+            return self._read_locked(slot, window)
+
+    def _read_locked(self, slot: int, window: bool = False) -> dict:
+        """Read with the table lock held. No writer can be active, so an odd seq is a torn write."""
+        values = self._unpack(slot)
+        buckets = self._unpack_window(slot) if window else None
+        if values[0] % 2:
+            logger.warning(f"Circuit breaker slot {slot} was left mid-write; repairing it")
+            state = self._decode(values, buckets if window else self._unpack_window(slot))
+            self._write(slot, values[1], state, seq=values[0] + 1)
+            values = self._unpack(slot)
+        return self._decode(values, buckets)
+
+    @staticmethod
+    def _decode(values: tuple, buckets: Optional[list]) -> dict:
+        state = dict(zip(_FIELDS, values[2:]))
+        # A torn write can leave out-of-range enum bytes; treat them as the defaults
+        circuit_state, trip_reason = state["circuit_state"], state["trip_reason"]
+        state["circuit_state"] = _STATES[circuit_state] if circuit_state < len(_STATES) else _STATES[0]
+        state["trip_reason"] = _TRIP_REASONS[trip_reason] if trip_reason < len(_TRIP_REASONS) else ""
+        if buckets is not None:
+            state["window"] = buckets
+        return state
+
+    @contextmanager
+    def update(self, slot: int):
+        """Yield the slot state for mutation under the table lock, then publish it."""
+        with self._flock():
+            state = self._read_locked(slot, window=True)
+            yield state
+            name = self._unpack(slot)[1]
+            self._write(slot, name, state)
+
+    def _write(self, slot: int, name: bytes, state: dict, seq: Optional[int] = None):
+        """Publish a slot; caller holds the table lock. seq overrides the current (even) sequence."""
+        offset = self._offset(slot)
+        if seq is None:
+            seq = struct.unpack_from("<I", self._mm, offset)[0]
+        writing = (seq + 1) & 0xFFFFFFFF  # Odd: write in progress
+        struct.pack_into("<I", self._mm, offset, writing)
+        _SLOT.pack_into(
+            self._mm, offset, writing, name,
+            _STATES.index(state.get("circuit_state", CircuitState.CLOSED.value)),
+            _TRIP_REASONS.index(state.get("trip_reason") or ""),
+            *(state.get(f, 0) or 0 for f in _FIELDS[2:]),
+        )
+        base = offset + _SLOT.size
+        for i, bucket in enumerate(state.get("window") or []):
+            _BUCKET.pack_into(self._mm, base + i * _BUCKET.size, *bucket)
+        struct.pack_into("<I", self._mm, offset, (seq + 2) & 0xFFFFFFFF)
+
+
+_table: Optional[SharedBreakerTable] = None
+
+
+def _get_table() -> SharedBreakerTable:
+    global _table
+    if _table is None:
+        _table = SharedBreakerTable(CB_SHM_PATH)
+    return _table
 
 
 class ProviderUnavailableError(Exception):
@@ -19,83 +271,151 @@ class CircuitBreaker:
     def __init__(self, provider_id: str):
         self.provider_id = provider_id
         self.state_path = os.path.join(DATA_DIR, "providers", f"{provider_id}_state.json")
+        self.mode = os.environ.get("CB_MODE", "consecutive")
         self.failure_threshold = int(os.environ.get("CB_FAILURE_THRESHOLD", 5))
         self.recovery_timeout = int(os.environ.get("CB_RECOVERY_TIMEOUT", 30))
         self.half_open_max = int(os.environ.get("CB_HALF_OPEN_MAX_CALLS", 3))
+        # Sliding-window mode thresholds; a latency threshold of 0 disables it
+        self.min_requests = int(os.environ.get("CB_MIN_REQUESTS", 20))
+        self.error_rate_threshold = float(os.environ.get("CB_ERROR_RATE_THRESHOLD", 0.5))
+        self.p95_threshold_ms = float(os.environ.get("CB_P95_THRESHOLD_MS", 0))
+        self.p99_threshold_ms = float(os.environ.get("CB_P99_THRESHOLD_MS", 0))
+        self.probe_max_latency_ms = float(os.environ.get(
+            "CB_HALF_OPEN_MAX_LATENCY_MS", self.p99_threshold_ms or self.p95_threshold_ms))
+        self._table = _get_table()
+        self._slot = self._table.slot_for(provider_id, self._load_persisted)
+
+    @property
+    def sliding_window(self) -> bool:
+        return self.mode == "sliding_window"
+
+    def _load_persisted(self) -> dict:
+        state = FileStore.read_json(self.state_path, default={})
+        seed = {f: state.get(f, 0) or 0 for f in _FIELDS if f not in _TIME_FIELDS}
+        seed["circuit_state"] = state.get("circuit_state", CircuitState.CLOSED.value)
+        seed["trip_reason"] = state.get("trip_reason") if state.get("trip_reason") in _TRIP_REASONS else ""
+        for f in _TIME_FIELDS:
+            seed[f] = _from_iso(state.get(f))
+        return seed
+
+    def _persist(self, state: dict):
+        FileStore.write_json(self.state_path, self._as_document(state))
+
+    def _as_document(self, state: dict) -> dict:
+        doc = {"provider_id": self.provider_id}
+        for f in _FIELDS:
+            if f == "persisted_at":
+                continue
+            doc[f] = _to_iso(state[f]) if f in _TIME_FIELDS else state[f]
+        doc["trip_reason"] = state["trip_reason"] or None
+        return doc
 
-    def _read_state(self) -> dict:
-        return FileStore.read_json(self.state_path, default={
-            "provider_id": self.provider_id,
-            "circuit_state": CircuitState.CLOSED.value,
-            "failure_count": 0,
-            "success_count": 0,
-            "half_open_calls": 0,
-        })
+    @contextmanager
+    def _mutate(self):
+        """Update shared state; persist on transitions or when the snapshot is stale."""
+        with self._table.update(self._slot) as state:
+            before = state["circuit_state"]
+            yield state
+            now = time.time()
+            persist = state["circuit_state"] != before or now - state["persisted_at"] >= CB_PERSIST_INTERVAL
+            if persist:
+                state["persisted_at"] = now
+        if persist:
+            self._persist(state)
 
-    def _write_state(self, state: dict):
-        FileStore.write_json(self.state_path, state)
+    def _open(self, state: dict, reason: str):
+        state["circuit_state"] = CircuitState.OPEN.value
+        state["opened_at"] = time.time()
+        state["half_open_calls"] = 0
+        state["trip_reason"] = reason
+        logger.warning(f"Circuit for {self.provider_id} opened: {reason}")
+
+    def _window_trip_reason(self, stats: dict) -> str:
+        if stats["requests"] < self.min_requests:
+            return ""
+        if stats["error_rate"] >= self.error_rate_threshold:
+            return "error_rate"
+        if self.p99_threshold_ms and (stats["p99_ms"] or 0) > self.p99_threshold_ms:
+            return "p99_latency"
+        if self.p95_threshold_ms and (stats["p95_ms"] or 0) > self.p95_threshold_ms:
+            return "p95_latency"
+        return ""
 
     def can_execute(self) -> bool:
-        state = self._read_state()
-        circuit = state.get("circuit_state", CircuitState.CLOSED.value)
+        state = self._table.read(self._slot)
+        circuit = state["circuit_state"]
 
         if circuit == CircuitState.CLOSED.value:
             return True
 
         if circuit == CircuitState.OPEN.value:
-            opened_at = state.get("opened_at")
-            if opened_at:
-                opened = datetime.fromisoformat(opened_at)
-                if datetime.utcnow() - opened > timedelta(seconds=self.recovery_timeout):
-                    # Transition to half-open
-                    state["circuit_state"] = CircuitState.HALF_OPEN.value
-                    state["half_open_calls"] = 0
-                    self._write_state(state)
-                    return True
-            return False
-
-        if circuit == CircuitState.HALF_OPEN.value:
-            if state.get("half_open_calls", 0) < self.half_open_max:
+            if state["opened_at"] and time.time() - state["opened_at"] > self.recovery_timeout:
+                # Transition to half-open
+                with self._mutate() as state:
+                    if state["circuit_state"] == CircuitState.OPEN.value:
+                        state["circuit_state"] = CircuitState.HALF_OPEN.value
+                        state["half_open_calls"] = 0
                 return True
             return False
 
-        return True
-
-    def record_success(self):
-        state = self._read_state()
-        circuit = state.get("circuit_state", CircuitState.CLOSED.value)
-
-        state["success_count"] = state.get("success_count", 0) + 1
-        state["last_success_at"] = datetime.utcnow().isoformat()
-
         if circuit == CircuitState.HALF_OPEN.value:
-            state["half_open_calls"] = state.get("half_open_calls", 0) + 1
-            if state["half_open_calls"] >= self.half_open_max:
-                # Close the circuit
-                state["circuit_state"] = CircuitState.CLOSED.value
-                state["failure_count"] = 0
-                state["half_open_calls"] = 0
+            return state["half_open_calls"] < self.half_open_max
 
-        self._write_state(state)
+        return True
 
-    def record_failure(self):
-        state = self._read_state()
-        circuit = state.get("circuit_state", CircuitState.CLOSED.value)
+    def record_success(self, latency_ms: Optional[float] = None):
+        with self._mutate() as state:
+            now = time.time()
+            state["success_count"] += 1
+            state["total_requests"] += 1
+            state["last_success_at"] = now
+            _observe(state["window"], now, True, latency_ms)
 
-        state["failure_count"] = state.get("failure_count", 0) + 1
-        state["last_failure_at"] = datetime.utcnow().isoformat()
+            if state["circuit_state"] == CircuitState.HALF_OPEN.value:
+                if (self.sliding_window and self.probe_max_latency_ms
+                        and latency_ms is not None and latency_ms > self.probe_max_latency_ms):
+                    # A slow probe means the provider has not recovered
+                    self._open(state, "half_open_probe")
+                    return
+                state["half_open_calls"] += 1
+                if state["half_open_calls"] >= self.half_open_max:
+                    # Close the circuit
+                    state["circuit_state"] = CircuitState.CLOSED.value
+                    state["failure_count"] = 0
+                    state["half_open_calls"] = 0
+                    state["trip_reason"] = ""
+                    if self.sliding_window:
+                        # Start the window afresh so pre-trip samples cannot re-trip it
+                        _clear(state["window"])
+            elif state["circuit_state"] == CircuitState.CLOSED.value and self.sliding_window:
+                reason = self._window_trip_reason(_window_stats(state["window"], now))
+                if reason:
+                    self._open(state, reason)
 
-        if circuit == CircuitState.HALF_OPEN.value:
-            # Immediately re-open
-            state["circuit_state"] = CircuitState.OPEN.value
-            state["opened_at"] = datetime.utcnow().isoformat()
-            state["half_open_calls"] = 0
-        elif circuit == CircuitState.CLOSED.value:
-            if state["failure_count"] >= self.failure_threshold:
-                state["circuit_state"] = CircuitState.OPEN.value
-                state["opened_at"] = datetime.utcnow().isoformat()
+    def record_failure(self, latency_ms: Optional[float] = None):
+        with self._mutate() as state:
+            now = time.time()
+            state["failure_count"] += 1
+            state["total_requests"] += 1
+            state["last_failure_at"] = now
+            _observe(state["window"], now, False, latency_ms)
 
-        self._write_state(state)
+            if state["circuit_state"] == CircuitState.HALF_OPEN.value:
+                # Immediately re-open
+                self._open(state, "half_open_probe")
+            elif state["circuit_state"] == CircuitState.CLOSED.value:
+                if self.sliding_window:
+                    reason = self._window_trip_reason(_window_stats(state["window"], now))
+                elif state["failure_count"] >= self.failure_threshold:
+                    reason = "consecutive_failures"
+                else:
+                    reason = ""
+                if reason:
+                    self._open(state, reason)
 
     def get_state(self) -> dict:
-        return self._read_state()
+        return self._as_document(self._table.read(self._slot))
+
+    def get_window_stats(self) -> dict:
+        state = self._table.read(self._slot, window=True)
+        return {"mode": self.mode, **_window_stats(state["window"], time.time())}
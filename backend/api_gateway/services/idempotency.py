@@ -1,27 +1,182 @@
 """Idempotency key management - prevents duplicate payment processing."""
 
 import os
+import time
+import fcntl
+import asyncio
 import hashlib
 import json
-from datetime import datetime, timedelta
+import logging
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
 from typing import Optional
-from shared.file_store import FileStore
+from filelock import FileLock
+from shared.ttl_store import ShardedTTLStore
+
+logger = logging.getLogger("payrail.idempotency")
 
 DATA_DIR = os.environ.get("DATA_DIR", "/app/data")
-KEYS_PATH = os.path.join(DATA_DIR, "idempotency", "idempotency_keys.json")
-TTL_HOURS = 24
+KEYS_DIR = os.path.join(DATA_DIR, "idempotency", "keys")
+LEGACY_KEYS_PATH = os.path.join(DATA_DIR, "idempotency", "idempotency_keys.json")
+TTL_HOURS = int(os.environ.get("IDEMPOTENCY_TTL_HOURS", 24))
+IDEMPOTENCY_SHARDS = int(os.environ.get("IDEMPOTENCY_SHARDS", 16))
+IDEMPOTENCY_BUCKET_MINUTES = int(os.environ.get("IDEMPOTENCY_BUCKET_MINUTES", 60))
+IDEMPOTENCY_EVICT_INTERVAL = float(os.environ.get("IDEMPOTENCY_EVICT_INTERVAL", 300))
+INFLIGHT_DIR = os.path.join(DATA_DIR, "idempotency", "inflight")
+# How long a duplicate waits for the in-flight original before giving up
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.environ.get("IDEMPOTENCY_WAIT_TIMEOUT", 30))
+IDEMPOTENCY_POLL_INTERVAL = float(os.environ.get("IDEMPOTENCY_POLL_INTERVAL", 0.02))
 
 
 class IdempotencyConflictError(Exception):
     pass
 
 
+class IdempotencyInProgressError(Exception):
+    pass
+
+
 class CachedResponse:
     def __init__(self, response: dict, status_code: int):
         self.response = response
         self.status_code = status_code
 
 
+def _open_key_store() -> ShardedTTLStore:
+    store = ShardedTTLStore(
+        KEYS_DIR,
+        shards=IDEMPOTENCY_SHARDS,
+        bucket_seconds=IDEMPOTENCY_BUCKET_MINUTES * 60,
+        ttl_seconds=TTL_HOURS * 3600,
+    )
+    _migrate_legacy(store)
+    return store
+
+
+def _migrate_legacy(store: ShardedTTLStore):
+    """Import unexpired keys from the single-file store, then move it aside."""
+    if not os.path.exists(LEGACY_KEYS_PATH):
+        return
+    with FileLock(f"{LEGACY_KEYS_PATH}.lock"):
+        if not os.path.exists(LEGACY_KEYS_PATH):
+            return
+        with open(LEGACY_KEYS_PATH, "r") as f:
+            keys = json.load(f)
+        cutoff = datetime.utcnow() - timedelta(hours=TTL_HOURS)
+        migrated = 0
+        for key, stored in keys.items():
+            created = datetime.fromisoformat(stored["created_at"])
+            if created > cutoff:
+                store.put(key, stored, created_ts=created.replace(tzinfo=timezone.utc).timestamp())
+                migrated += 1
+        os.replace(LEGACY_KEYS_PATH, f"{LEGACY_KEYS_PATH}.migrated")
+    logger.info(f"Migrated {migrated} of {len(keys)} idempotency keys to {KEYS_DIR}")
+
+
+# Shared by every router in the process
+key_store = _open_key_store()
+
+
+async def run_eviction_loop():
+    """Drop expired key buckets in the background; every worker may run this."""
+    while True:
+        try:
+            key_store.evict()
+        except Exception as e:
+            logger.error(f"Idempotency key eviction failed: {e}")
+        await asyncio.sleep(IDEMPOTENCY_EVICT_INTERVAL)
+
+
+class _Flight:
+    """A request this worker is executing for an idempotency key."""
+
+    def __init__(self, key: str, request_hash: str, fd: int):
+        self.key = key
+        self.request_hash = request_hash
+        self.fd = fd
+        self.done = asyncio.get_running_loop().create_future()
+
+
+class InFlightRegistry:
+    """Single-flight claims per idempotency key, shared across worker processes.
+
+    A claim is an exclusive flock on inflight/<sha256(key)>.lock whose content
+    is the request hash, so other workers can tell a duplicate from a
+    conflicting reuse without waiting. The kernel drops the lock if the owner
+    dies. Duplicates in the owning worker wait on a future; duplicates in other
+    workers poll the key store until the result lands or the claim is freed.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._flights: dict[str, _Flight] = {}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{hashlib.sha256(key.encode()).hexdigest()}.lock")
+
+    def local(self, key: str) -> Optional[_Flight]:
+        return self._flights.get(key)
+
+    def try_claim(self, key: str, request_hash: str) -> Optional[str]:
+        """Claim key for this request. Returns None on success, else the owner's request hash ("" if unknown)."""
+        path = self._path(key)
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                owner_hash = os.pread(fd, 64, 0).decode(errors="replace")
+                os.close(fd)
+                return owner_hash
+            try:
+                same_file = os.fstat(fd).st_ino == os.stat(path).st_ino
+            except FileNotFoundError:
+                same_file = False
+            if not same_file:
+                # The previous owner released and unlinked it between our open and lock
+                os.close(fd)
+                continue
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, request_hash.encode(), 0)
+            self._flights[key] = _Flight(key, request_hash, fd)
+            return None
+
+    def release(self, key: str) -> None:
+        flight = self._flights.pop(key, None)
+        if flight is None:
+            return
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+        fcntl.flock(flight.fd, fcntl.LOCK_UN)
+        os.close(flight.fd)
+        if not flight.done.done():
+            flight.done.set_result(None)
+
+    def count(self) -> int:
+        return len(self._flights)
+
+
+inflight = InFlightRegistry(INFLIGHT_DIR)
+
+# Keys claimed by the current request, released when it finishes
+_request_claims: ContextVar[Optional[list[str]]] = ContextVar("idempotency_claims", default=None)
+
+
+async def idempotency_scope():
+    """Router dependency that frees claims a request leaves behind (errors, early returns)."""
+    claims: list[str] = []
+    token = _request_claims.set(claims)
+    try:
+        yield
+    finally:
+        for key in claims:
+            inflight.release(key)
+        _request_claims.reset(token)
+
+
 class IdempotencyService:
 
     @staticmethod
@@ -29,12 +184,62 @@ class IdempotencyService:
         serialized = json.dumps(body, sort_keys=True, default=str)
         return hashlib.sha256(serialized.encode()).hexdigest()
 
-    def check(self, key: str, request_hash: str) -> Optional[CachedResponse]:
-        keys = FileStore.read_json(KEYS_PATH, default={})
-        if key not in keys:
+    async def check(self, key: str, request_hash: str) -> Optional[CachedResponse]:
+        """Return the cached response, or claim the key so this request executes it.
+
+        A duplicate of a request that is still running waits for it and then
+        gets its cached response; a different body under the same key fails
+        immediately.
+        """
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+        while True:
+            cached = self._lookup(key, request_hash)
+            if cached:
+                return cached
+
+            flight = inflight.local(key)
+            if flight is None:
+                owner_hash = inflight.try_claim(key, request_hash)
+                if owner_hash is None:
+                    # The previous owner (possibly on another worker) may have stored its
+                    # response and released between our lookup and the claim
+                    try:
+                        cached = self._lookup(key, request_hash)
+                    except Exception:
+                        inflight.release(key)
+                        raise
+                    if cached:
+                        inflight.release(key)
+                        return cached
+                    claims = _request_claims.get()
+                    if claims is not None:
+                        claims.append(key)
+                    return None
+            else:
+                owner_hash = flight.request_hash
+
+            if owner_hash and owner_hash != request_hash:
+                raise IdempotencyConflictError(
+                    f"Idempotency key '{key}' is in use by a request with a different body"
+                )
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise IdempotencyInProgressError(
+                    f"Request with idempotency key '{key}' is still in progress"
+                )
+            if flight is not None:
+                try:
+                    await asyncio.wait_for(asyncio.shield(flight.done), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(min(IDEMPOTENCY_POLL_INTERVAL, remaining))
+
+    def _lookup(self, key: str, request_hash: str) -> Optional[CachedResponse]:
+        stored = key_store.get(key)
+        if stored is None:
             return None
 
-        stored = keys[key]
         if stored["request_hash"] != request_hash:
             raise IdempotencyConflictError(
                 f"Idempotency key '{key}' already used with different request body"
@@ -52,11 +257,10 @@ class IdempotencyService:
         )
 
     def store(self, key: str, request_hash: str, response: dict, status_code: int) -> None:
-        keys = FileStore.read_json(KEYS_PATH, default={})
-        keys[key] = {
+        key_store.put(key, {
             "request_hash": request_hash,
             "response": response,
             "status_code": status_code,
             "created_at": datetime.utcnow().isoformat(),
-        }
-        FileStore.write_json(KEYS_PATH, keys)
+        })
+        inflight.release(key)
@@ -3,10 +3,22 @@
 import os
 from datetime import datetime
 from shared.file_store import FileStore
+from shared.ledger_index import LedgerIndex
 from shared.models import LedgerEntry, OutboxEvent
 from shared.correlation import get_correlation_id
 
 DATA_DIR = os.environ.get("DATA_DIR", "/app/data")
+LEDGER_DIR = os.path.join(DATA_DIR, "ledger")
+
+# One index per process, shared by every LedgerService instance
+ref_index = LedgerIndex(
+    os.path.join(LEDGER_DIR, "ref_index.jsonl"),
+    {
+        "payment": os.path.join(LEDGER_DIR, "payments.jsonl"),
+        "refund": os.path.join(LEDGER_DIR, "refunds.jsonl"),
+        "dispute": os.path.join(LEDGER_DIR, "disputes.jsonl"),
+    },
+)
 
 
 class LedgerService:
@@ -26,25 +38,18 @@ class LedgerService:
 
     def write_entry(self, entry: LedgerEntry) -> None:
         path = self._path_for_type(entry.type)
+        # The ref index picks this line up on the next lookup
         FileStore.append_jsonl(path, entry.model_dump())
 
     def get_entries_for_ref(self, ref_id: str) -> list[dict]:
-        all_entries = []
-        for path in [self.payments_path, self.refunds_path, self.disputes_path]:
-            entries = FileStore.read_jsonl(path)
-            all_entries.extend([e for e in entries if e.get("ref") == ref_id])
+        all_entries = ref_index.lookup(ref_id)
         return sorted(all_entries, key=lambda e: e.get("timestamp", ""))
 
     def get_current_state(self, ref_id: str, entity_type: str = "payment") -> dict | None:
-        if entity_type == "payment":
-            path = self.payments_path
-        elif entity_type == "refund":
-            path = self.refunds_path
-        else:
-            path = self.disputes_path
+        if entity_type not in ("payment", "refund"):
+            entity_type = "dispute"
 
-        entries = FileStore.read_jsonl(path)
-        ref_entries = [e for e in entries if e.get("ref") == ref_id]
+        ref_entries = ref_index.lookup(ref_id, files=[entity_type])
         if not ref_entries:
             return None
 
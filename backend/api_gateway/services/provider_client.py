@@ -1,16 +1,24 @@
 """HTTP client for calling provider-sim with circuit breaker integration."""
 
 import os
+import time
 import logging
 import httpx
+from typing import Optional
 from shared.correlation import get_correlation_id
+from shared.http_clients import http_clients
 from services.circuit_breaker import CircuitBreaker, ProviderUnavailableError
+from services.provider_stats import provider_stats
 
 logger = logging.getLogger("payrail.provider_client")
 
 PROVIDER_SIM_URL = os.environ.get("PROVIDER_SIM_URL", "http://provider-sim:8028")
 
 
+def _elapsed_ms(start: float) -> float:
+    return (time.perf_counter() - start) * 1000
+
+
 class ProviderError(Exception):
     def __init__(self, provider_id: str, detail: str):
         self.provider_id = provider_id
@@ -23,45 +31,64 @@ class ProviderTimeoutError(ProviderError):
         super().__init__(provider_id, "Request timed out")
 
 
+class ProviderBusyError(ProviderError):
+    """No pooled connection freed up in time: local overload, not a provider fault."""
+
+    def __init__(self, provider_id: str):
+        super().__init__(provider_id, "Connection pool exhausted")
+
+
 class ProviderClient:
 
+    def _record(self, cb: CircuitBreaker, ok: bool, start: float, approved: Optional[bool] = None):
+        latency_ms = _elapsed_ms(start)
+        if ok:
+            cb.record_success(latency_ms)
+        else:
+            cb.record_failure(latency_ms)
+        provider_stats.record(cb.provider_id, latency_ms, approved)
+
     async def authorize(self, provider_id: str, payment_id: str, amount: int,
                         currency: str, pan: str, expiry: str, merchant_id: str) -> dict:
         cb = CircuitBreaker(provider_id)
         if not cb.can_execute():
             raise ProviderUnavailableError(provider_id)
 
+        start = time.perf_counter()
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.post(
-                    f"{PROVIDER_SIM_URL}/providers/{provider_id}/authorize",
-                    json={
-                        "payment_id": payment_id,
-                        "amount": amount,
-                        "currency": currency,
-                        "pan": pan,
-                        "expiry": expiry,
-                        "merchant_id": merchant_id,
-                        "correlation_id": get_correlation_id(),
-                    },
-                    headers={"X-Correlation-Id": get_correlation_id()},
-                    timeout=10.0,
-                )
+            client = http_clients.get("provider")
+            resp = await client.post(
+                f"{PROVIDER_SIM_URL}/providers/{provider_id}/authorize",
+                json={
+                    "payment_id": payment_id,
+                    "amount": amount,
+                    "currency": currency,
+                    "pan": pan,
+                    "expiry": expiry,
+                    "merchant_id": merchant_id,
+                    "correlation_id": get_correlation_id(),
+                },
+                headers={"X-Correlation-Id": get_correlation_id()},
+                timeout=10.0,
+            )
             if resp.status_code == 200:
                 data = resp.json()
                 if data.get("success"):
-                    cb.record_success()
+                    self._record(cb, True, start, approved=True)
                 else:
-                    cb.record_failure()
+                    self._record(cb, False, start, approved=False)
                 return data
             else:
-                cb.record_failure()
+                self._record(cb, False, start, approved=False)
                 raise ProviderError(provider_id, resp.text)
+        except httpx.PoolTimeout:
+            # Never reached the provider, so the breaker and stats are left alone
+            raise ProviderBusyError(provider_id)
         except httpx.TimeoutException:
-            cb.record_failure()
+            self._record(cb, False, start, approved=False)
             raise ProviderTimeoutError(provider_id)
         except (httpx.ConnectError, httpx.ReadError) as e:
-            cb.record_failure()
+            self._record(cb, False, start, approved=False)
             raise ProviderError(provider_id, str(e))
 
     async def capture(self, provider_id: str, payment_id: str,
@@ -70,28 +97,34 @@ class ProviderClient:
         if not cb.can_execute():
             raise ProviderUnavailableError(provider_id)
 
+        start = time.perf_counter()
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.post(
-                    f"{PROVIDER_SIM_URL}/providers/{provider_id}/capture",
-                    json={
-                        "payment_id": payment_id,
-                        "provider_ref": provider_ref,
-                        "amount": amount,
-                        "correlation_id": get_correlation_id(),
-                    },
-                    headers={"X-Correlation-Id": get_correlation_id()},
-                    timeout=10.0,
-                )
+            client = http_clients.get("provider")
+            resp = await client.post(
+                f"{PROVIDER_SIM_URL}/providers/{provider_id}/capture",
+                json={
+                    "payment_id": payment_id,
+                    "provider_ref": provider_ref,
+                    "amount": amount,
+                    "correlation_id": get_correlation_id(),
+                },
+                headers={"X-Correlation-Id": get_correlation_id()},
+                timeout=10.0,
+            )
             if resp.status_code == 200:
-                cb.record_success()
+                self._record(cb, True, start)
                 return resp.json()
             else:
-                cb.record_failure()
+                self._record(cb, False, start)
                 raise ProviderError(provider_id, resp.text)
+        except httpx.PoolTimeout:
+            raise ProviderBusyError(provider_id)
         except httpx.TimeoutException:
-            cb.record_failure()
+            self._record(cb, False, start)
             raise ProviderTimeoutError(provider_id)
+        except (httpx.ConnectError, httpx.ReadError) as e:
+            self._record(cb, False, start)
+            raise ProviderError(provider_id, str(e))
 
     async def refund(self, provider_id: str, payment_id: str,
                      provider_ref: str, amount: int) -> dict:
@@ -99,25 +132,31 @@ class ProviderClient:
         if not cb.can_execute():
             raise ProviderUnavailableError(provider_id)
 
+        start = time.perf_counter()
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.post(
-                    f"{PROVIDER_SIM_URL}/providers/{provider_id}/refund",
-                    json={
-                        "payment_id": payment_id,
-                        "provider_ref": provider_ref,
-                        "amount": amount,
-                        "correlation_id": get_correlation_id(),
-                    },
-                    headers={"X-Correlation-Id": get_correlation_id()},
-                    timeout=10.0,
-                )
+            client = http_clients.get("provider")
+            resp = await client.post(
+                f"{PROVIDER_SIM_URL}/providers/{provider_id}/refund",
+                json={
+                    "payment_id": payment_id,
+                    "provider_ref": provider_ref,
+                    "amount": amount,
+                    "correlation_id": get_correlation_id(),
+                },
+                headers={"X-Correlation-Id": get_correlation_id()},
+                timeout=10.0,
+            )
             if resp.status_code == 200:
-                cb.record_success()
+                self._record(cb, True, start)
                 return resp.json()
             else:
-                cb.record_failure()
+                self._record(cb, False, start)
                 raise ProviderError(provider_id, resp.text)
+        except httpx.PoolTimeout:
+            raise ProviderBusyError(provider_id)
         except httpx.TimeoutException:
-            cb.record_failure()
+            self._record(cb, False, start)
             raise ProviderTimeoutError(provider_id)
+        except (httpx.ConnectError, httpx.ReadError) as e:
+            self._record(cb, False, start)
+            raise ProviderError(provider_id, str(e))
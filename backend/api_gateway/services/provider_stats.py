@@ -0,0 +1,96 @@
+"""Live per-provider latency and approval statistics for adaptive routing."""
+
+import os
+import time
+from typing import Callable, Optional
+
+ROUTING_EWMA_ALPHA = float(os.environ.get("ROUTING_EWMA_ALPHA", 0.2))
+# Priors used until a provider has been observed
+ROUTING_LATENCY_PRIOR_MS = float(os.environ.get("ROUTING_LATENCY_PRIOR_MS", 200))
+ROUTING_APPROVAL_PRIOR = float(os.environ.get("ROUTING_APPROVAL_PRIOR", 0.9))
+# Seconds for an unrefreshed average to move halfway back to the prior (0 disables decay)
+ROUTING_STATS_HALF_LIFE_S = float(os.environ.get("ROUTING_STATS_HALF_LIFE_S", 60))
+
+
+class _ProviderStat:
+    __slots__ = ("latency_ms", "approval_rate", "calls", "authorizations", "approvals", "updated_at")
+
+    def __init__(self):
+        self.latency_ms = ROUTING_LATENCY_PRIOR_MS
+        self.approval_rate = ROUTING_APPROVAL_PRIOR
+        self.calls = 0
+        self.authorizations = 0
+        self.approvals = 0
+        self.updated_at = 0.0
+
+
+class ProviderStats:
+    """Exponentially weighted moving averages, kept in process memory only.
+
+    Averages decay toward the priors while a provider gets no traffic, so a
+    provider that stopped being routed to after a bad spell is not judged on
+    that spell forever.
+    """
+
+    def __init__(self, alpha: float = ROUTING_EWMA_ALPHA, half_life_s: float = ROUTING_STATS_HALF_LIFE_S,
+                 clock: Callable[[], float] = time.time):
+        self.alpha = alpha
+        self.half_life_s = half_life_s
+        self.clock = clock
+        self._stats: dict[str, _ProviderStat] = {}
+
+    def _stat(self, provider_id: str) -> _ProviderStat:
+        stat = self._stats.get(provider_id)
+        if stat is None:
+            stat = self._stats[provider_id] = _ProviderStat()
+        return stat
+
+    def _keep(self, stat: _ProviderStat, now: float) -> float:
+        """Weight the history still carries, given the time since the last sample."""
+        if stat.calls == 0 or self.half_life_s <= 0:
+            return 1.0
+        return 0.5 ** (max(0.0, now - stat.updated_at) / self.half_life_s)
+
+    def _decayed(self, stat: _ProviderStat, keep: float) -> tuple[float, float]:
+        """(latency_ms, approval_rate) pulled toward the priors by 1 - keep."""
+        return (
+            ROUTING_LATENCY_PRIOR_MS + keep * (stat.latency_ms - ROUTING_LATENCY_PRIOR_MS),
+            ROUTING_APPROVAL_PRIOR + keep * (stat.approval_rate - ROUTING_APPROVAL_PRIOR),
+        )
+
+    def record(self, provider_id: str, latency_ms: float, approved: Optional[bool] = None):
+        """Record one provider call; approved is None for calls that are not authorizations."""
+        now = self.clock()
+        stat = self._stat(provider_id)
+        keep = self._keep(stat, now)
+        latency, approval_rate = self._decayed(stat, keep)
+        # A sample after a quiet spell counts for more, so sparse traffic still tracks recovery
+        a = 1 - (1 - self.alpha) * keep
+        # Seed the average with the first real sample instead of the prior
+        stat.latency_ms = latency_ms if stat.calls == 0 else a * latency_ms + (1 - a) * latency
+        stat.approval_rate = approval_rate
+        stat.calls += 1
+        if approved is not None:
+            stat.approval_rate = a * float(approved) + (1 - a) * approval_rate
+            stat.authorizations += 1
+            stat.approvals += int(approved)
+        stat.updated_at = now
+
+    def snapshot(self, provider_id: str) -> dict:
+        stat = self._stat(provider_id)
+        latency_ms, approval_rate = self._decayed(stat, self._keep(stat, self.clock()))
+        return {
+            "ewma_latency_ms": round(latency_ms, 2),
+            "approval_rate": round(approval_rate, 4),
+            "calls": stat.calls,
+            "authorizations": stat.authorizations,
+            "approvals": stat.approvals,
+        }
+
+    def get(self, provider_id: str) -> tuple[float, float]:
+        stat = self._stat(provider_id)
+        return self._decayed(stat, self._keep(stat, self.clock()))
+
+
+# One set of stats per worker process
+provider_stats = ProviderStats()
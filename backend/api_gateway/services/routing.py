@@ -1,79 +1,118 @@
 """Routing engine - selects payment provider based on rules and health."""
 
 import os
+import random
 import logging
 from typing import Optional
 from shared.models import CircuitState
 from services.circuit_breaker import CircuitBreaker
+from services.provider_stats import provider_stats
+from services.routing_rules import routing_rules
 
 logger = logging.getLogger("payrail.routing")
 
-DEFAULT_PROVIDER = os.environ.get("DEFAULT_PROVIDER", "providerA")
-FAILOVER_PROVIDER = os.environ.get("FAILOVER_PROVIDER", "providerB")
-
-# Cost table (percentage fees)
-COST_TABLE = {
-    "providerA": 2.9,
-    "providerB": 2.5,
-}
-
-# Country routing rules
-COUNTRY_ROUTES = {
-    "DE": "providerB",
-    "FR": "providerB",
-    "GB": "providerB",
-    "JP": "providerB",
-    "US": "providerA",
-    "CA": "providerA",
-    "AU": "providerA",
-}
-
-# Amount thresholds
-HIGH_VALUE_THRESHOLD = 10000  # cents ($100)
-HIGH_VALUE_PROVIDER = "providerB"
+# "rules" walks the routing rules file; "adaptive" scores providers on live stats
+ROUTING_MODE = os.environ.get("ROUTING_MODE", "rules")
+ROUTING_WEIGHT_FEE = float(os.environ.get("ROUTING_WEIGHT_FEE", 1.0))
+ROUTING_WEIGHT_LATENCY = float(os.environ.get("ROUTING_WEIGHT_LATENCY", 1.0))
+ROUTING_WEIGHT_APPROVAL = float(os.environ.get("ROUTING_WEIGHT_APPROVAL", 2.0))
+# Share of adaptive decisions sent to a random non-best provider, so its stats stay current
+ROUTING_EXPLORE_RATE = float(os.environ.get("ROUTING_EXPLORE_RATE", 0.05))
 
 
 class RoutingEngine:
 
+    def __init__(self, mode: str = ROUTING_MODE):
+        self.mode = mode
+
     def select_provider(
         self,
         amount: int,
         currency: str = "USD",
         country: Optional[str] = None,
         preferred_provider: Optional[str] = None,
+        bin_prefix: Optional[str] = None,
     ) -> str:
+        return self.decide(amount, currency, country, preferred_provider, bin_prefix)["provider"]
+
+    def decide(
+        self,
+        amount: int,
+        currency: str = "USD",
+        country: Optional[str] = None,
+        preferred_provider: Optional[str] = None,
+        bin_prefix: Optional[str] = None,
+    ) -> dict:
+        """Pick a provider and return the decision with the reason (and scores, if adaptive)."""
         # 1. If explicitly preferred and available, use it
         if preferred_provider:
             cb = CircuitBreaker(preferred_provider)
             if cb.can_execute():
-                return preferred_provider
-
-        # 2. Country-based routing
-        if country and country in COUNTRY_ROUTES:
-            provider = COUNTRY_ROUTES[country]
-            cb = CircuitBreaker(provider)
-            if cb.can_execute():
-                logger.info(f"Routing to {provider} based on country {country}")
-                return provider
-
-        # 3. Amount-based routing
-        if amount >= HIGH_VALUE_THRESHOLD:
-            cb = CircuitBreaker(HIGH_VALUE_PROVIDER)
-            if cb.can_execute():
-                logger.info(f"Routing to {HIGH_VALUE_PROVIDER} for high-value payment ({amount})")
-                return HIGH_VALUE_PROVIDER
+                return {"provider": preferred_provider, "mode": self.mode, "reason": "preferred"}
 
-        # 4. Default provider
-        cb_default = CircuitBreaker(DEFAULT_PROVIDER)
-        if cb_default.can_execute():
-            return DEFAULT_PROVIDER
+        if self.mode == "adaptive":
+            return self._adaptive_decision()
+        provider, reason = self._rules_decision(amount, currency, country, bin_prefix)
+        return {"provider": provider, "mode": self.mode, "reason": reason}
 
-        # 5. Failover
-        cb_failover = CircuitBreaker(FAILOVER_PROVIDER)
-        if cb_failover.can_execute():
-            logger.warning(f"Failing over to {FAILOVER_PROVIDER}")
-            return FAILOVER_PROVIDER
+    def _rules_decision(self, amount: int, currency: Optional[str], country: Optional[str],
+                        bin_prefix: Optional[str]) -> tuple[str, str]:
+        # 2-6. BIN, country, currency and amount rules, then default and failover
+        for provider, reason in routing_rules.current().evaluate(amount, currency, country, bin_prefix):
+            if CircuitBreaker(provider).can_execute():
+                if reason == "failover":
+                    logger.warning(f"Failing over to {provider}")
+                elif reason != "default":
+                    logger.info(f"Routing to {provider} by {reason} rule")
+                return provider, reason
 
         # All providers down
         logger.error("All providers unavailable")
         raise Exception("No available providers")
+
+    # === Adaptive mode ===
+
+    def score_providers(self) -> list[dict]:
+        """Score every provider in the rules' cost table from in-memory stats; higher is better."""
+        rows = []
+        for provider_id, fee_pct in routing_rules.current().cost_table.items():
+            latency_ms, approval_rate = provider_stats.get(provider_id)
+            rows.append({
+                "provider": provider_id,
+                "eligible": CircuitBreaker(provider_id).can_execute(),
+                "fee_pct": fee_pct,
+                "ewma_latency_ms": round(latency_ms, 2),
+                "approval_rate": round(approval_rate, 4),
+                "score": None,
+            })
+
+        eligible = [r for r in rows if r["eligible"]]
+        if eligible:
+            # Fee and latency are normalised against the worst eligible provider
+            max_fee = max(r["fee_pct"] for r in eligible) or 1.0
+            max_latency = max(r["ewma_latency_ms"] for r in eligible) or 1.0
+            for r in eligible:
+                r["score"] = round(
+                    ROUTING_WEIGHT_APPROVAL * r["approval_rate"]
+                    - ROUTING_WEIGHT_FEE * r["fee_pct"] / max_fee
+                    - ROUTING_WEIGHT_LATENCY * r["ewma_latency_ms"] / max_latency,
+                    4,
+                )
+        return rows
+
+    def _adaptive_decision(self) -> dict:
+        scores = self.score_providers()
+        best = None
+        for r in scores:
+            if r["score"] is not None and (best is None or r["score"] > best["score"]):
+                best = r
+        if best is None:
+            logger.error("All providers unavailable")
+            raise Exception("No available providers")
+        others = [r for r in scores if r["score"] is not None and r is not best]
+        if others and random.random() < ROUTING_EXPLORE_RATE:
+            pick = random.choice(others)
+            logger.info(f"Adaptive routing exploring {pick['provider']} (score {pick['score']})")
+            return {"provider": pick["provider"], "mode": self.mode, "reason": "explore", "scores": scores}
+        logger.info(f"Adaptive routing to {best['provider']} (score {best['score']})")
+        return {"provider": best["provider"], "mode": self.mode, "reason": "best_score", "scores": scores}
@@ -0,0 +1,245 @@
+"""Declarative routing rules compiled into lookup tables, reloaded on file change.
+
+The rules file is JSON:
+
+    {
+      "default_provider": "providerA",
+      "failover_provider": "providerB",
+      "cost_table": {"providerA": 2.9},
+      "bin_routes": [{"prefix": "4571", "provider": "providerB"}],
+      "country_routes": {"DE": "providerB"},
+      "currency_routes": {"EUR": "providerB"},
+      "amount_bands": [{"min": 10000, "max": null, "provider": "providerB"}]
+    }
+
+BIN prefixes go into a multibit trie (longest prefix wins): each level is a
+dict keyed by a fixed-width chunk of the BIN (4, then 2, then 2 digits), and
+shorter prefixes are expanded to every completion of their level at compile
+time, so an 8-digit BIN resolves in at most three dict lookups. Resolved BINs
+are memoised per compiled rule set (bounded by ROUTING_BIN_CACHE_SIZE), since
+live traffic concentrates on a limited set of BINs. Countries and currencies
+become dicts, and amount bands a sorted bound list searched with bisect.
+Reloads compile a new table set and swap it in with a single assignment, so
+requests always see either the old rules or the new ones.
+
+scripts/bench_routing_rules.py measures evaluate() against 10,000 BIN routes.
+Only BINs already in the cache evaluate in under a microsecond (about 0.7 µs
+on CPython 3.11). A BIN seen for the first time also walks the trie, about
+1.4 µs.
+"""
+
+import os
+import json
+import time
+import logging
+from bisect import bisect_right
+from itertools import product
+from typing import Optional
+
+logger = logging.getLogger("payrail.routing_rules")
+
+ROUTING_RULES_PATH = os.environ.get(
+    "ROUTING_RULES_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "routing_rules.json"),
+)
+# How often to stat the rules file for changes
+ROUTING_RULES_CHECK_INTERVAL = float(os.environ.get("ROUTING_RULES_CHECK_INTERVAL", 1.0))
+ROUTING_BIN_CACHE_SIZE = int(os.environ.get("ROUTING_BIN_CACHE_SIZE", 65536))
+
+# Used when the rules file is absent
+DEFAULT_RULES = {
+    "default_provider": os.environ.get("DEFAULT_PROVIDER", "providerA"),
+    "failover_provider": os.environ.get("FAILOVER_PROVIDER", "providerB"),
+    "cost_table": {"providerA": 2.9, "providerB": 2.5},
+    "bin_routes": [],
+    "country_routes": {
+        "DE": "providerB", "FR": "providerB", "GB": "providerB", "JP": "providerB",
+        "US": "providerA", "CA": "providerA", "AU": "providerA",
+    },
+    "currency_routes": {},
+    "amount_bands": [{"min": 10000, "max": None, "provider": "providerB"}],
+}
+
+# Digit offsets where each BIN trie level ends; BINs are at most 8 digits
+_BIN_LEVEL_ENDS = (4, 6, 8)
+_MISS = object()
+
+
+class RulesError(Exception):
+    pass
+
+
+class CompiledRules:
+
+    def __init__(self, rules: dict, source: str = "defaults", bin_cache_size: int = ROUTING_BIN_CACHE_SIZE):
+        self.source = source
+        self.bin_cache_size = bin_cache_size
+        self.loaded_at = time.time()
+        try:
+            self.default_provider = rules.get("default_provider", DEFAULT_RULES["default_provider"])
+            self.failover_provider = rules.get("failover_provider", DEFAULT_RULES["failover_provider"])
+            self.cost_table = {p: float(fee) for p, fee in rules.get("cost_table", {}).items()}
+            self.country_routes = {c.upper(): p for c, p in rules.get("country_routes", {}).items()}
+            self.currency_routes = {c.upper(): p for c, p in rules.get("currency_routes", {}).items()}
+            self._bin_trie = self._compile_bins(rules.get("bin_routes", []))
+            self._band_lows, self._bands = self._compile_bands(rules.get("amount_bands", []))
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            raise RulesError(f"Invalid routing rules from {source}: {e!r}")
+        self.bin_route_count = len(rules.get("bin_routes", []))
+        self._bin_cache: dict[str, Optional[str]] = {}
+        self._default_candidate = (self.default_provider, "default")
+        self._failover_candidate = (self.failover_provider, "failover")
+
+    @staticmethod
+    def _compile_bins(routes: list[dict]) -> dict:
+        """Build the trie; each node is [provider or None, child level dict]."""
+        root: dict = {}
+        prefixes = sorted((str(r["prefix"]), r["provider"]) for r in routes)
+        # Shorter prefixes first, so longer ones overwrite their expansions
+        for prefix, provider in sorted(prefixes, key=lambda pv: len(pv[0])):
+            if not prefix.isdigit() or len(prefix) > _BIN_LEVEL_ENDS[-1]:
+                raise ValueError(f"BIN prefix {prefix!r} is not 1-{_BIN_LEVEL_ENDS[-1]} digits")
+            level, start = root, 0
+            for end in _BIN_LEVEL_ENDS:
+                chunk = prefix[start:end]
+                if len(prefix) <= end:
+                    for tail in product("0123456789", repeat=end - start - len(chunk)):
+                        node = level.setdefault(chunk + "".join(tail), [None, {}])
+                        node[0] = provider
+                    break
+                level = level.setdefault(chunk, [None, {}])[1]
+                start = end
+        return root
+
+    @staticmethod
+    def _compile_bands(bands: list[dict]) -> tuple[list[int], list[tuple[int, Optional[int], str]]]:
+        compiled = sorted(
+            (int(b.get("min") or 0), None if b.get("max") is None else int(b["max"]), b["provider"])
+            for b in bands
+        )
+        for (lo, hi, _), (next_lo, _, _) in zip(compiled, compiled[1:]):
+            if hi is None or hi > next_lo:
+                raise ValueError(f"amount band starting at {lo} overlaps the band starting at {next_lo}")
+        return [lo for lo, _, _ in compiled], compiled
+
+    def match_bin(self, bin_prefix: Optional[str]) -> Optional[str]:
+        found = None
+        if not bin_prefix:
+            return found
+        level, start, size = self._bin_trie, 0, len(bin_prefix)
+        for end in _BIN_LEVEL_ENDS:
+            if size < end:
+                break
+            node = level.get(bin_prefix[start:end])
+            if node is None:
+                break
+            if node[0] is not None:
+                found = node[0]
+            level = node[1]
+            if not level:
+                break
+            start = end
+        return found
+
+    def match_amount(self, amount: int) -> Optional[str]:
+        i = bisect_right(self._band_lows, amount) - 1
+        if i < 0:
+            return None
+        _, hi, provider = self._bands[i]
+        if hi is not None and amount >= hi:
+            return None
+        return provider
+
+    def evaluate(self, amount: int, currency: Optional[str] = None,
+                 country: Optional[str] = None, bin_prefix: Optional[str] = None) -> list[tuple[str, str]]:
+        """Matching (provider, reason) candidates in priority order, ending with default and failover."""
+        candidates = []
+        if bin_prefix:
+            found = self._bin_cache.get(bin_prefix, _MISS)
+            if found is _MISS:
+                found = self.match_bin(bin_prefix)
+                if self.bin_cache_size:
+                    if len(self._bin_cache) >= self.bin_cache_size:
+                        self._bin_cache.clear()
+                    self._bin_cache[bin_prefix] = found
+            if found is not None:
+                candidates.append((found, "bin"))
+        # Keys are upper-cased at compile time
+        if country:
+            provider = self.country_routes.get(country.upper())
+            if provider:
+                candidates.append((provider, "country"))
+        if currency:
+            provider = self.currency_routes.get(currency.upper())
+            if provider:
+                candidates.append((provider, "currency"))
+        provider = self.match_amount(amount)
+        if provider:
+            candidates.append((provider, "amount_band"))
+        candidates.append(self._default_candidate)
+        candidates.append(self._failover_candidate)
+        return candidates
+
+    def describe(self) -> dict:
+        return {
+            "source": self.source,
+            "loaded_at": self.loaded_at,
+            "bin_routes": self.bin_route_count,
+            "country_routes": len(self.country_routes),
+            "currency_routes": len(self.currency_routes),
+            "amount_bands": len(self._bands),
+            "providers": sorted(self.cost_table),
+        }
+
+
+class RoutingRules:
+    """Holds the compiled rules and recompiles them when the file changes."""
+
+    def __init__(self, path: str = ROUTING_RULES_PATH, check_interval: float = ROUTING_RULES_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._compiled = CompiledRules(DEFAULT_RULES)
+        self._signature = None
+        self._next_check = 0.0
+        self._reload()
+
+    def _file_signature(self) -> Optional[tuple]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _reload(self):
+        signature = self._file_signature()
+        if signature == self._signature:
+            return
+        if signature is None:
+            compiled = CompiledRules(DEFAULT_RULES)
+        else:
+            try:
+                with open(self.path, "r") as f:
+                    compiled = CompiledRules(json.load(f), source=self.path)
+            except (ValueError, RulesError) as e:
+                # Keep serving the previous rules until the file is fixed
+                logger.error(f"Routing rules not reloaded: {e}")
+                self._signature = signature
+                return
+            except OSError as e:
+                # Replaced or removed between stat and open (e.g. mid-deploy); retry on the next check
+                logger.warning(f"Routing rules not reloaded: {e}")
+                return
+        self._compiled = compiled
+        self._signature = signature
+        logger.info(f"Routing rules loaded: {compiled.describe()}")
+
+    def current(self) -> CompiledRules:
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            self._reload()
+        return self._compiled
+
+
+# One rules holder per process
+routing_rules = RoutingRules()
@@ -0,0 +1,20 @@
+"""Current-state record stores for payments, refunds, and disputes."""
+
+import os
+from shared.record_store import RecordStore
+
+DATA_DIR = os.environ.get("DATA_DIR", "/app/data")
+STORE_DIR = os.path.join(DATA_DIR, "idempotency")
+
+
+def _open_store(name: str) -> RecordStore:
+    # Legacy <name>.json snapshots are imported into the log on first open
+    return RecordStore(
+        os.path.join(STORE_DIR, f"{name}.jsonl"),
+        legacy_path=os.path.join(STORE_DIR, f"{name}.json"),
+    )
+
+
+payments_store = _open_store("payments_store")
+refunds_store = _open_store("refunds_store")
+disputes_store = _open_store("disputes_store")
@@ -0,0 +1,14 @@
+"""Run gateway modules from a checkout: put the service and backend/ on sys.path, data in a temp dir."""
+
+import os
+import sys
+import tempfile
+
+_SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [_SERVICE_DIR, os.path.dirname(_SERVICE_DIR)]
+
+# Modules read these at import time
+_DATA_DIR = tempfile.mkdtemp(prefix="payrail-gateway-tests-")
+os.environ.setdefault("DATA_DIR", _DATA_DIR)
+os.environ.setdefault("CB_SHM_PATH", os.path.join(_DATA_DIR, "providers", "circuit_breakers.shm"))
+os.makedirs(os.path.join(os.environ["DATA_DIR"], "providers"), exist_ok=True)
@@ -0,0 +1,29 @@
+import struct
+
+from services.circuit_breaker import SharedBreakerTable
+
+
+def _seq(table: SharedBreakerTable, slot: int) -> int:
+    return struct.unpack_from("<I", table._mm, table._offset(slot))[0]
+
+
+def test_slot_left_mid_write_is_repaired(tmp_path):
+    table = SharedBreakerTable(str(tmp_path / "cb.shm"), slots=4, buckets=4)
+    slot = table.slot_for("providerA", lambda: {"circuit_state": "open", "failure_count": 5})
+
+    # A worker that died between the odd and the even seq store
+    struct.pack_into("<I", table._mm, table._offset(slot), _seq(table, slot) + 1)
+    assert _seq(table, slot) % 2 == 1
+
+    state = table.read(slot)
+    assert state["circuit_state"] == "open"
+    assert state["failure_count"] == 5
+    assert _seq(table, slot) % 2 == 0
+
+    # Writers (which read under the lock) recover too, and the table survives reopening
+    struct.pack_into("<I", table._mm, table._offset(slot), _seq(table, slot) + 1)
+    with table.update(slot) as state:
+        state["failure_count"] += 1
+    reopened = SharedBreakerTable(str(tmp_path / "cb.shm"), slots=4, buckets=4)
+    assert reopened.read(slot)["failure_count"] == 6
+    assert _seq(reopened, slot) % 2 == 0
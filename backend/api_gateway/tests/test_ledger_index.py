@@ -0,0 +1,25 @@
+import json
+
+from shared.ledger_index import LedgerIndex
+
+
+def _append(path, *lines):
+    with open(path, "ab") as f:
+        for line in lines:
+            f.write(line if isinstance(line, bytes) else (json.dumps(line) + "\n").encode())
+
+
+def test_corrupt_ledger_line_is_skipped_not_fatal(tmp_path):
+    ledger = tmp_path / "payments.jsonl"
+    _append(ledger, {"ref": "pi_1", "type": "payment.created"}, b'{"ref": "pi_2", "ty\n')
+    index = LedgerIndex(str(tmp_path / "ref_index.jsonl"), {"payment": str(ledger)})
+    assert [e["type"] for e in index.lookup("pi_1")] == ["payment.created"]
+
+    # Appends after the bad line are picked up lazily, by the next lookup
+    _append(ledger, {"ref": "pi_1", "type": "payment.captured"})
+    assert [e["type"] for e in index.lookup("pi_1")] == ["payment.created", "payment.captured"]
+
+    # A full rebuild and a fresh process both step over it too
+    index.rebuild()
+    assert len(index.lookup("pi_1")) == 2
+    assert len(LedgerIndex(str(tmp_path / "ref_index.jsonl"), {"payment": str(ledger)}).lookup("pi_1")) == 2
@@ -0,0 +1,48 @@
+import random
+
+from services import routing
+from services.provider_stats import ProviderStats, ROUTING_APPROVAL_PRIOR, ROUTING_LATENCY_PRIOR_MS
+
+
+def test_stats_decay_toward_prior_without_traffic():
+    now = [1000.0]
+    stats = ProviderStats(half_life_s=60, clock=lambda: now[0])
+    for _ in range(20):
+        stats.record("providerB", 2000, approved=False)
+    latency, approval = stats.get("providerB")
+    assert latency > 1500 and approval < 0.1
+
+    now[0] += 60
+    latency, approval = stats.get("providerB")
+    assert abs(latency - (ROUTING_LATENCY_PRIOR_MS + 2000) / 2) < 100
+    now[0] += 600
+    latency, approval = stats.get("providerB")
+    assert abs(latency - ROUTING_LATENCY_PRIOR_MS) < 5
+    assert abs(approval - ROUTING_APPROVAL_PRIOR) < 0.01
+
+
+def test_degraded_provider_wins_traffic_back_after_recovery(monkeypatch):
+    now = [1000.0]
+    stats = ProviderStats(half_life_s=60, clock=lambda: now[0])
+    monkeypatch.setattr(routing, "provider_stats", stats)
+    monkeypatch.setattr(routing, "random", random.Random(7))
+    engine = routing.RoutingEngine(mode="adaptive")
+
+    # providerB (the cheaper one) goes through a bad spell
+    for _ in range(20):
+        stats.record("providerA", 100, approved=True)
+        stats.record("providerB", 2000, approved=False)
+    monkeypatch.setattr(routing, "ROUTING_EXPLORE_RATE", 0.0)
+    assert engine.decide(amount=1000)["provider"] == "providerA"
+
+    # providerB has recovered; only decay and exploration can bring it back
+    monkeypatch.setattr(routing, "ROUTING_EXPLORE_RATE", 0.05)
+    healthy_latency = {"providerA": 100, "providerB": 50}
+    recent = []
+    for _ in range(400):
+        now[0] += 1
+        decision = engine.decide(amount=1000)
+        stats.record(decision["provider"], healthy_latency[decision["provider"]], approved=True)
+        recent.append(decision)
+    best = [d["provider"] for d in recent[-50:] if d["reason"] == "best_score"]
+    assert best and all(p == "providerB" for p in best)
@@ -0,0 +1,76 @@
+"""External sort and merge-join over (key, value) records with bounded memory.
+
+sort_runs() buffers at most chunk_size records, sorts them and spills each
+buffer to a run file; iter_sorted() k-way merges the runs back into one
+key-ordered stream. Sorting is stable, so records sharing a key come out in
+input order and last_per_key() can keep the latest one, matching what a
+dict built from the same input would hold.
+"""
+
+import os
+import json
+import heapq
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterable, Iterator, Optional
+
+_key = itemgetter(0)
+
+
+def sort_runs(records: Iterable[tuple], run_dir: str, chunk_size: int, prefix: str = "run") -> list[str]:
+    """Spill records to sorted run files of at most chunk_size records each; returns their paths."""
+    paths = []
+    buffer = []
+
+    def spill():
+        buffer.sort(key=_key)
+        path = os.path.join(run_dir, f"{prefix}_{len(paths):05d}.jsonl")
+        with open(path, "w") as f:
+            f.writelines(json.dumps(record) + "\n" for record in buffer)
+        paths.append(path)
+        buffer.clear()
+
+    for record in records:
+        buffer.append(record)
+        if len(buffer) >= chunk_size:
+            spill()
+    if buffer:
+        spill()
+    return paths
+
+
+def _read_run(path: str) -> Iterator[tuple]:
+    with open(path, "r") as f:
+        for line in f:
+            yield tuple(json.loads(line))
+
+
+def iter_sorted(paths: list[str]) -> Iterator[tuple]:
+    """Merge sorted run files into a single stream ordered by key, stable across runs."""
+    return heapq.merge(*(_read_run(p) for p in paths), key=_key)
+
+
+def last_per_key(records: Iterator[tuple]) -> Iterator[tuple]:
+    """Collapse a key-ordered stream to the last record for each key."""
+    for _, group in groupby(records, key=_key):
+        last = None
+        for last in group:
+            pass
+        yield last
+
+
+def merge_join(left: Iterator[tuple], right: Iterator[tuple]) -> Iterator[tuple[str, Optional[tuple], Optional[tuple]]]:
+    """Full outer join of two key-ordered, key-unique streams: yields (key, left_record, right_record)."""
+    lrec = next(left, None)
+    rrec = next(right, None)
+    while lrec is not None or rrec is not None:
+        if rrec is None or (lrec is not None and lrec[0] < rrec[0]):
+            yield lrec[0], lrec, None
+            lrec = next(left, None)
+        elif lrec is None or rrec[0] < lrec[0]:
+            yield rrec[0], None, rrec
+            rrec = next(right, None)
+        else:
+            yield lrec[0], lrec, rrec
+            lrec = next(left, None)
+            rrec = next(right, None)
@@ -18,24 +18,37 @@ DATA_DIR = os.environ.get("DATA_DIR", "/app/data")
 for d in ["ledger", "outbox", "settlement", "reconciliation", "metrics"]:
     os.makedirs(os.path.join(DATA_DIR, d), exist_ok=True)
 
-from outbox_dispatcher import OutboxDispatcher
+from outbox_dispatcher import OutboxDispatcher, ConcurrentOutboxDispatcher
 from settlement_generator import SettlementGenerator
-from reconciliation import ReconciliationJob
+from reconciliation_runner import ReconciliationRunner
+from shared.http_clients import http_clients
+from shared.settlement_manifest import SettlementManifest
 
 
 async def main():
     logger.info("Ledger Jobs service starting...")
-
-    dispatcher = OutboxDispatcher()
+    # Index settlement files written before the manifest existed or left behind it by a crash
+    indexed = SettlementManifest(os.path.join(DATA_DIR, "settlement")).refresh()
+    if indexed:
+        logger.info(f"Indexed {indexed} settlement files into the manifest")
+
+    if os.environ.get("OUTBOX_MODE", "sequential") == "concurrent":
+        dispatcher = ConcurrentOutboxDispatcher()
+    else:
+        dispatcher = OutboxDispatcher()
     settlement = SettlementGenerator()
-    reconciliation = ReconciliationJob()
-
-    # Run all background loops concurrently
-    await asyncio.gather(
-        dispatcher.run_loop(interval=5),
-        settlement.run_loop(interval=10),
-        reconciliation.run_loop(interval=3600),
-    )
+    reconciliation = ReconciliationRunner()
+
+    http_clients.open("webhook")
+    try:
+        # Run all background loops concurrently
+        await asyncio.gather(
+            dispatcher.run_loop(interval=5),
+            settlement.run_loop(interval=10),
+            reconciliation.run_loop(interval=3600),
+        )
+    finally:
+        await http_clients.aclose()
 
 
 if __name__ == "__main__":
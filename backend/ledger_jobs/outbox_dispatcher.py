@@ -1,28 +1,52 @@
 """Outbox dispatcher - reads events and sends webhooks with retry/DLQ."""
 
 import os
+import time
+import heapq
+import itertools
 import json
 import hmac
 import hashlib
 import logging
 import asyncio
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timezone
 
-import httpx
-
-from shared.file_store import FileStore
+from shared.file_store import FileStore, JsonlCursor
+from shared.http_clients import http_clients
+from shared.stats import summarize
 
 logger = logging.getLogger("ledger-jobs.outbox")
 
 DATA_DIR = os.environ.get("DATA_DIR", "/app/data")
 OUTBOX_PATH = os.path.join(DATA_DIR, "outbox", "events.jsonl")
-PROCESSED_PATH = os.path.join(DATA_DIR, "outbox", "processed_events.json")
+PROCESSED_PATH = os.path.join(DATA_DIR, "outbox", "processed_events.json")  # Legacy, read once
+CHECKPOINT_PATH = os.path.join(DATA_DIR, "outbox", "dispatcher_checkpoint.json")
+STATUS_LOG_PATH = os.path.join(DATA_DIR, "outbox", "delivery_status.jsonl")
 DLQ_PATH = os.path.join(DATA_DIR, "outbox", "dlq.jsonl")
+STATS_PATH = os.path.join(DATA_DIR, "metrics", "outbox_dispatcher.json")
 WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "whsec_payrail_demo_secret_key_2026")
 WEBHOOK_CALLBACK_URL = os.environ.get("WEBHOOK_CALLBACK_URL", "http://api-gateway:8026/webhooks/provider")
 
 MAX_RETRIES = 3
 RETRY_BACKOFF = [1, 3, 10]  # seconds
+MAX_IN_FLIGHT = int(os.environ.get("OUTBOX_MAX_IN_FLIGHT", 100))
+OUTBOX_WORKERS = int(os.environ.get("OUTBOX_WORKERS", 8))
+STATS_INTERVAL = 30  # seconds
+# Admit more events as soon as the in-flight window drains below this
+REFILL_LOW_WATER = int(os.environ.get("OUTBOX_REFILL_LOW_WATER", MAX_IN_FLIGHT // 2))
+LATENCY_SAMPLES = 2000
+
+
+def _created_ts(event: dict):
+    """Epoch seconds of the event's created_at (naive timestamps are UTC), or None."""
+    try:
+        created = datetime.fromisoformat(event["created_at"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    return created.timestamp()
 
 
 def sign_payload(payload: str) -> str:
@@ -32,7 +56,15 @@ def sign_payload(payload: str) -> str:
 
 class OutboxDispatcher:
 
-    async def dispatch_event(self, event: dict) -> bool:
+    def __init__(self):
+        self.cursor = JsonlCursor(OUTBOX_PATH, CHECKPOINT_PATH)
+        # Events delivered before checkpointing existed; only needed until the
+        # cursor first catches up with the end of the outbox.
+        self._legacy_processed: set[str] = set()
+        if not os.path.exists(CHECKPOINT_PATH):
+            self._legacy_processed = set(FileStore.read_json(PROCESSED_PATH, default={}))
+
+    def _build_payload(self, event: dict) -> tuple[str, str]:
         payload_obj = {
             "id": event.get("event_id", f"oevt_{datetime.utcnow().timestamp()}"),
             "type": event.get("type", ""),
@@ -41,32 +73,48 @@ class OutboxDispatcher:
             "created_at": event.get("created_at", datetime.utcnow().isoformat()),
         }
         payload = json.dumps(payload_obj, default=str)
-        signature = sign_payload(payload)
+        return payload, sign_payload(payload)
 
-        for attempt in range(MAX_RETRIES):
-            try:
-                async with httpx.AsyncClient() as client:
-                    resp = await client.post(
-                        WEBHOOK_CALLBACK_URL,
-                        content=payload,
-                        headers={
-                            "Content-Type": "application/json",
-                            "X-Webhook-Signature": signature,
-                            "X-Correlation-Id": event.get("correlation_id", ""),
-                        },
-                        timeout=10.0,
-                    )
-                if resp.status_code < 400:
-                    return True
-                logger.warning(f"Webhook returned {resp.status_code}, attempt {attempt + 1}")
-            except Exception as e:
-                logger.warning(f"Webhook delivery failed (attempt {attempt + 1}): {e}")
+    async def _send_once(self, event: dict, payload: str, signature: str, attempt: int) -> bool:
+        try:
+            client = http_clients.get("webhook")
+            resp = await client.post(
+                WEBHOOK_CALLBACK_URL,
+                content=payload,
+                headers={
+                    "Content-Type": "application/json",
+                    "X-Webhook-Signature": signature,
+                    "X-Correlation-Id": event.get("correlation_id", ""),
+                },
+                timeout=10.0,
+            )
+            if resp.status_code < 400:
+                return True
+            logger.warning(f"Webhook returned {resp.status_code}, attempt {attempt}")
+        except Exception as e:
+            logger.warning(f"Webhook delivery failed (attempt {attempt}): {e}")
+        return False
 
+    async def dispatch_event(self, event: dict) -> bool:
+        payload, signature = self._build_payload(event)
+
+        for attempt in range(MAX_RETRIES):
+            if await self._send_once(event, payload, signature, attempt + 1):
+                return True
             if attempt < MAX_RETRIES - 1:
                 await asyncio.sleep(RETRY_BACKOFF[attempt])
 
         return False
 
+    def _move_to_dlq(self, event: dict):
+        FileStore.append_jsonl(DLQ_PATH, {
+            **event,
+            "dlq_reason": "max_retries_exceeded",
+            "dlq_at": datetime.utcnow().isoformat(),
+        })
+        self._record_status(event, "dlq")
+        logger.warning(f"Event {event.get('event_id', '')} moved to DLQ")
+
     async def run_loop(self, interval: int = 5):
         logger.info(f"Outbox dispatcher started (interval={interval}s)")
         while True:
@@ -76,40 +124,239 @@ class OutboxDispatcher:
                 logger.error(f"Outbox dispatcher error: {e}")
             await asyncio.sleep(interval)
 
-    async def process_pending(self):
-        events = FileStore.read_jsonl(OUTBOX_PATH)
-        if not events:
-            return
-
-        processed = FileStore.read_json(PROCESSED_PATH, default={})
-        pending = [e for e in events if e.get("event_id") not in processed]
+    def _record_status(self, event: dict, status: str):
+        FileStore.append_jsonl(STATUS_LOG_PATH, {
+            "event_id": event.get("event_id", ""),
+            "type": event.get("type", ""),
+            "status": status,
+            "processed_at": datetime.utcnow().isoformat(),
+        })
 
-        if not pending:
+    async def process_pending(self):
+        # Bounded in-flight set: at most MAX_IN_FLIGHT events past the checkpoint
+        batch = list(itertools.islice(
+            FileStore.read_jsonl_from(OUTBOX_PATH, self.cursor.offset), MAX_IN_FLIGHT
+        ))
+        if not batch:
+            self._legacy_processed.clear()
             return
 
-        logger.info(f"Processing {len(pending)} outbox events")
+        pending = [(e, end) for e, end in batch if e.get("event_id") not in self._legacy_processed]
+        if pending:
+            logger.info(f"Processing {len(pending)} outbox events")
 
-        for event in pending:
+        for event, end in pending:
             event_id = event.get("event_id", "")
             success = await self.dispatch_event(event)
 
             if success:
-                processed[event_id] = {
-                    "processed_at": __import__("datetime").datetime.utcnow().isoformat(),
-                    "status": "delivered",
-                }
+                self._record_status(event, "delivered")
                 logger.info(f"Delivered outbox event {event_id}")
             else:
-                # Move to DLQ
-                FileStore.append_jsonl(DLQ_PATH, {
-                    **event,
-                    "dlq_reason": "max_retries_exceeded",
-                    "dlq_at": __import__("datetime").datetime.utcnow().isoformat(),
-                })
-                processed[event_id] = {
-                    "processed_at": __import__("datetime").datetime.utcnow().isoformat(),
-                    "status": "dlq",
-                }
-                logger.warning(f"Event {event_id} moved to DLQ")
-
-        FileStore.write_json(PROCESSED_PATH, processed)
+                self._move_to_dlq(event)
+
+            self.cursor.commit(end)
+
+        # Advance past any trailing already-delivered legacy events
+        last_end = batch[-1][1]
+        if last_end != self.cursor.offset:
+            self.cursor.commit(last_end)
+
+
+class _Delivery:
+
+    def __init__(self, event: dict, end: int, payload: str, signature: str):
+        self.event = event
+        self.end = end
+        self.payload = payload
+        self.signature = signature
+        self.event_id = event.get("event_id", "")
+        # Ordering key: the payment/refund/dispute the event is about
+        self.key = event.get("payload", {}).get("id") or self.event_id
+        self.attempts = 0
+        self.admitted_at = time.monotonic()
+        self.created_at = _created_ts(event)
+        self.done = False
+
+
+class ConcurrentOutboxDispatcher(OutboxDispatcher):
+    """Delivers with N workers while keeping events for one entity in order.
+
+    Each entity (payload id) has a FIFO of admitted events and at most one of
+    them is being delivered or waiting to retry at a time. A failed attempt
+    goes onto a time-ordered retry heap instead of sleeping in a worker, so a
+    slow or failing target only holds up its own entity. The checkpoint only
+    advances past events that completed, in outbox order. The window is
+    refilled as soon as it drains below REFILL_LOW_WATER; the poll interval
+    only applies once the outbox has nothing new.
+    """
+
+    def __init__(self, workers: int = OUTBOX_WORKERS):
+        super().__init__()
+        self.workers = workers
+        self._read_offset = self.cursor.offset
+        self._window: deque[_Delivery] = deque()  # Admitted events, outbox order
+        self._by_key: dict[str, deque[_Delivery]] = {}
+        self._ready: asyncio.Queue[str] = asyncio.Queue()
+        self._retries: list[tuple[float, int, str]] = []
+        self._retry_seq = itertools.count()
+        self._started = time.monotonic()
+        self._delivered = 0
+        self._dlq = 0
+        self._attempts = 0
+        self._latencies_ms: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self._completed_at: deque[float] = deque()
+        self._refill = asyncio.Event()
+
+    def _admit(self) -> int:
+        """Read new outbox events into the window; returns how many were admitted."""
+        room = MAX_IN_FLIGHT - len(self._window)
+        if room <= 0:
+            return 0
+        batch = list(itertools.islice(
+            FileStore.read_jsonl_from(OUTBOX_PATH, self._read_offset), room
+        ))
+        if not batch and not self._window:
+            self._legacy_processed.clear()
+        for event, end in batch:
+            self._read_offset = end
+            d = _Delivery(event, end, *self._build_payload(event))
+            self._window.append(d)
+            if d.event_id in self._legacy_processed:
+                d.done = True
+                continue
+            queue = self._by_key.get(d.key)
+            if queue is None:
+                self._by_key[d.key] = deque([d])
+                self._ready.put_nowait(d.key)
+            else:
+                queue.append(d)
+        self._advance_checkpoint()
+        return len(batch)
+
+    def _advance_checkpoint(self):
+        end = None
+        while self._window and self._window[0].done:
+            end = self._window.popleft().end
+        if end is not None:
+            self.cursor.commit(end)
+
+    def _finish(self, d: _Delivery, status: str):
+        # File I/O first: if it fails, d is still the head of its entity and gets retried
+        if status == "delivered":
+            self._record_status(d.event, status)
+            self._delivered += 1
+        else:
+            self._move_to_dlq(d.event)
+            self._dlq += 1
+
+        queue = self._by_key[d.key]
+        queue.popleft()
+        if queue:
+            self._ready.put_nowait(d.key)
+        else:
+            del self._by_key[d.key]
+
+        now = time.monotonic()
+        # End-to-end: from when the event was written to the outbox, not when it was admitted
+        if d.created_at is not None:
+            self._latencies_ms.append(max(0.0, time.time() - d.created_at) * 1000)
+        else:
+            self._latencies_ms.append((now - d.admitted_at) * 1000)
+        self._completed_at.append(now)
+        d.done = True
+        self._advance_checkpoint()
+        if len(self._window) < REFILL_LOW_WATER:
+            self._refill.set()
+
+    def _schedule_retry(self, d: _Delivery):
+        due = time.monotonic() + RETRY_BACKOFF[min(d.attempts, len(RETRY_BACKOFF)) - 1]
+        heapq.heappush(self._retries, (due, next(self._retry_seq), d.key))
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            d = None
+            try:
+                d = self._by_key[key][0]
+                d.attempts += 1
+                self._attempts += 1
+                try:
+                    ok = await self._send_once(d.event, d.payload, d.signature, d.attempts)
+                except Exception as e:
+                    logger.error(f"Outbox worker error for {d.event_id}: {e}")
+                    ok = False
+
+                if ok:
+                    self._finish(d, "delivered")
+                elif d.attempts >= MAX_RETRIES:
+                    self._finish(d, "dlq")
+                else:
+                    self._schedule_retry(d)
+            except Exception as e:
+                # Status/DLQ/checkpoint I/O failed; keep this worker alive and the entity's queue moving
+                logger.error(f"Outbox worker error finishing {d.event_id if d else key}: {e}")
+                queue = self._by_key.get(key)
+                if d is not None and queue and queue[0] is d and not d.done:
+                    self._schedule_retry(d)
+
+    async def _retry_scheduler(self):
+        while True:
+            now = time.monotonic()
+            while self._retries and self._retries[0][0] <= now:
+                _, _, key = heapq.heappop(self._retries)
+                self._ready.put_nowait(key)
+            wait = self._retries[0][0] - now if self._retries else 0.5
+            await asyncio.sleep(min(max(wait, 0.01), 0.5))
+
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        while self._completed_at and now - self._completed_at[0] > 60:
+            self._completed_at.popleft()
+        elapsed = now - self._started
+        return {
+            "mode": "concurrent",
+            "workers": self.workers,
+            "delivered": self._delivered,
+            "dlq": self._dlq,
+            "attempts": self._attempts,
+            "throughput_per_sec_1m": round(len(self._completed_at) / min(60, max(elapsed, 1)), 2),
+            "in_flight": len(self._window),
+            "ready_queue_depth": self._ready.qsize(),
+            "retry_queue_depth": len(self._retries),
+            "active_entities": len(self._by_key),
+            "delivery_latency_ms": summarize(self._latencies_ms),
+            "checkpoint_offset": self.cursor.offset,
+            "updated_at": datetime.utcnow().isoformat(),
+        }
+
+    async def run_loop(self, interval: int = 5):
+        logger.info(f"Concurrent outbox dispatcher started (workers={self.workers}, interval={interval}s)")
+        tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        tasks.append(asyncio.create_task(self._retry_scheduler()))
+        last_stats = 0.0
+        try:
+            while True:
+                # Cleared before admitting so a drain during admission still wakes us
+                self._refill.clear()
+                try:
+                    self._admit()
+                    if time.monotonic() - last_stats >= STATS_INTERVAL:
+                        last_stats = time.monotonic()
+                        stats = self.get_stats()
+                        FileStore.write_json(STATS_PATH, stats)
+                        logger.info(
+                            f"Outbox: {stats['throughput_per_sec_1m']}/s, "
+                            f"in_flight={stats['in_flight']}, retry={stats['retry_queue_depth']}, "
+                            f"p99={stats['delivery_latency_ms']['p99']}ms"
+                        )
+                except Exception as e:
+                    logger.error(f"Outbox dispatcher error: {e}")
+                # Woken early when workers drain the window; otherwise poll for new events
+                try:
+                    await asyncio.wait_for(self._refill.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -1,11 +1,35 @@
-"""Reconciliation job - compares ledger against settlement CSV."""
+"""Reconciliation job - compares ledger against settlement CSVs.
+
+Both inputs are streamed, externally sorted by payment_id in chunks of
+RECON_CHUNK_SIZE records, and merge-joined in a single pass, so memory stays
+bounded regardless of the size of a settlement day. Mismatches are written
+line by line to reconciliation_mismatches_{date}.jsonl; the JSON report keeps
+the totals and the first RECON_REPORT_SAMPLE mismatches.
+
+The settlement side is the day's per-provider partitions listed in the
+settlement manifest. When there are several and together they exceed
+RECON_PARALLEL_MIN_BYTES, each is parsed (and sorted into runs, or loaded
+into arrays) in its own worker process while the ledger is read here.
+
+RECON_ENGINE=columnar switches to the NumPy engine in
+reconciliation_columnar.py, which is much faster on large days but holds the
+day's ids and amounts in memory. Both engines produce identical reports.
+"""
 
 import os
+import json
 import logging
+import tempfile
+import multiprocessing
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from collections import defaultdict
+from typing import Callable, Iterator, Optional
 
 from shared.file_store import FileStore
+from shared.settlement_manifest import SettlementManifest
+from external_sort import sort_runs, iter_sorted, last_per_key, merge_join
+import reconciliation_columnar
 
 logger = logging.getLogger("ledger-jobs.reconciliation")
 
@@ -14,106 +38,245 @@ LEDGER_PATH = os.path.join(DATA_DIR, "ledger", "payments.jsonl")
 SETTLEMENT_DIR = os.path.join(DATA_DIR, "settlement")
 RECON_DIR = os.path.join(DATA_DIR, "reconciliation")
 
+RECON_CHUNK_SIZE = int(os.environ.get("RECON_CHUNK_SIZE", 100000))
+RECON_REPORT_SAMPLE = int(os.environ.get("RECON_REPORT_SAMPLE", 100))
+RECON_ENGINE = os.environ.get("RECON_ENGINE", "stream")
+RECON_INGEST_WORKERS = int(os.environ.get("RECON_INGEST_WORKERS", min(4, os.cpu_count() or 1)))
+# Below this many settlement bytes, process start-up costs more than parsing partitions inline
+RECON_PARALLEL_MIN_BYTES = int(os.environ.get("RECON_PARALLEL_MIN_BYTES", 8 * 1024 * 1024))
+
+settlements = SettlementManifest(SETTLEMENT_DIR)
+
+
+def partition_suffix(date: str, provider: Optional[str] = None) -> str:
+    return f"{date}_{provider}" if provider else date
+
+
+def report_path(date: str, provider: Optional[str] = None) -> str:
+    return os.path.join(RECON_DIR, f"reconciliation_report_{partition_suffix(date, provider)}.json")
+
+
+def _partition_records(path: str, provider: Optional[str] = None) -> Iterator[tuple[str, int, str]]:
+    """(payment_id, amount, currency) per settlement row; with provider, only rows tagged with it."""
+    columns = ["payment_id", "amount", "currency", "provider"]
+    for pid, amount, currency, row_provider in FileStore.iter_csv_columns(path, columns):
+        if provider and row_provider != provider:
+            continue
+        yield pid, int(amount or 0), currency or "USD"
+
+
+def _sort_partition(path: str, provider: Optional[str], run_dir: str, chunk_size: int, prefix: str) -> list[str]:
+    return sort_runs(_partition_records(path, provider), run_dir, chunk_size, prefix)
+
+
+def _load_partition(path: str, provider: Optional[str]) -> list:
+    return reconciliation_columnar.load_columns(_partition_records(path, provider), 3)
+
+
+class _Tally:
+    """Counts, totals and mismatch output shared by both engines."""
+
+    def __init__(self, out, sample_size: int):
+        self.out = out
+        self.sample_size = sample_size
+        self.matched = 0
+        self.mismatched = 0
+        self.missing_from_settlement = 0
+        self.missing_from_ledger = 0
+        self.total_ledger = 0
+        self.total_settlement = 0
+        self.by_currency: dict[str, dict] = {}
+        self.ledger_by_provider: dict[str, int] = {}
+        self.sample = []
+
+    def currency(self, code: str) -> dict:
+        totals = self.by_currency.get(code)
+        if totals is None:
+            totals = self.by_currency[code] = {"ledger": 0, "settlement": 0}
+        return totals
+
+    def mismatch(self, record: dict):
+        self.out.write(json.dumps(record) + "\n")
+        if len(self.sample) < self.sample_size:
+            self.sample.append(record)
+
 
 class ReconciliationJob:
 
-    def reconcile(self, date: str = None):
+    def __init__(self, chunk_size: int = RECON_CHUNK_SIZE, engine: str = RECON_ENGINE,
+                 ingest_workers: int = RECON_INGEST_WORKERS):
+        self.chunk_size = chunk_size
+        self.ingest_workers = max(1, ingest_workers)
+        if engine == "columnar" and not reconciliation_columnar.available():
+            logger.warning("RECON_ENGINE=columnar needs numpy; using the streaming engine")
+            engine = "stream"
+        self.engine = engine
+
+    @staticmethod
+    def _ledger_records(date: str, provider: Optional[str] = None,
+                        ledger_path: str = LEDGER_PATH) -> Iterator[tuple[str, int, str, str]]:
+        """(payment_id, amount, currency, provider) for captured/settled ledger entries stamped on date."""
+        if not os.path.exists(ledger_path):
+            return
+        needle = date.encode()
+        with open(ledger_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Torn trailing append
+                # Substring checks reject other days and event types without decoding the line
+                if needle not in line or (b"payment.captured" not in line and b"payment.settled" not in line):
+                    continue
+                entry = json.loads(line)
+                if entry.get("type") not in ("payment.captured", "payment.settled"):
+                    continue
+                timestamp = entry.get("timestamp", "")
+                if not isinstance(timestamp, str) or not timestamp.startswith(date):
+                    continue
+                entry_provider = entry.get("provider") or "unknown"
+                if provider and entry_provider != provider:
+                    continue
+                yield (
+                    entry.get("ref", ""),
+                    int(entry.get("amount", 0)),
+                    entry.get("currency") or "USD",
+                    entry_provider,
+                )
+
+    def _ingest(self, stack: ExitStack, worker: Callable, jobs: list[tuple], size: int) -> Callable[[], list]:
+        """Start worker(*job) for each settlement partition; the returned callable yields results in job order.
+
+        Workers run in a process pool (shut down with stack) when there are
+        several partitions and enough bytes to be worth it, otherwise inline
+        when the results are collected.
+        """
+        if len(jobs) < 2 or self.ingest_workers < 2 or size < RECON_PARALLEL_MIN_BYTES:
+            return lambda: [worker(*job) for job in jobs]
+        pool = stack.enter_context(ProcessPoolExecutor(
+            max_workers=min(self.ingest_workers, len(jobs)), mp_context=multiprocessing.get_context("spawn"),
+        ))
+        futures = [pool.submit(worker, *job) for job in jobs]
+        return lambda: [future.result() for future in futures]
+
+    def _join_stream(self, ledger_records: Iterator[tuple], partitions: list[dict],
+                     provider: Optional[str], tally: _Tally):
+        size = sum(p.get("bytes", 0) for p in partitions)
+        with tempfile.TemporaryDirectory(prefix=".recon-", dir=RECON_DIR) as run_dir, ExitStack() as stack:
+            # Distinct run prefixes per partition; merged in partition order so duplicates resolve as if read in sequence
+            collect = self._ingest(stack, _sort_partition, [
+                (os.path.join(SETTLEMENT_DIR, p["file"]), provider, run_dir, self.chunk_size, f"settlement{i:03d}")
+                for i, p in enumerate(partitions)
+            ], size)
+            ledger_runs = sort_runs(ledger_records, run_dir, self.chunk_size, "ledger")
+            settlement_runs = [path for runs in collect() for path in runs]
+            ledger = last_per_key(iter_sorted(ledger_runs))
+            settlement = last_per_key(iter_sorted(settlement_runs))
+
+            for pid, lrec, srec in merge_join(ledger, settlement):
+                ledger_amt = lrec[1] if lrec else None
+                settle_amt = srec[1] if srec else None
+                if lrec:
+                    tally.total_ledger += ledger_amt
+                    tally.currency(lrec[2])["ledger"] += ledger_amt
+                    tally.ledger_by_provider[lrec[3]] = tally.ledger_by_provider.get(lrec[3], 0) + ledger_amt
+                if srec:
+                    tally.total_settlement += settle_amt
+                    tally.currency(srec[2])["settlement"] += settle_amt
+
+                if ledger_amt is None:
+                    tally.missing_from_ledger += 1
+                    tally.mismatch({
+                        "payment_id": pid,
+                        "ledger_amount": None,
+                        "settlement_amount": settle_amt,
+                        "issue": "missing_from_ledger",
+                    })
+                elif settle_amt is None:
+                    tally.missing_from_settlement += 1
+                    tally.mismatch({
+                        "payment_id": pid,
+                        "ledger_amount": ledger_amt,
+                        "settlement_amount": None,
+                        "issue": "missing_from_settlement",
+                    })
+                elif ledger_amt != settle_amt:
+                    tally.mismatched += 1
+                    tally.mismatch({
+                        "payment_id": pid,
+                        "ledger_amount": ledger_amt,
+                        "settlement_amount": settle_amt,
+                        "diff": ledger_amt - settle_amt,
+                        "issue": "amount_mismatch",
+                    })
+                else:
+                    tally.matched += 1
+
+    def reconcile(self, date: str = None, provider: Optional[str] = None,
+                  ledger_path: str = LEDGER_PATH, input_hash: Optional[str] = None):
+        """Reconcile one day, or one provider's share of it.
+
+        ledger_path may point at a pre-filtered extract of the ledger (see
+        reconciliation_runner); input_hash is recorded in the report so
+        unchanged partitions can be skipped next time.
+        """
         if date is None:
             date = datetime.utcnow().strftime("%Y-%m-%d")
 
         os.makedirs(RECON_DIR, exist_ok=True)
+        suffix = partition_suffix(date, provider)
+        mismatches_name = f"reconciliation_mismatches_{suffix}.jsonl"
+        mismatches_path = os.path.join(RECON_DIR, mismatches_name)
+        ledger_records = self._ledger_records(date, provider, ledger_path)
+        partitions = settlements.partitions(date, provider)
+
+        # Written beside the final path and swapped in, so readers never see a partial report
+        fd, tmp = tempfile.mkstemp(dir=RECON_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as out:
+                tally = _Tally(out, RECON_REPORT_SAMPLE)
+                if self.engine == "columnar":
+                    with ExitStack() as stack:
+                        collect = self._ingest(stack, _load_partition, [
+                            (os.path.join(SETTLEMENT_DIR, p["file"]), provider) for p in partitions
+                        ], sum(p.get("bytes", 0) for p in partitions))
+                        ledger_columns = reconciliation_columnar.load_columns(ledger_records, 4)
+                        settlement_columns = reconciliation_columnar.concat_columns(collect(), 3)
+                    reconciliation_columnar.reconcile_columns(ledger_columns, settlement_columns, tally)
+                else:
+                    self._join_stream(ledger_records, partitions, provider, tally)
+            os.replace(tmp, mismatches_path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
 
-        # Load ledger totals for captured/settled payments
-        entries = FileStore.read_jsonl(LEDGER_PATH)
-        ledger_amounts = {}
-        for entry in entries:
-            if entry.get("type") in ("payment.captured", "payment.settled"):
-                ref = entry.get("ref", "")
-                ledger_amounts[ref] = int(entry.get("amount", 0))
-
-        # Load settlement CSV
-        csv_path = os.path.join(SETTLEMENT_DIR, f"settlement_{date}.csv")
-        settlement_rows = FileStore.read_csv(csv_path)
-        settlement_amounts = {}
-        for row in settlement_rows:
-            pid = row.get("payment_id", "")
-            settlement_amounts[pid] = int(row.get("amount", 0))
-
-        # Compare
-        all_ids = set(ledger_amounts.keys()) | set(settlement_amounts.keys())
-        matched = 0
-        mismatched = 0
-        missing_from_settlement = 0
-        missing_from_ledger = 0
-        mismatches = []
-
-        for pid in all_ids:
-            ledger_amt = ledger_amounts.get(pid)
-            settle_amt = settlement_amounts.get(pid)
-
-            if ledger_amt is None:
-                missing_from_ledger += 1
-                mismatches.append({
-                    "payment_id": pid,
-                    "ledger_amount": None,
-                    "settlement_amount": settle_amt,
-                    "issue": "missing_from_ledger",
-                })
-            elif settle_amt is None:
-                missing_from_settlement += 1
-                mismatches.append({
-                    "payment_id": pid,
-                    "ledger_amount": ledger_amt,
-                    "settlement_amount": None,
-                    "issue": "missing_from_settlement",
-                })
-            elif ledger_amt != settle_amt:
-                mismatched += 1
-                mismatches.append({
-                    "payment_id": pid,
-                    "ledger_amount": ledger_amt,
-                    "settlement_amount": settle_amt,
-                    "diff": ledger_amt - settle_amt,
-                    "issue": "amount_mismatch",
-                })
-            else:
-                matched += 1
-
-        total_ledger = sum(ledger_amounts.values())
-        total_settlement = sum(settlement_amounts.values())
-
-        status = "clean" if not mismatches else "mismatches_found"
+        total_mismatches = tally.mismatched + tally.missing_from_settlement + tally.missing_from_ledger
+        status = "clean" if not total_mismatches else "mismatches_found"
         report = {
             "date": date,
+            "provider": provider,
             "status": status,
-            "total_ledger": total_ledger,
-            "total_settlement": total_settlement,
-            "diff": total_ledger - total_settlement,
-            "matched": matched,
-            "mismatched": mismatched,
-            "missing_from_settlement": missing_from_settlement,
-            "missing_from_ledger": missing_from_ledger,
-            "mismatches": mismatches,
+            "total_ledger": tally.total_ledger,
+            "total_settlement": tally.total_settlement,
+            "diff": tally.total_ledger - tally.total_settlement,
+            "matched": tally.matched,
+            "mismatched": tally.mismatched,
+            "missing_from_settlement": tally.missing_from_settlement,
+            "missing_from_ledger": tally.missing_from_ledger,
+            "totals_by_currency": {c: tally.by_currency[c] for c in sorted(tally.by_currency)},
+            "ledger_totals_by_provider": {p: tally.ledger_by_provider[p] for p in sorted(tally.ledger_by_provider)},
+            "mismatches": tally.sample,
+            "mismatches_total": total_mismatches,
+            "mismatches_file": mismatches_name,
+            "settlement_files": [p["file"] for p in partitions],
+            "input_hash": input_hash,
             "generated_at": datetime.utcnow().isoformat(),
         }
 
-        report_path = os.path.join(RECON_DIR, f"reconciliation_report_{date}.json")
-        FileStore.write_json(report_path, report)
+        FileStore.write_json(report_path(date, provider), report)
 
         logger.info(
-            f"Reconciliation {date}: {matched} matched, "
-            f"{mismatched} mismatched, {missing_from_settlement} missing from settlement, "
-            f"{missing_from_ledger} missing from ledger"
+            f"Reconciliation {suffix} ({self.engine} engine): {tally.matched} matched, "
+            f"{tally.mismatched} mismatched, {tally.missing_from_settlement} missing from settlement, "
+            f"{tally.missing_from_ledger} missing from ledger"
         )
         return report
-
-    async def run_loop(self, interval: int = 3600):
-        import asyncio
-        logger.info(f"Reconciliation job started (interval={interval}s)")
-        while True:
-            try:
-                today = datetime.utcnow().strftime("%Y-%m-%d")
-                self.reconcile(today)
-            except Exception as e:
-                logger.error(f"Reconciliation error: {e}")
-            await asyncio.sleep(interval)
@@ -0,0 +1,246 @@
+"""Reconciliation over a date range and provider set, fanned out over a process pool.
+
+Each (date, provider) pair is a partition; provider None means the whole day,
+which is what the hourly loop uses. The runner:
+
+1. Scans the ledger once, copying each partition's captured/settled lines to
+   its own extract file and hashing them as it goes.
+2. Combines that hash with the manifest checksums of the settlement
+   partitions it will read. Partitions whose combined hash matches the
+   input_hash of their existing report are skipped.
+3. Reconciles the rest in worker processes (ReconciliationJob against the
+   extract), and merges every partition's report into one summary under
+   reconciliation/runs/.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Optional
+
+from shared.file_store import FileStore
+from reconciliation import (
+    ReconciliationJob, LEDGER_PATH, RECON_DIR, RECON_CHUNK_SIZE, RECON_ENGINE,
+    partition_suffix, report_path, settlements,
+)
+
+logger = logging.getLogger("ledger-jobs.reconciliation")
+
+RUNS_DIR = os.path.join(RECON_DIR, "runs")
+RECON_WORKERS = int(os.environ.get("RECON_WORKERS", min(4, os.cpu_count() or 1)))
+RECON_LOOKBACK_DAYS = int(os.environ.get("RECON_LOOKBACK_DAYS", 1))
+RECON_PROVIDERS = [p for p in os.environ.get("RECON_PROVIDERS", "").split(",") if p]
+# Extract lines buffered across all partitions before they are flushed to disk
+EXTRACT_BUFFER_LINES = 20000
+
+_COUNTERS = ("matched", "mismatched", "missing_from_settlement", "missing_from_ledger",
+             "total_ledger", "total_settlement")
+
+
+def date_range(start: str, end: str) -> list[str]:
+    first = datetime.strptime(start, "%Y-%m-%d")
+    last = datetime.strptime(end, "%Y-%m-%d")
+    return [(first + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((last - first).days + 1)]
+
+
+def settlement_digest(date: str, provider: Optional[str]) -> str:
+    """Hash of the settlement files a partition reads, from their manifest checksums."""
+    entries = settlements.partitions(date, provider)
+    return hashlib.sha256(",".join(f"{e['file']}:{e['checksum']}" for e in entries).encode()).hexdigest()
+
+
+def _reconcile_partition(date: str, provider: Optional[str], ledger_path: str, input_hash: str,
+                         engine: str, chunk_size: int) -> dict:
+    """Worker entry point; returns the report without its inline mismatch sample."""
+    job = ReconciliationJob(chunk_size=chunk_size, engine=engine)
+    report = job.reconcile(date, provider, ledger_path=ledger_path, input_hash=input_hash)
+    report.pop("mismatches", None)
+    return report
+
+
+class ReconciliationRunner:
+
+    def __init__(self, workers: int = RECON_WORKERS, engine: str = RECON_ENGINE,
+                 chunk_size: int = RECON_CHUNK_SIZE):
+        self.workers = max(1, workers)
+        self.engine = engine
+        self.chunk_size = chunk_size
+
+    def _split_ledger(self, dates: list[str], providers: Optional[list[str]], extract_dir: str) -> dict:
+        """One ledger pass: {(date, provider): (extract path, sha256 of its lines)}."""
+        wanted_dates = set(dates)
+        wanted_providers = set(providers) if providers else None
+        digests: dict[tuple, "hashlib._Hash"] = {}
+        paths: dict[tuple, str] = {}
+        buffers: dict[tuple, list] = {}
+        buffered = 0
+
+        def flush():
+            for key, lines in buffers.items():
+                with open(paths[key], "ab") as out:
+                    out.writelines(lines)
+            buffers.clear()
+
+        if os.path.exists(LEDGER_PATH):
+            with open(LEDGER_PATH, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # Torn trailing append
+                    if b"payment.captured" not in line and b"payment.settled" not in line:
+                        continue
+                    entry = json.loads(line)
+                    if entry.get("type") not in ("payment.captured", "payment.settled"):
+                        continue
+                    timestamp = entry.get("timestamp", "")
+                    date = timestamp[:10] if isinstance(timestamp, str) else ""
+                    if date not in wanted_dates:
+                        continue
+                    provider = entry.get("provider") or "unknown"
+                    if wanted_providers is not None and provider not in wanted_providers:
+                        continue
+                    key = (date, provider if wanted_providers is not None else None)
+                    if key not in paths:
+                        paths[key] = os.path.join(extract_dir, f"ledger_{partition_suffix(*key)}.jsonl")
+                        digests[key] = hashlib.sha256()
+                    digests[key].update(line)
+                    buffers.setdefault(key, []).append(line)
+                    buffered += 1
+                    if buffered >= EXTRACT_BUFFER_LINES:
+                        flush()
+                        buffered = 0
+        flush()
+        return {key: (paths[key], digests[key].hexdigest()) for key in paths}
+
+    def run(self, start_date: str, end_date: str, providers: Optional[list[str]] = None,
+            force: bool = False) -> dict:
+        started = time.perf_counter()
+        dates = date_range(start_date, end_date)
+        partitions = [(d, p) for d in dates for p in (providers or [None])]
+        os.makedirs(RUNS_DIR, exist_ok=True)
+        empty_digest = hashlib.sha256().hexdigest()
+
+        results: dict[tuple, dict] = {}
+        with tempfile.TemporaryDirectory(prefix=".runner-", dir=RECON_DIR) as extract_dir:
+            extracts = self._split_ledger(dates, providers, extract_dir)
+            todo = []
+            for date, provider in partitions:
+                ledger_path, ledger_digest = extracts.get(
+                    (date, provider), (os.path.join(extract_dir, "empty.jsonl"), empty_digest)
+                )
+                input_hash = hashlib.sha256(
+                    f"{ledger_digest}:{settlement_digest(date, provider)}".encode()
+                ).hexdigest()
+                prior_path = report_path(date, provider)
+                if not force and os.path.exists(prior_path):
+                    prior = FileStore.read_json(prior_path, default={})
+                    if prior.get("input_hash") == input_hash:
+                        prior.pop("mismatches", None)
+                        results[(date, provider)] = {**prior, "skipped": True}
+                        continue
+                todo.append((date, provider, ledger_path, input_hash))
+
+            if todo:
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(max_workers=min(self.workers, len(todo)), mp_context=context) as pool:
+                    futures = {
+                        pool.submit(_reconcile_partition, date, provider, ledger_path, input_hash,
+                                    self.engine, self.chunk_size): (date, provider)
+                        for date, provider, ledger_path, input_hash in todo
+                    }
+                    for future in as_completed(futures):
+                        date, provider = futures[future]
+                        try:
+                            results[(date, provider)] = {**future.result(), "skipped": False}
+                        except Exception as e:
+                            logger.error(f"Reconciliation {partition_suffix(date, provider)} failed: {e}")
+                            results[(date, provider)] = {
+                                "date": date, "provider": provider, "status": "error",
+                                "error": str(e), "skipped": False,
+                            }
+
+        summary = self._summarize(start_date, end_date, providers, partitions, results)
+        # Reports are engine-independent; which engine produced this run is recorded here
+        summary["engine"] = self.engine
+        summary["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+        summary_path = os.path.join(RUNS_DIR, f"summary_{start_date}_{end_date}.json")
+        FileStore.write_json(summary_path, summary)
+        logger.info(
+            f"Reconciliation {start_date}..{end_date}: {summary['reconciled']} reconciled, "
+            f"{summary['skipped']} unchanged, {summary['failed']} failed in {summary['elapsed_seconds']}s "
+            f"({self.engine} engine)"
+        )
+        return summary
+
+    @staticmethod
+    def _summarize(start_date: str, end_date: str, providers: Optional[list[str]],
+                   partitions: list[tuple], results: dict) -> dict:
+        totals = dict.fromkeys(_COUNTERS, 0)
+        by_currency: dict[str, dict] = {}
+        by_provider: dict[str, int] = {}
+        rows = []
+        for key in partitions:
+            report = results[key]
+            rows.append({
+                "date": report["date"],
+                "provider": report.get("provider"),
+                "status": report["status"],
+                "skipped": report.get("skipped", False),
+                **{k: report.get(k, 0) for k in _COUNTERS},
+                "mismatches_file": report.get("mismatches_file"),
+                "error": report.get("error"),
+            })
+            if report["status"] == "error":
+                continue
+            for k in _COUNTERS:
+                totals[k] += report.get(k, 0)
+            for currency, amounts in report.get("totals_by_currency", {}).items():
+                merged = by_currency.setdefault(currency, {"ledger": 0, "settlement": 0})
+                merged["ledger"] += amounts["ledger"]
+                merged["settlement"] += amounts["settlement"]
+            for provider, amount in report.get("ledger_totals_by_provider", {}).items():
+                by_provider[provider] = by_provider.get(provider, 0) + amount
+
+        failed = sum(1 for r in rows if r["status"] == "error")
+        if failed:
+            status = "errors"
+        elif any(r["status"] != "clean" for r in rows):
+            status = "mismatches_found"
+        else:
+            status = "clean"
+        return {
+            "start_date": start_date,
+            "end_date": end_date,
+            "providers": providers,
+            "status": status,
+            "partitions": len(rows),
+            "reconciled": sum(1 for r in rows if not r["skipped"] and r["status"] != "error"),
+            "skipped": sum(1 for r in rows if r["skipped"]),
+            "failed": failed,
+            **totals,
+            "diff": totals["total_ledger"] - totals["total_settlement"],
+            "totals_by_currency": {c: by_currency[c] for c in sorted(by_currency)},
+            "ledger_totals_by_provider": {p: by_provider[p] for p in sorted(by_provider)},
+            "results": rows,
+            "generated_at": datetime.utcnow().isoformat(),
+        }
+
+    async def run_loop(self, interval: int = 3600):
+        import asyncio
+        logger.info(f"Reconciliation job started (interval={interval}s, lookback={RECON_LOOKBACK_DAYS}d)")
+        while True:
+            try:
+                today = datetime.utcnow()
+                start = (today - timedelta(days=RECON_LOOKBACK_DAYS)).strftime("%Y-%m-%d")
+                # Late settlement rows for earlier days are picked up; unchanged days are skipped
+                await asyncio.to_thread(
+                    self.run, start, today.strftime("%Y-%m-%d"), RECON_PROVIDERS or None,
+                )
+            except Exception as e:
+                logger.error(f"Reconciliation error: {e}")
+            await asyncio.sleep(interval)
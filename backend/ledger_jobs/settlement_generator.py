@@ -1,118 +1,183 @@
-"""Settlement generator - creates daily settlement CSV from ledger."""
+"""Settlement generator - incrementally builds daily settlement CSVs from the ledger.
+
+Each run reads only ledger entries appended since the last checkpoint
+(JsonlCursor over ledger/payments.jsonl). Captured payments waiting to be
+promoted to `settled` are carried in the checkpoint, and each captured or
+settled entry is appended to the partition for its day and provider
+(settlement_{date}_{provider}.csv, see shared.settlement_manifest), whose
+manifest entry is refreshed after every append. Rows are de-duplicated per
+partition against what the file already holds, so replaying a batch after a
+crash does not write a payment twice.
+"""
 
 import os
 import logging
 import uuid
+from collections import OrderedDict
 from datetime import datetime
 
-from shared.file_store import FileStore
+from shared.file_store import FileStore, JsonlCursor
+from shared.record_store import RecordStore
+from shared.settlement_manifest import SettlementManifest
 
 logger = logging.getLogger("ledger-jobs.settlement")
 
 DATA_DIR = os.environ.get("DATA_DIR", "/app/data")
 LEDGER_PATH = os.path.join(DATA_DIR, "ledger", "payments.jsonl")
 SETTLEMENT_DIR = os.path.join(DATA_DIR, "settlement")
-PAYMENTS_STORE = os.path.join(DATA_DIR, "idempotency", "payments_store.json")
+CHECKPOINT_PATH = os.path.join(SETTLEMENT_DIR, "settlement_checkpoint.json")
+PAYMENTS_STORE = os.path.join(DATA_DIR, "idempotency", "payments_store.jsonl")
+LEGACY_PAYMENTS_STORE = os.path.join(DATA_DIR, "idempotency", "payments_store.json")
 OUTBOX_PATH = os.path.join(DATA_DIR, "outbox", "events.jsonl")
 
+SETTLEMENT_BATCH_SIZE = int(os.environ.get("SETTLEMENT_BATCH_SIZE", 5000))
+# Partitions whose settled payment ids are kept in memory for de-duplication
+SETTLEMENT_CACHED_PARTITIONS = 32
+
 CSV_HEADERS = [
     "payment_id", "provider_ref", "amount", "currency",
-    "type", "status", "settled_at",
+    "type", "status", "settled_at", "provider",
 ]
+SETTLEMENT_TYPES = ("payment.captured", "payment.settled")
 
 
 class SettlementGenerator:
 
-    def generate(self, date: str = None):
-        if date is None:
-            date = datetime.utcnow().strftime("%Y-%m-%d")
-
-        entries = FileStore.read_jsonl(LEDGER_PATH)
-        payments = FileStore.read_json(PAYMENTS_STORE, default={})
-        settled_refs = {e.get("ref") for e in entries if e.get("type") == "payment.settled"}
-
-        # Filter captured/settled entries for the target date (for CSV)
-        rows = []
-        seen_payments = set()
-
-        # Promote captured payments to settled regardless of capture date
+    def __init__(self):
+        self.payments = RecordStore(PAYMENTS_STORE, legacy_path=LEGACY_PAYMENTS_STORE)
+        self.cursor = JsonlCursor(LEDGER_PATH, CHECKPOINT_PATH)
+        self.manifest = SettlementManifest(SETTLEMENT_DIR)
+        # Payment ids per (date, provider) already in that partition, loaded from the file on first use
+        self._partition_ids: OrderedDict[tuple, set] = OrderedDict()
+
+    def _ids_for_partition(self, date: str, provider: str) -> set:
+        key = (date, provider)
+        ids = self._partition_ids.get(key)
+        if ids is None:
+            path = self.manifest.path(date, provider)
+            ids = {pid for (pid,) in FileStore.iter_csv_columns(path, ["payment_id"])}
+            self._partition_ids[key] = ids
+            if len(self._partition_ids) > SETTLEMENT_CACHED_PARTITIONS:
+                self._partition_ids.popitem(last=False)
+        else:
+            self._partition_ids.move_to_end(key)
+        return ids
+
+    def _promote(self, payment_id: str, entry: dict, settled_entries: list, outbox_events: list) -> bool:
+        """Move a captured payment to settled; returns False if it should be retried later."""
+        now = datetime.utcnow().isoformat()
+        # Conditional on the state under the store lock, so a refund or dispute
+        # landing concurrently is never overwritten with a stale copy
+        payment = self.payments.update(
+            payment_id, {"state": "settled", "updated_at": now}, only_if={"state": "captured"},
+        )
+        if payment is None:
+            # Not visible yet (keep it pending), or already settled/refunded/disputed since capture
+            return self.payments.get(payment_id) is not None
+
+        settled_entries.append({
+            "event_id": f"evt_{uuid.uuid4().hex[:12]}",
+            "type": "payment.settled",
+            "ref": payment_id,
+            "amount": entry.get("amount", 0),
+            "currency": entry.get("currency", "USD"),
+            "merchant_id": payment.get("merchant_id", ""),
+            "provider": entry.get("provider"),
+            "correlation_id": "corr_settlement_job",
+            "timestamp": now,
+            "metadata": payment,
+        })
+        outbox_events.append({
+            "event_id": f"oevt_{uuid.uuid4().hex[:12]}",
+            "type": "payment.settled",
+            "payload": payment,
+            "correlation_id": "corr_settlement_job",
+            "created_at": now,
+        })
+        return True
+
+    def _process_batch(self, entries: list[dict], pending: dict) -> dict[str, list]:
+        """Promote captured payments and collect new CSV rows per (date, provider) for one ledger batch."""
+        rows_by_partition: dict[tuple, list] = {}
         for entry in entries:
-            if entry.get("type") not in ("payment.captured", "payment.settled"):
+            if entry.get("type") not in SETTLEMENT_TYPES:
                 continue
             payment_id = entry.get("ref", "")
-            payment = payments.get(payment_id)
-            if not payment:
-                continue
-            if payment.get("state") == "captured" and payment_id not in settled_refs:
-                payment["state"] = "settled"
-                payment["updated_at"] = datetime.utcnow().isoformat()
-                payments[payment_id] = payment
-
-                settled_entry = {
-                    "event_id": f"evt_{uuid.uuid4().hex[:12]}",
-                    "type": "payment.settled",
-                    "ref": payment_id,
+            if entry["type"] == "payment.captured":
+                pending[payment_id] = {
                     "amount": entry.get("amount", 0),
                     "currency": entry.get("currency", "USD"),
-                    "merchant_id": payment.get("merchant_id", ""),
                     "provider": entry.get("provider"),
-                    "correlation_id": "corr_settlement_job",
-                    "timestamp": datetime.utcnow().isoformat(),
-                    "metadata": payment,
-                }
-                FileStore.append_jsonl(LEDGER_PATH, settled_entry)
-
-                outbox_event = {
-                    "event_id": f"oevt_{uuid.uuid4().hex[:12]}",
-                    "type": "payment.settled",
-                    "payload": payment,
-                    "correlation_id": "corr_settlement_job",
-                    "created_at": datetime.utcnow().isoformat(),
                 }
-                FileStore.append_jsonl(OUTBOX_PATH, outbox_event)
-
-        for entry in entries:
-            if entry.get("type") not in ("payment.captured", "payment.settled"):
-                continue
+            else:
+                pending.pop(payment_id, None)
 
             timestamp = entry.get("timestamp", "")
-            if isinstance(timestamp, str) and timestamp.startswith(date):
-                payment_id = entry.get("ref", "")
-                if payment_id in seen_payments:
-                    continue
-                seen_payments.add(payment_id)
-
-                metadata = entry.get("metadata", {})
-                rows.append({
-                    "payment_id": payment_id,
-                    "provider_ref": metadata.get("provider_ref", ""),
-                    "amount": entry.get("amount", 0),
-                    "currency": entry.get("currency", "USD"),
-                    "type": entry.get("type", ""),
-                    "status": "settled",
-                    "settled_at": timestamp,
-                })
-
-
-        if rows:
-            csv_path = os.path.join(SETTLEMENT_DIR, f"settlement_{date}.csv")
-            FileStore.write_csv(csv_path, CSV_HEADERS, rows)
-            logger.info(f"Generated settlement for {date}: {len(rows)} rows")
-        else:
-            logger.info(f"No settled payments for {date}")
-
-        if payments:
-            FileStore.write_json(PAYMENTS_STORE, payments)
-
-        return rows
+            if not isinstance(timestamp, str) or len(timestamp) < 10:
+                continue
+            date = timestamp[:10]
+            provider = entry.get("provider") or "unknown"
+            partition_ids = self._ids_for_partition(date, provider)
+            if payment_id in partition_ids:
+                continue
+            partition_ids.add(payment_id)
+            metadata = entry.get("metadata", {})
+            rows_by_partition.setdefault((date, provider), []).append({
+                "payment_id": payment_id,
+                "provider_ref": metadata.get("provider_ref", ""),
+                "amount": entry.get("amount", 0),
+                "currency": entry.get("currency", "USD"),
+                "type": entry.get("type", ""),
+                "status": "settled",
+                "settled_at": timestamp,
+                "provider": provider,
+            })
+
+        # Promote captured payments regardless of capture date
+        settled_entries, outbox_events = [], []
+        for payment_id in list(pending):
+            if self._promote(payment_id, pending[payment_id], settled_entries, outbox_events):
+                del pending[payment_id]
+        # Settled entries land in the ledger after the cursor, so the next batch picks them up
+        FileStore.append_jsonl_many(LEDGER_PATH, settled_entries)
+        FileStore.append_jsonl_many(OUTBOX_PATH, outbox_events)
+        return rows_by_partition
+
+    def generate(self) -> list[dict]:
+        """Consume new ledger entries; returns the settlement rows appended by this run."""
+        appended = []
+        while True:
+            entries, end = self.cursor.read(limit=SETTLEMENT_BATCH_SIZE)
+            if end == self.cursor.offset:
+                break
+            pending = dict(self.cursor.state.get("pending", {}))
+            if end < self.cursor.offset:
+                # Ledger was rewritten; rebuild from the start and rely on per-partition de-duplication
+                logger.warning(f"{LEDGER_PATH} shrank below the checkpoint, re-reading from the start")
+                self._partition_ids.clear()
+            rows_by_partition = self._process_batch(entries, pending)
+            for (date, provider), rows in sorted(rows_by_partition.items()):
+                FileStore.append_csv(self.manifest.path(date, provider), CSV_HEADERS, rows)
+                self.manifest.record(self.manifest.file_name(date, provider))
+                logger.info(f"Appended {len(rows)} rows to settlement for {date} {provider}")
+                appended.extend(rows)
+            self.cursor.commit(end, {"pending": pending})
+
+        if self.cursor.state.get("pending"):
+            # Captures whose payment record was not readable yet
+            pending = dict(self.cursor.state["pending"])
+            before = len(pending)
+            self._process_batch([], pending)
+            if len(pending) != before:
+                self.cursor.commit(self.cursor.offset, {"pending": pending})
+        return appended
 
     async def run_loop(self, interval: int = 3600):
         import asyncio
         logger.info(f"Settlement generator started (interval={interval}s)")
         while True:
             try:
-                today = datetime.utcnow().strftime("%Y-%m-%d")
-                self.generate(today)
+                self.generate()
             except Exception as e:
                 logger.error(f"Settlement generator error: {e}")
             await asyncio.sleep(interval)
@@ -20,10 +20,10 @@ sys.path.insert(0, "/app/shared")
 from shared.file_store import FileStore
 from shared.correlation import get_correlation_id
 from shared.middleware import CorrelationMiddleware
+from shared.http_clients import http_clients
+from shared.settlement_manifest import SettlementManifest
 from failure_injection import FailureConfig, PROVIDER_PROFILES, DECLINE_REASONS
 
-import httpx
-
 logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
 logger = logging.getLogger("provider-sim")
 
@@ -38,6 +38,17 @@ WEBHOOK_CALLBACK_URL = os.environ.get("WEBHOOK_CALLBACK_URL", "http://api-gatewa
 SEED = int(os.environ.get("SEED", 42))
 
 rng = random.Random(SEED)
+settlements = SettlementManifest(SETTLEMENT_DIR)
+
+
+@app.on_event("startup")
+async def startup():
+    http_clients.open("webhook")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await http_clients.aclose()
 
 
 def _sim_state_path(provider_id: str) -> str:
@@ -90,7 +101,24 @@ async def send_webhook(event_type: str, data: dict, provider_id: str):
     })
     signature = sign_webhook(payload)
     try:
-        async with httpx.AsyncClient() as client:
+        client = http_clients.get("webhook")
+        await client.post(
+            WEBHOOK_CALLBACK_URL,
+            content=payload,
+            headers={
+                "Content-Type": "application/json",
+                "X-Webhook-Signature": signature,
+                "X-Correlation-Id": get_correlation_id(),
+            },
+            timeout=10.0,
+        )
+        logger.info(f"Webhook sent: {event_type} for provider {provider_id}")
+
+        # Duplicate webhook injection
+        config = get_provider_config(provider_id)
+        if rng.random() < config.duplicate_webhook_rate:
+            logger.info(f"Injecting duplicate webhook: {event_type}")
+            await asyncio.sleep(0.5)
             await client.post(
                 WEBHOOK_CALLBACK_URL,
                 content=payload,
@@ -101,24 +129,6 @@ async def send_webhook(event_type: str, data: dict, provider_id: str):
                 },
                 timeout=10.0,
             )
-        logger.info(f"Webhook sent: {event_type} for provider {provider_id}")
-
-        # Duplicate webhook injection
-        config = get_provider_config(provider_id)
-        if rng.random() < config.duplicate_webhook_rate:
-            logger.info(f"Injecting duplicate webhook: {event_type}")
-            await asyncio.sleep(0.5)
-            async with httpx.AsyncClient() as client:
-                await client.post(
-                    WEBHOOK_CALLBACK_URL,
-                    content=payload,
-                    headers={
-                        "Content-Type": "application/json",
-                        "X-Webhook-Signature": signature,
-                        "X-Correlation-Id": get_correlation_id(),
-                    },
-                    timeout=10.0,
-                )
     except Exception as e:
         logger.error(f"Webhook delivery failed: {e}")
 
@@ -330,15 +340,16 @@ async def generate_settlement(provider_id: str, date: Optional[str] = None):
     if date is None:
         date = datetime.utcnow().strftime("%Y-%m-%d")
 
-    # Read ledger to find captured/settled payments for this provider
+    # Read ledger to find this provider's captured/settled payments on that date
     ledger_path = os.path.join(DATA_DIR, "ledger", "payments.jsonl")
     entries = FileStore.read_jsonl(ledger_path)
 
     settlement_rows = []
     for entry in entries:
+        timestamp = entry.get("timestamp")
         if entry.get("provider") == provider_id and entry.get("type") in (
             "payment.captured", "payment.settled"
-        ):
+        ) and isinstance(timestamp, str) and timestamp.startswith(date):
             config = get_provider_config(provider_id)
             amount = entry.get("amount", 0)
             # Inject settlement mismatch
@@ -352,16 +363,21 @@ async def generate_settlement(provider_id: str, date: Optional[str] = None):
                 "currency": entry.get("currency", "USD"),
                 "type": entry.get("type", ""),
                 "status": "settled",
-                "settled_at": entry.get("timestamp", datetime.utcnow().isoformat()),
+                "settled_at": timestamp,
+                "provider": provider_id,
             })
 
-    csv_path = os.path.join(SETTLEMENT_DIR, f"settlement_{date}.csv")
-    headers = ["payment_id", "provider_ref", "amount", "currency", "type", "status", "settled_at"]
+    # The provider's statement is its own partition; reconciliation prefers it over the generated file
+    csv_path = settlements.path(date, provider_id, source="provider")
+    headers = ["payment_id", "provider_ref", "amount", "currency", "type", "status", "settled_at", "provider"]
     FileStore.write_csv(csv_path, headers, settlement_rows)
+    entry = settlements.record(os.path.basename(csv_path))
 
     return {
-        "file": f"settlement_{date}.csv",
-        "rows": len(settlement_rows),
+        "file": entry["file"],
+        "rows": entry["rows"],
+        "total_amount": entry["total_amount"],
+        "checksum": entry["checksum"],
         "provider": provider_id,
     }
 
@@ -369,3 +385,8 @@ async def generate_settlement(provider_id: str, date: Optional[str] = None):
 @app.get("/health")
 async def health():
     return {"status": "healthy", "service": "provider-sim"}
+
+
+@app.get("/metrics/http-pools")
+async def http_pool_stats():
+    return {"pools": http_clients.stats()}
@@ -1,47 +1,231 @@
-"""Fernet encryption with key rotation support via MultiFernet."""
+"""Vault encryption: key-ID-tagged ciphertexts over pluggable cipher suites (Fernet, AES-GCM)."""
 
-import json
 import os
-from cryptography.fernet import Fernet, MultiFernet
+import json
+import base64
+import hashlib
+import tempfile
+from typing import Optional, Union
+from filelock import FileLock
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# Suite used for keys created by rotation or bootstrap; existing keys keep theirs
+VAULT_CIPHER_SUITE = os.environ.get("VAULT_CIPHER_SUITE", "fernet")
+
+
+def key_id(key: str) -> str:
+    """Stable, non-secret identifier for a key, safe to log and checkpoint."""
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+# === Cipher suites ===
+
+class FernetSuite:
+    """AES-128-CBC + HMAC-SHA256. Fernet takes no associated data, so a wrong key id just fails the HMAC."""
+
+    name = "fernet"
+
+    def __init__(self, key: str):
+        self._fernet = Fernet(key.encode())
+
+    @staticmethod
+    def generate_key() -> str:
+        return Fernet.generate_key().decode()
+
+    def encrypt(self, plaintext: bytes, aad: bytes) -> str:
+        return self._fernet.encrypt(plaintext).decode()
+
+    def decrypt(self, payload: str, aad: bytes) -> bytes:
+        return self._fernet.decrypt(payload.encode())
+
+
+class AESGCMSuite:
+    """AES-256-GCM with a random 96-bit nonce; the ciphertext tag is bound as associated data."""
+
+    name = "aesgcm"
+
+    def __init__(self, key: str):
+        self._aead = AESGCM(base64.urlsafe_b64decode(key))
+
+    @staticmethod
+    def generate_key() -> str:
+        return base64.urlsafe_b64encode(AESGCM.generate_key(bit_length=256)).decode()
+
+    def encrypt(self, plaintext: bytes, aad: bytes) -> str:
+        nonce = os.urandom(12)
+        return base64.urlsafe_b64encode(nonce + self._aead.encrypt(nonce, plaintext, aad)).decode()
+
+    def decrypt(self, payload: str, aad: bytes) -> bytes:
+        try:
+            raw = base64.urlsafe_b64decode(payload)
+            return self._aead.decrypt(raw[:12], raw[12:], aad)
+        except (InvalidTag, ValueError):
+            raise InvalidToken
+
+
+CIPHER_SUITES = {suite.name: suite for suite in (FernetSuite, AESGCMSuite)}
+
+
+def _parse_entry(entry: Union[str, dict]) -> tuple[str, str, str]:
+    """(key id, suite, key) for a keys.json entry; bare strings are legacy Fernet keys."""
+    if isinstance(entry, str):
+        return key_id(entry), FernetSuite.name, entry
+    return entry.get("id") or key_id(entry["key"]), entry["suite"], entry["key"]
 
 
 class VaultCrypto:
+    """Key ring kept in memory and rebuilt only when keys.json changes.
+
+    Ciphertexts are stored as "<suite>:<key id>:<payload>", so decrypt does one
+    dict lookup and one cipher operation whatever the ring size. Untagged
+    ciphertexts from before tagging are plain Fernet tokens and are decrypted
+    with a MultiFernet over the ring's Fernet keys, as before.
 
-    def __init__(self, keys_path: str):
+    The cached ring is keyed by the file's (inode, size, mtime_ns), so a
+    rotation by this process or any other is picked up on the next call.
+    """
+
+    def __init__(self, keys_path: str, suite: str = VAULT_CIPHER_SUITE):
+        if suite not in CIPHER_SUITES:
+            raise ValueError(f"Unknown cipher suite {suite!r}; expected one of {sorted(CIPHER_SUITES)}")
         self.keys_path = keys_path
+        self.suite = suite
+        self._signature: Optional[tuple] = None
+        self._key_ids: list[str] = []
+        self._ring: dict[str, object] = {}
+        self._active: Optional[tuple[str, object, bytes]] = None
+        self._legacy: Optional[MultiFernet] = None
+        self._lock = FileLock(f"{keys_path}.lock")
         self._ensure_keys()
 
+    def _new_entry(self) -> dict:
+        key = CIPHER_SUITES[self.suite].generate_key()
+        return {"id": key_id(key), "suite": self.suite, "key": key}
+
     def _ensure_keys(self):
         if not os.path.exists(self.keys_path):
-            key = Fernet.generate_key().decode()
-            os.makedirs(os.path.dirname(self.keys_path), exist_ok=True)
-            with open(self.keys_path, "w") as f:
-                json.dump({"keys": [key], "active_key_index": 0}, f, indent=2)
+            self._write_keys({"keys": [self._new_entry()], "active_key_index": 0})
+
+    def _write_keys(self, data: dict):
+        """Replace keys.json atomically so readers never see a partial file."""
+        directory = os.path.dirname(self.keys_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp, self.keys_path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
 
-    def _load_keys(self) -> list[str]:
+    def _file_signature(self) -> tuple:
+        st = os.stat(self.keys_path)
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _load_keys(self) -> list[Union[str, dict]]:
         with open(self.keys_path, "r") as f:
             data = json.load(f)
         return data["keys"]
 
-    def _get_multi_fernet(self) -> MultiFernet:
-        keys = self._load_keys()
-        fernet_keys = [Fernet(k.encode()) for k in keys]
-        return MultiFernet(fernet_keys)
+    def invalidate(self):
+        self._signature = None
+
+    def _load_ring(self):
+        signature = self._file_signature()
+        if signature == self._signature:
+            return
+        ring, key_ids, fernets = {}, [], []
+        for entry in self._load_keys():
+            kid, suite, key = _parse_entry(entry)
+            handle = CIPHER_SUITES[suite](key)
+            ring[kid] = handle
+            key_ids.append(kid)
+            if suite == FernetSuite.name:
+                fernets.append(handle._fernet)
+        active_id = key_ids[0]
+        self._ring = ring
+        self._key_ids = key_ids
+        self._active = (active_id, ring[active_id], f"{ring[active_id].name}:{active_id}".encode())
+        self._legacy = MultiFernet(fernets) if fernets else None
+        self._signature = signature
+
+    def key_count(self) -> int:
+        self._load_ring()
+        return len(self._key_ids)
+
+    def key_ids(self) -> list[str]:
+        """Key identifiers, active (newest) first."""
+        self._load_ring()
+        return list(self._key_ids)
+
+    def active_key_id(self) -> str:
+        self._load_ring()
+        return self._active[0]
 
     def encrypt(self, plaintext: str) -> str:
-        mf = self._get_multi_fernet()
-        return mf.encrypt(plaintext.encode()).decode()
+        self._load_ring()
+        kid, handle, header = self._active
+        return f"{header.decode()}:{handle.encrypt(plaintext.encode(), header)}"
+
+    def _split(self, ciphertext: str) -> Optional[tuple[str, str, str]]:
+        """(suite, key id, payload) for a tagged ciphertext, None for a legacy Fernet token."""
+        parts = ciphertext.split(":", 2)
+        return (parts[0], parts[1], parts[2]) if len(parts) == 3 else None
 
     def decrypt(self, ciphertext: str) -> str:
-        mf = self._get_multi_fernet()
-        return mf.decrypt(ciphertext.encode()).decode()
+        self._load_ring()
+        tagged = self._split(ciphertext)
+        if tagged is None:
+            if self._legacy is None:
+                raise InvalidToken
+            return self._legacy.decrypt(ciphertext.encode()).decode()
+        suite, kid, payload = tagged
+        handle = self._ring.get(kid)
+        if handle is None or handle.name != suite:
+            raise InvalidToken
+        return handle.decrypt(payload, f"{suite}:{kid}".encode()).decode()
+
+    def rewrap(self, ciphertext: str) -> Optional[str]:
+        """Re-encrypt ciphertext under the active key, or None if it already uses it.
+
+        Legacy untagged tokens are always rewrapped, which also tags them.
+        Raises InvalidToken if no key in the ring can decrypt it.
+        """
+        tagged = self._split(ciphertext)
+        if tagged is not None and tagged[1] == self.active_key_id():
+            return None
+        return self.encrypt(self.decrypt(ciphertext))
 
     def rotate_key(self) -> str:
-        new_key = Fernet.generate_key().decode()
-        with open(self.keys_path, "r") as f:
-            data = json.load(f)
-        data["keys"].insert(0, new_key)
-        data["active_key_index"] = 0
-        with open(self.keys_path, "w") as f:
-            json.dump(data, f, indent=2)
-        return new_key
+        """Add a key in the configured suite and make it active; returns its key id."""
+        entry = self._new_entry()
+        with self._lock:
+            with open(self.keys_path, "r") as f:
+                data = json.load(f)
+            data["keys"].insert(0, entry)
+            data["active_key_index"] = 0
+            self._write_keys(data)
+        self.invalidate()
+        return entry["id"]
+
+    def retire_keys(self, active_key_id: str) -> list[str]:
+        """Drop every key but the active one; returns the retired key ids.
+
+        Only safe once no stored ciphertext uses the older keys. Does nothing
+        if the active key is no longer active_key_id (rotated again since).
+        """
+        with self._lock:
+            with open(self.keys_path, "r") as f:
+                data = json.load(f)
+            ids = [_parse_entry(entry)[0] for entry in data["keys"]]
+            if ids[0] != active_key_id or len(ids) == 1:
+                return []
+            data["keys"] = data["keys"][:1]
+            data["active_key_index"] = 0
+            self._write_keys(data)
+        self.invalidate()
+        return ids[1:]
@@ -4,10 +4,16 @@ import json
 import os
 import tempfile
 import csv
+from datetime import datetime
 from filelock import FileLock
-from typing import Any
+from typing import Any, Iterator, Optional
 from pathlib import Path
 
+TAIL_BLOCK_SIZE = 64 * 1024
+
+# count_jsonl progress per path: (inode, bytes counted, lines counted)
+_line_counts: dict[str, tuple[int, int, int]] = {}
+
 
 class FileStore:
 
@@ -49,6 +55,18 @@ class FileStore:
             with open(file_path, "a") as f:
                 f.write(json.dumps(record, default=str) + "\n")
 
+    @staticmethod
+    def append_jsonl_many(file_path: str, records: list[dict]) -> None:
+        """Append all records under one lock with a single write."""
+        if not records:
+            return
+        data = "".join(json.dumps(record, default=str) + "\n" for record in records)
+        lock = FileLock(FileStore._lock_path(file_path))
+        with lock:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, "a") as f:
+                f.write(data)
+
     @staticmethod
     def read_jsonl(file_path: str) -> list[dict]:
         lock = FileLock(FileStore._lock_path(file_path))
@@ -63,6 +81,72 @@ class FileStore:
                         records.append(json.loads(line))
             return records
 
+    @staticmethod
+    def read_jsonl_from(file_path: str, offset: int = 0) -> Iterator[tuple[dict, int]]:
+        """Yield (record, end_offset) for each complete line at or after offset.
+
+        Lock-free: appends are whole lines, and a torn trailing line is left
+        for the next read. If the file shrank below offset it was replaced,
+        so reading restarts from the beginning.
+        """
+        if not os.path.exists(file_path):
+            return
+        with open(file_path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < offset:
+                offset = 0
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                if line.strip():
+                    yield json.loads(line), offset
+
+    @staticmethod
+    def tail_jsonl(file_path: str, n: int) -> list[dict]:
+        """Return the last n records in file order, reading backwards from EOF."""
+        if n <= 0 or not os.path.exists(file_path):
+            return []
+        with open(file_path, "rb") as f:
+            pos = f.seek(0, os.SEEK_END)
+            buf = b""
+            while pos > 0 and buf.count(b"\n") <= n:
+                step = min(TAIL_BLOCK_SIZE, pos)
+                pos -= step
+                f.seek(pos)
+                buf = f.read(step) + buf
+        lines = buf.split(b"\n")[:-1]  # Drop the torn/empty piece after the last newline
+        if pos > 0:
+            lines = lines[1:]  # First piece may start mid-line
+        lines = [line for line in lines if line.strip()]
+        return [json.loads(line) for line in lines[-n:]]
+
+    @staticmethod
+    def count_jsonl(file_path: str) -> int:
+        """Count complete lines without decoding them.
+
+        The count is kept per process and resumed from where the last call
+        stopped, so repeated calls on an append-only log only read the bytes
+        appended since. A replaced (new inode) or truncated file is recounted.
+        """
+        try:
+            f = open(file_path, "rb")
+        except FileNotFoundError:
+            _line_counts.pop(file_path, None)
+            return 0
+        with f:
+            st = os.fstat(f.fileno())
+            inode, offset, count = _line_counts.get(file_path, (st.st_ino, 0, 0))
+            if inode != st.st_ino or offset > st.st_size:
+                inode, offset, count = st.st_ino, 0, 0
+            f.seek(offset)
+            while chunk := f.read(TAIL_BLOCK_SIZE * 16):
+                count += chunk.count(b"\n")
+                offset += len(chunk)
+        _line_counts[file_path] = (inode, offset, count)
+        return count
+
     @staticmethod
     def write_csv(file_path: str, headers: list[str], rows: list[dict]) -> None:
         lock = FileLock(FileStore._lock_path(file_path))
@@ -82,6 +166,28 @@ class FileStore:
                     os.unlink(tmp)
                 raise
 
+    @staticmethod
+    def append_csv(file_path: str, headers: list[str], rows: list[dict]) -> None:
+        """Append rows under the file lock, writing the header first if the file is new or empty.
+
+        An existing file keeps its own header: columns it lacks are dropped
+        and missing ones are left blank.
+        """
+        if not rows:
+            return
+        lock = FileLock(FileStore._lock_path(file_path))
+        with lock:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            existing = None
+            if os.path.exists(file_path) and os.path.getsize(file_path):
+                with open(file_path, "r", newline="") as f:
+                    existing = next(csv.reader(f), None)
+            with open(file_path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=existing or headers, extrasaction="ignore")
+                if not existing:
+                    writer.writeheader()
+                writer.writerows(rows)
+
     @staticmethod
     def read_csv(file_path: str) -> list[dict]:
         lock = FileLock(FileStore._lock_path(file_path))
@@ -92,6 +198,25 @@ class FileStore:
                 reader = csv.DictReader(f)
                 return list(reader)
 
+    @staticmethod
+    def iter_csv_columns(file_path: str, columns: list[str]) -> Iterator[tuple]:
+        """Stream the named columns of each row as tuples ("" where a column is absent).
+
+        The file lock is held until the generator finishes.
+        """
+        lock = FileLock(FileStore._lock_path(file_path))
+        with lock:
+            if not os.path.exists(file_path):
+                return
+            with open(file_path, "r", newline="") as f:
+                reader = csv.reader(f)
+                header = next(reader, None)
+                if header is None:
+                    return
+                positions = [header.index(c) if c in header else None for c in columns]
+                for row in reader:
+                    yield tuple(row[p] if p is not None and p < len(row) else "" for p in positions)
+
     @staticmethod
     def update_json_field(file_path: str, key: str, value: Any) -> None:
         lock = FileLock(FileStore._lock_path(file_path))
@@ -113,3 +238,42 @@ class FileStore:
                 if os.path.exists(tmp):
                     os.unlink(tmp)
                 raise
+
+
+class JsonlCursor:
+    """Persisted byte-offset checkpoint for incremental consumption of a JSONL file."""
+
+    def __init__(self, file_path: str, checkpoint_path: str):
+        self.file_path = file_path
+        self.checkpoint_path = checkpoint_path
+        checkpoint = FileStore.read_json(checkpoint_path, default={})
+        self.offset = checkpoint.get("offset", 0)
+        # Consumer state saved atomically with the offset (e.g. work carried between batches)
+        self.state = checkpoint.get("state", {})
+
+    def read(self, limit: Optional[int] = None) -> tuple[list[dict], int]:
+        """Return records appended since the checkpoint and the offset just past them.
+
+        The checkpoint only moves on commit(), so a crash before commit
+        replays the batch (at-least-once).
+        """
+        records = []
+        end = self.offset
+        for record, end in FileStore.read_jsonl_from(self.file_path, self.offset):
+            records.append(record)
+            if limit and len(records) >= limit:
+                break
+        return records, end
+
+    def commit(self, offset: int, state: Optional[dict] = None) -> None:
+        self.offset = offset
+        if state is not None:
+            self.state = state
+        checkpoint = {
+            "file": self.file_path,
+            "offset": offset,
+            "updated_at": datetime.utcnow().isoformat(),
+        }
+        if self.state:
+            checkpoint["state"] = self.state
+        FileStore.write_json(self.checkpoint_path, checkpoint)
@@ -0,0 +1,131 @@
+"""App-lifetime pooled HTTP clients, one connection pool per upstream.
+
+Limits come from HTTP_POOL_* env vars, overridable per upstream with
+HTTP_POOL_<UPSTREAM>_* (e.g. HTTP_POOL_VAULT_MAX_CONNECTIONS).
+"""
+
+import os
+import time
+import logging
+import httpx
+
+logger = logging.getLogger("payrail.http_clients")
+
+
+def _env(upstream: str, key: str, default: str) -> str:
+    specific = f"HTTP_POOL_{upstream.upper().replace('-', '_')}_{key}"
+    return os.environ.get(specific, os.environ.get(f"HTTP_POOL_{key}", default))
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class _CountingTransport(httpx.AsyncHTTPTransport):
+    """Transport that keeps request counters for pool sizing."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.total_ms = 0.0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        start = time.perf_counter()
+        try:
+            return await super().handle_async_request(request)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.requests += 1
+            self.total_ms += (time.perf_counter() - start) * 1000
+
+    def pool_connections(self) -> tuple[int, int]:
+        # httpcore does not expose pool state publicly; read it defensively
+        connections = getattr(getattr(self, "_pool", None), "connections", [])
+        idle = sum(1 for c in connections if c.is_idle())
+        return len(connections), idle
+
+
+class HttpClientRegistry:
+
+    def __init__(self):
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        self._transports: dict[str, _CountingTransport] = {}
+        self._limits: dict[str, dict] = {}
+
+    def open(self, upstream: str) -> httpx.AsyncClient:
+        if upstream in self._clients:
+            return self._clients[upstream]
+
+        max_connections = int(_env(upstream, "MAX_CONNECTIONS", "100"))
+        max_keepalive = int(_env(upstream, "MAX_KEEPALIVE", "20"))
+        keepalive_expiry = float(_env(upstream, "KEEPALIVE_EXPIRY", "30"))
+        http2 = _env(upstream, "HTTP2", "false").lower() in ("1", "true", "yes")
+        if http2 and not _http2_available():
+            logger.warning(f"HTTP/2 requested for {upstream} but h2 is not installed; using HTTP/1.1")
+            http2 = False
+
+        transport = _CountingTransport(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            http2=http2,
+        )
+        self._transports[upstream] = transport
+        self._limits[upstream] = {
+            "max_connections": max_connections,
+            "max_keepalive_connections": max_keepalive,
+            "keepalive_expiry": keepalive_expiry,
+            "http2": http2,
+        }
+        self._clients[upstream] = httpx.AsyncClient(transport=transport)
+        logger.info(f"Opened HTTP pool for {upstream}: {self._limits[upstream]}")
+        return self._clients[upstream]
+
+    def get(self, upstream: str) -> httpx.AsyncClient:
+        """Return the pooled client, opening it lazily if startup did not."""
+        client = self._clients.get(upstream)
+        if client is None or client.is_closed:
+            self._clients.pop(upstream, None)
+            client = self.open(upstream)
+        return client
+
+    async def aclose(self) -> None:
+        for upstream, client in list(self._clients.items()):
+            await client.aclose()
+            logger.info(f"Closed HTTP pool for {upstream}")
+        self._clients.clear()
+        self._transports.clear()
+
+    def stats(self) -> dict:
+        pools = {}
+        for upstream, transport in self._transports.items():
+            connections, idle = transport.pool_connections()
+            pools[upstream] = {
+                **self._limits[upstream],
+                "connections": connections,
+                "idle_connections": idle,
+                "in_flight": transport.in_flight,
+                "peak_in_flight": transport.peak_in_flight,
+                "requests": transport.requests,
+                "errors": transport.errors,
+                "avg_ms": round(transport.total_ms / transport.requests, 2) if transport.requests else None,
+            }
+        return pools
+
+
+# One registry per process
+http_clients = HttpClientRegistry()
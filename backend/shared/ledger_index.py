@@ -0,0 +1,196 @@
+"""Persistent ref -> (file, byte offset, length) index over the ledger JSONL files.
+
+Postings live in an append-only JSONL file next to the ledger. Every process
+keeps the postings in memory and catches up on appended ledger lines when a
+lookup runs, so writers never pay for indexing. Undecodable ledger lines are
+skipped with a warning. The index can always be rebuilt from the ledger files
+themselves.
+"""
+
+import json
+import os
+import logging
+from collections import defaultdict
+from typing import Optional
+from filelock import FileLock
+
+logger = logging.getLogger("payrail.ledger_index")
+
+
+class StaleIndexError(Exception):
+    pass
+
+
+class LedgerIndex:
+
+    def __init__(self, index_path: str, ledger_paths: dict[str, str]):
+        self.index_path = index_path
+        self.ledger_paths = ledger_paths
+        self._lock = FileLock(f"{index_path}.lock")
+        self._reset()
+
+    def _reset(self):
+        self._postings: dict[str, list[tuple[str, int, int]]] = defaultdict(list)
+        self._watermarks = {name: 0 for name in self.ledger_paths}
+        self._index_end = 0
+        self._index_inode = None
+
+    def _add(self, ref: str, name: str, offset: int, length: int):
+        if ref:
+            self._postings[ref].append((name, offset, length))
+        self._watermarks[name] = max(self._watermarks.get(name, 0), offset + length)
+
+    # === Index file ===
+
+    def _load_index_tail(self):
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            self._reset()
+            return
+        if st.st_ino != self._index_inode or st.st_size < self._index_end:
+            self._reset()
+            self._index_inode = st.st_ino
+        if st.st_size == self._index_end:
+            return
+
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_end)
+            offset = self._index_end
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    p = json.loads(line)
+                    self._add(p["ref"], p["file"], p["offset"], p["length"])
+                except (ValueError, KeyError, TypeError):
+                    logger.warning(f"Skipping corrupt index line at {self.index_path}:{offset}")
+                offset += len(line)
+            self._index_end = offset
+
+    def _append_postings(self, postings: list[dict]):
+        if not postings:
+            return
+        data = b"".join(
+            (json.dumps(p) + "\n").encode() for p in postings
+        )
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        with open(self.index_path, "ab") as f:
+            offset = f.tell()
+            if offset > self._index_end:
+                # Terminate a torn write left by a crashed process
+                f.write(b"\n")
+                offset += 1
+            f.write(data)
+        if self._index_inode is None:
+            self._index_inode = os.stat(self.index_path).st_ino
+        for p in postings:
+            self._add(p["ref"], p["file"], p["offset"], p["length"])
+        self._index_end = offset + len(data)
+
+    # === Ledger scanning ===
+
+    def _scan_ledger(self, name: str, start: int) -> list[dict]:
+        path = self.ledger_paths[name]
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+        if size < start:
+            raise StaleIndexError(f"{path} shrank below indexed offset {start}")
+        if size == start:
+            return []
+
+        postings = []
+        with open(path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                if line.strip():
+                    try:
+                        ref = json.loads(line).get("ref") or ""
+                    except (ValueError, AttributeError):
+                        if offset == start and start:
+                            # The watermark is not on a line start: the file was rewritten
+                            raise StaleIndexError(f"{path} has no record boundary at {offset}")
+                        # Indexed with no ref, so every process steps over it instead of rebuilding
+                        logger.warning(f"Skipping undecodable ledger line at {path}:{offset}")
+                        ref = ""
+                    postings.append({"ref": ref, "file": name, "offset": offset, "length": len(line)})
+                offset += len(line)
+        return postings
+
+    def _sync(self):
+        self._load_index_tail()
+        try:
+            for name in self.ledger_paths:
+                self._append_postings(self._scan_ledger(name, self._watermarks.get(name, 0)))
+        except StaleIndexError as e:
+            logger.warning(f"Ledger index is stale ({e}), rebuilding")
+            self._rebuild()
+
+    def _rebuild(self):
+        self._reset()
+        tmp = f"{self.index_path}.tmp"
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        try:
+            with open(tmp, "wb") as f:
+                for name in self.ledger_paths:
+                    for p in self._scan_ledger(name, 0):
+                        line = (json.dumps(p) + "\n").encode()
+                        f.write(line)
+                        self._add(p["ref"], p["file"], p["offset"], p["length"])
+                        self._index_end += len(line)
+            os.replace(tmp, self.index_path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        self._index_inode = os.stat(self.index_path).st_ino
+        logger.info(f"Rebuilt ledger index: {len(self._postings)} refs")
+
+    def _read(self, ref: str, files: Optional[list[str]]) -> list[dict]:
+        entries = []
+        handles = {}
+        try:
+            for name, offset, length in self._postings.get(ref, []):
+                if files and name not in files:
+                    continue
+                if name not in handles:
+                    handles[name] = open(self.ledger_paths[name], "rb")
+                f = handles[name]
+                f.seek(offset)
+                try:
+                    entry = json.loads(f.read(length))
+                except ValueError:
+                    raise StaleIndexError(f"undecodable posting {name}:{offset}")
+                if entry.get("ref") != ref:
+                    raise StaleIndexError(f"posting {name}:{offset} does not belong to {ref}")
+                entries.append(entry)
+        finally:
+            for f in handles.values():
+                f.close()
+        return entries
+
+    # === Public API ===
+
+    def sync(self) -> None:
+        with self._lock:
+            self._sync()
+
+    def rebuild(self) -> None:
+        with self._lock:
+            self._rebuild()
+
+    def lookup(self, ref: str, files: Optional[list[str]] = None) -> list[dict]:
+        """Return the ledger entries for ref in file order, decoding only matching lines."""
+        with self._lock:
+            self._sync()
+            try:
+                return self._read(ref, files)
+            except StaleIndexError as e:
+                logger.warning(f"Ledger index is stale ({e}), rebuilding")
+                self._rebuild()
+                return self._read(ref, files)
@@ -0,0 +1,178 @@
+"""Buffered JSONL writer: records go through an asyncio queue and are appended in batches.
+
+A background task collects up to LOG_WRITER_BATCH_SIZE records, or whatever
+arrived within LOG_WRITER_FLUSH_INTERVAL seconds of the first one, and writes
+them with a single locked append (FileStore.append_jsonl_many) off the event
+loop. When the queue is full, callers wait for room (backpressure); writers
+created with drop_when_full give up after LOG_WRITER_PUT_TIMEOUT and count the
+record as dropped instead. close() drains the queue. Until start() is called,
+or once close() has begun, write() appends synchronously, so no record is lost
+outside the app lifetime.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Optional
+
+from shared.file_store import FileStore
+
+logger = logging.getLogger("payrail.log_writer")
+
+LOG_WRITER_BATCH_SIZE = int(os.environ.get("LOG_WRITER_BATCH_SIZE", 500))
+LOG_WRITER_FLUSH_INTERVAL = float(os.environ.get("LOG_WRITER_FLUSH_INTERVAL", 0.25))
+LOG_WRITER_QUEUE_SIZE = int(os.environ.get("LOG_WRITER_QUEUE_SIZE", 10000))
+LOG_WRITER_PUT_TIMEOUT = float(os.environ.get("LOG_WRITER_PUT_TIMEOUT", 0.05))
+
+_STOP = object()
+
+
+class BatchedLogWriter:
+
+    def __init__(self, path: str, drop_when_full: bool = False,
+                 batch_size: int = LOG_WRITER_BATCH_SIZE,
+                 flush_interval: float = LOG_WRITER_FLUSH_INTERVAL,
+                 queue_size: int = LOG_WRITER_QUEUE_SIZE,
+                 put_timeout: float = LOG_WRITER_PUT_TIMEOUT):
+        self.path = path
+        self.drop_when_full = drop_when_full
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.put_timeout = put_timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.enqueued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.blocked = 0
+        self.direct = 0
+        self.batches = 0
+        self.last_flush_at: Optional[float] = None
+        self.last_flush_ms = 0.0
+
+    # === Lifecycle ===
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._closing = False
+        self._queue = asyncio.Queue(self.queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Flush everything queued, then stop the writer task."""
+        if self._task is None:
+            return
+        self._closing = True
+        await self._queue.put(_STOP)
+        await self._task
+        # Producers that were blocked on a full queue may have landed behind the stop marker
+        leftovers = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                leftovers.append(item)
+        if leftovers:
+            await self._flush(leftovers)
+        self._task = None
+        self._queue = None
+
+    # === Producers ===
+
+    async def write(self, record: dict) -> bool:
+        """Queue record for the next batch; returns False if it was dropped."""
+        if self._task is None or self._closing:
+            FileStore.append_jsonl(self.path, record)
+            self.direct += 1
+            return True
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.blocked += 1
+            if self.drop_when_full:
+                try:
+                    await asyncio.wait_for(self._queue.put(record), self.put_timeout)
+                except asyncio.TimeoutError:
+                    self.dropped += 1
+                    return False
+            else:
+                await self._queue.put(record)
+        self.enqueued += 1
+        return True
+
+    async def write_many(self, records: list[dict]) -> int:
+        """Queue records in order; returns how many were accepted."""
+        if self._task is None or self._closing:
+            FileStore.append_jsonl_many(self.path, records)
+            self.direct += len(records)
+            return len(records)
+        accepted = 0
+        for record in records:
+            accepted += await self.write(record)
+        return accepted
+
+    # === Consumer ===
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[dict]):
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(FileStore.append_jsonl_many, self.path, batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Failed to write {len(batch)} records to {self.path}: {e}")
+            return
+        self.flushed += len(batch)
+        self.batches += 1
+        self.last_flush_at = time.time()
+        self.last_flush_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "running": self._task is not None,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "queue_size": self.queue_size,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "drop_when_full": self.drop_when_full,
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "direct": self.direct,
+            "batches": self.batches,
+            "avg_batch": round(self.flushed / self.batches, 1) if self.batches else 0,
+            "last_flush_at": self.last_flush_at,
+            "last_flush_ms": self.last_flush_ms,
+        }
@@ -1,63 +1,132 @@
-"""Shared middleware for correlation IDs, RBAC, and metrics."""
+"""Shared middleware for correlation IDs, RBAC, and metrics.
+
+These are plain ASGI middleware rather than BaseHTTPMiddleware subclasses:
+each layer calls the next app directly and only wraps send(), so a request
+through the stack costs no extra tasks or response-body streams.
+"""
 
 import time
 import json
 import os
+import random
 import logging
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
+from starlette.datastructures import Headers, MutableHeaders
 from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from shared.correlation import set_correlation_id, generate_correlation_id, get_correlation_id
-from shared.file_store import FileStore
+from shared.log_writer import BatchedLogWriter
+from shared.request_metrics import request_metrics
 
 logger = logging.getLogger("payrail")
 
+METRICS_PATH = os.path.join(os.environ.get("DATA_DIR", "/app/data"), "metrics", "service_metrics.jsonl")
+# Fraction of requests also written as raw samples to METRICS_PATH; 0 disables the file
+METRICS_RAW_SAMPLE_RATE = float(os.environ.get("METRICS_RAW_SAMPLE_RATE", 1.0))
+# Request samples are best-effort: under sustained overload they are dropped after a short wait
+metrics_writer = BatchedLogWriter(METRICS_PATH, drop_when_full=True)
+
 
-class CorrelationMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        cid = request.headers.get("X-Correlation-Id", generate_correlation_id())
+class CorrelationMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        cid = Headers(scope=scope).get("X-Correlation-Id")
+        if cid is None:
+            cid = generate_correlation_id()
         set_correlation_id(cid)
-        response = await call_next(request)
-        response.headers["X-Correlation-Id"] = cid
-        return response
 
+        async def send_with_cid(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["X-Correlation-Id"] = cid
+            await send(message)
+
+        await self.app(scope, receive, send_with_cid)
 
-class RBACMiddleware(BaseHTTPMiddleware):
+
+class RBACMiddleware:
     EXEMPT_PATHS = {"/health", "/docs", "/openapi.json", "/redoc"}
 
-    async def dispatch(self, request: Request, call_next):
-        if request.url.path in self.EXEMPT_PATHS:
-            return await call_next(request)
-        if request.url.path.startswith("/webhooks/"):
-            return await call_next(request)
-        # Allow GET without merchant header for read operations
-        if request.method == "GET":
-            return await call_next(request)
-        merchant_id = request.headers.get("X-Merchant-Id")
-        if not merchant_id and request.method in ("POST", "PUT", "PATCH", "DELETE"):
-            return JSONResponse(
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and not self._allowed(scope):
+            response = JSONResponse(
                 status_code=401,
                 content={"error": "X-Merchant-Id header required"},
             )
-        return await call_next(request)
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+    def _allowed(self, scope: Scope) -> bool:
+        path = scope["path"]
+        if path in self.EXEMPT_PATHS or path.startswith("/webhooks/"):
+            return True
+        # Allow GET without merchant header for read operations
+        method = scope["method"]
+        if method not in ("POST", "PUT", "PATCH", "DELETE"):
+            return True
+        return bool(Headers(scope=scope).get("X-Merchant-Id"))
+
+
+def _route_template(scope: Scope) -> str:
+    """Request path with matched path parameters put back as {name}, so ids do not create new series."""
+    if "endpoint" not in scope:
+        return "unmatched"
+    path = scope["path"]
+    params = scope.get("path_params")
+    if params:
+        names = {str(value): name for name, value in params.items()}
+        path = "/".join(f"{{{names[part]}}}" if part in names else part for part in path.split("/"))
+    return path
+
 
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
 
-class MetricsMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        start = time.time()
-        response = await call_next(request)
-        duration_ms = round((time.time() - start) * 1000, 2)
-        data_dir = os.environ.get("DATA_DIR", "/app/data")
-        metrics_path = os.path.join(data_dir, "metrics", "service_metrics.jsonl")
         try:
-            FileStore.append_jsonl(metrics_path, {
-                "timestamp": time.time(),
-                "method": request.method,
-                "path": request.url.path,
-                "status_code": response.status_code,
-                "duration_ms": duration_ms,
-                "correlation_id": get_correlation_id(),
-            })
+            await self.app(scope, receive, send_with_status)
         except Exception:
-            pass  # Don't fail requests over metrics
-        return response
+            await observe_request(scope, 500, start)
+            raise
+        await observe_request(scope, status_code, start)
+
+
+async def observe_request(scope: Scope, status_code: int, start: float):
+    """Record one finished request in the in-memory metrics and, if sampled, the raw JSONL file."""
+    duration_ms = round((time.perf_counter() - start) * 1000, 2)
+    route = _route_template(scope)
+    request_metrics.record(scope["method"], route, status_code, duration_ms)
+    if METRICS_RAW_SAMPLE_RATE < 1.0 and random.random() >= METRICS_RAW_SAMPLE_RATE:
+        return
+    try:
+        await metrics_writer.write({
+            "timestamp": time.time(),
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": route,
+            "status_code": status_code,
+            "duration_ms": duration_ms,
+            "correlation_id": get_correlation_id(),
+        })
+    except Exception:
+        pass  # Don't fail requests over metrics
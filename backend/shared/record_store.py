@@ -0,0 +1,194 @@
+"""Log-structured keyed record store with an in-memory offset index.
+
+Each put appends one JSON line to the log; the index maps record id to the
+byte offset and length of its latest version, so reads and writes touch only
+the affected record. Superseded versions are dropped by compaction.
+"""
+
+import json
+import os
+import logging
+from typing import Optional
+from filelock import FileLock
+
+logger = logging.getLogger("payrail.record_store")
+
+COMPACT_MIN_BYTES = int(os.environ.get("RECORD_STORE_COMPACT_MIN_BYTES", 1024 * 1024))
+COMPACT_DEAD_RATIO = float(os.environ.get("RECORD_STORE_COMPACT_DEAD_RATIO", 0.5))
+
+
+class RecordStore:
+
+    def __init__(self, log_path: str, legacy_path: Optional[str] = None):
+        self.log_path = log_path
+        self.legacy_path = legacy_path
+        self._lock = FileLock(f"{log_path}.lock")
+        self._index: dict[str, tuple[int, int]] = {}
+        self._end = 0
+        self._inode = None
+        self._live_bytes = 0
+        with self._lock:
+            self._migrate_legacy()
+
+    # === Index maintenance ===
+
+    def _reset_index(self):
+        self._index = {}
+        self._end = 0
+        self._inode = None
+        self._live_bytes = 0
+
+    def _catch_up(self):
+        """Index lines appended since the last call, by this or any other process."""
+        try:
+            st = os.stat(self.log_path)
+        except FileNotFoundError:
+            self._reset_index()
+            return
+        if st.st_ino != self._inode or st.st_size < self._end:
+            # Compacted or replaced underneath us
+            self._reset_index()
+            self._inode = st.st_ino
+        if st.st_size == self._end:
+            return
+
+        with open(self.log_path, "rb") as f:
+            f.seek(self._end)
+            offset = self._end
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Partial trailing write, pick it up next time
+                length = len(line)
+                try:
+                    rec = json.loads(line)
+                    self._index_line(rec["id"], offset, length)
+                except (ValueError, KeyError, TypeError):
+                    logger.warning(f"Skipping corrupt line at {self.log_path}:{offset}")
+                offset += length
+            self._end = offset
+
+    def _index_line(self, record_id: str, offset: int, length: int):
+        previous = self._index.get(record_id)
+        if previous:
+            self._live_bytes -= previous[1]
+        self._index[record_id] = (offset, length)
+        self._live_bytes += length
+
+    def _read_at(self, f, offset: int, length: int) -> dict:
+        f.seek(offset)
+        return json.loads(f.read(length))["data"]
+
+    def _append(self, record_id: str, data: dict):
+        line = (json.dumps({"id": record_id, "data": data}, default=str) + "\n").encode()
+        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        with open(self.log_path, "ab") as f:
+            offset = f.tell()
+            if offset > self._end:
+                # Terminate a torn write so it cannot swallow this record
+                f.write(b"\n")
+                offset += 1
+            f.write(line)
+        if self._inode is None:
+            self._inode = os.stat(self.log_path).st_ino
+        self._index_line(record_id, offset, len(line))
+        self._end = offset + len(line)
+
+    def _maybe_compact(self):
+        dead = self._end - self._live_bytes
+        if self._end >= COMPACT_MIN_BYTES and dead > self._end * COMPACT_DEAD_RATIO:
+            self._compact()
+
+    def _compact(self):
+        tmp = f"{self.log_path}.compact.tmp"
+        index = {}
+        offset = 0
+        try:
+            with open(self.log_path, "rb") as src, open(tmp, "wb") as dst:
+                for record_id, (pos, length) in sorted(self._index.items(), key=lambda kv: kv[1][0]):
+                    src.seek(pos)
+                    line = src.read(length)
+                    dst.write(line)
+                    index[record_id] = (offset, length)
+                    offset += length
+                dst.flush()
+                os.fsync(dst.fileno())
+            before = self._end
+            os.replace(tmp, self.log_path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        self._index = index
+        self._end = offset
+        self._live_bytes = offset
+        self._inode = os.stat(self.log_path).st_ino
+        logger.info(f"Compacted {self.log_path}: {before} -> {offset} bytes")
+
+    def _migrate_legacy(self):
+        """Import a legacy whole-file JSON store, then move it aside."""
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return
+        legacy_lock = FileLock(f"{self.legacy_path}.lock")
+        with legacy_lock:
+            if not os.path.exists(self.legacy_path):
+                return
+            with open(self.legacy_path, "r") as f:
+                records = json.load(f)
+            self._catch_up()
+            for record_id, data in records.items():
+                self._append(record_id, data)
+            os.replace(self.legacy_path, f"{self.legacy_path}.migrated")
+        logger.info(f"Migrated {len(records)} records from {self.legacy_path} to {self.log_path}")
+
+    # === Public API ===
+
+    def get(self, record_id: str) -> Optional[dict]:
+        with self._lock:
+            self._catch_up()
+            loc = self._index.get(record_id)
+            if not loc:
+                return None
+            with open(self.log_path, "rb") as f:
+                return self._read_at(f, *loc)
+
+    def put(self, record_id: str, data: dict) -> None:
+        with self._lock:
+            self._catch_up()
+            self._append(record_id, data)
+            self._maybe_compact()
+
+    def update(self, record_id: str, changes: dict, only_if: Optional[dict] = None) -> Optional[dict]:
+        """Merge field changes into one record under the store lock.
+
+        With only_if, the record is changed only if it currently has those
+        field values. Returns the updated record, or None if it does not exist
+        or the condition did not hold.
+        """
+        with self._lock:
+            self._catch_up()
+            loc = self._index.get(record_id)
+            if not loc:
+                return None
+            with open(self.log_path, "rb") as f:
+                data = self._read_at(f, *loc)
+            if only_if and any(data.get(k) != v for k, v in only_if.items()):
+                return None
+            data.update(changes)
+            self._append(record_id, data)
+            self._maybe_compact()
+            return data
+
+    def values(self) -> list[dict]:
+        with self._lock:
+            self._catch_up()
+            if not self._index:
+                return []
+            with open(self.log_path, "rb") as f:
+                return [self._read_at(f, offset, length)
+                        for offset, length in sorted(self._index.values())]
+
+    def compact(self) -> None:
+        with self._lock:
+            self._catch_up()
+            if self._index:
+                self._compact()
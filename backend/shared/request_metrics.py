@@ -0,0 +1,173 @@
+"""In-memory request metrics: per-route latency histograms, counters, and rolling-window summaries.
+
+Two views are kept per worker process:
+
+- Cumulative series per (method, route, status): request count, latency sum
+  and bucket counts, exposed in Prometheus text format.
+- A ring of one-second slots per (method, route) holding request, 4xx and 5xx
+  counts plus latency bucket counts, from which p50/p95/p99 and RPS are
+  computed over the last N seconds (up to METRICS_WINDOW_SECONDS).
+
+Routes are the matched path templates ("/payment-intents/{payment_id}"), not
+raw paths, so series stay bounded.
+"""
+
+import os
+import time
+from bisect import bisect_left
+from typing import Optional
+
+from shared.stats import histogram_quantile
+
+METRICS_WINDOW_SECONDS = int(os.environ.get("METRICS_WINDOW_SECONDS", 300))
+METRICS_SUMMARY_WINDOWS = [int(w) for w in os.environ.get("METRICS_SUMMARY_WINDOWS", "60,300").split(",")]
+
+# Bucket upper bounds in milliseconds; one overflow bucket follows
+LATENCY_BOUNDS_MS = (1, 2.5, 5, 10, 25, 50, 75, 100, 150, 250, 500, 750, 1000, 2500, 5000, 10000)
+_BINS = len(LATENCY_BOUNDS_MS) + 1
+# Slot row layout: requests, 4xx, 5xx, then latency bins
+_ROW = 3 + _BINS
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Series:
+    __slots__ = ("count", "sum_ms", "bins")
+
+    def __init__(self):
+        self.count = 0
+        self.sum_ms = 0.0
+        self.bins = [0] * _BINS
+
+
+class _Slot:
+    __slots__ = ("second", "rows")
+
+    def __init__(self):
+        self.second = -1
+        self.rows: dict[tuple[str, str], list] = {}
+
+
+class RequestMetrics:
+
+    def __init__(self, window_seconds: int = METRICS_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self.started_at = time.time()
+        self._series: dict[tuple[str, str, int], _Series] = {}
+        self._slots = [_Slot() for _ in range(window_seconds)]
+
+    def record(self, method: str, route: str, status: int, duration_ms: float, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        b = bisect_left(LATENCY_BOUNDS_MS, duration_ms)
+
+        key = (method, route, status)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _Series()
+        series.count += 1
+        series.sum_ms += duration_ms
+        series.bins[b] += 1
+
+        second = int(now)
+        slot = self._slots[second % self.window_seconds]
+        if slot.second != second:
+            slot.second = second
+            slot.rows = {}
+        row = slot.rows.get((method, route))
+        if row is None:
+            row = slot.rows[(method, route)] = [0] * _ROW
+        row[0] += 1
+        if 400 <= status < 500:
+            row[1] += 1
+        elif status >= 500:
+            row[2] += 1
+        row[3 + b] += 1
+
+    # === Rolling summaries ===
+
+    @staticmethod
+    def _summarize(row: list, window: int) -> dict:
+        requests = row[0]
+        bins = row[3:]
+        return {
+            "requests": requests,
+            "rps": round(requests / window, 3),
+            "client_errors": row[1],
+            "server_errors": row[2],
+            "error_rate": round(row[2] / requests, 4) if requests else 0.0,
+            "p50_ms": _round(histogram_quantile(LATENCY_BOUNDS_MS, bins, 50)),
+            "p95_ms": _round(histogram_quantile(LATENCY_BOUNDS_MS, bins, 95)),
+            "p99_ms": _round(histogram_quantile(LATENCY_BOUNDS_MS, bins, 99)),
+        }
+
+    def summary(self, window: int, now: Optional[float] = None) -> dict:
+        """Totals and per-route RPS, error rate and latency percentiles over the last window seconds."""
+        now = time.time() if now is None else now
+        window = max(1, min(window, self.window_seconds))
+        oldest = int(now) - window + 1
+        per_route: dict[tuple[str, str], list] = {}
+        total = [0] * _ROW
+        for slot in self._slots:
+            if slot.second < oldest or slot.second > now:
+                continue
+            for key, row in slot.rows.items():
+                merged = per_route.get(key)
+                if merged is None:
+                    merged = per_route[key] = [0] * _ROW
+                for i, v in enumerate(row):
+                    merged[i] += v
+                    total[i] += v
+        # Before the process has run a full window, rates use the time it has been up
+        span = max(1, min(window, int(now - self.started_at) + 1))
+        routes = [
+            {"method": method, "route": route, **self._summarize(row, span)}
+            for (method, route), row in sorted(per_route.items(), key=lambda kv: -kv[1][0])
+        ]
+        return {"window_seconds": window, "overall": self._summarize(total, span), "routes": routes}
+
+    def summaries(self, windows: list[int] = METRICS_SUMMARY_WINDOWS) -> dict:
+        now = time.time()
+        return {f"{w}s": self.summary(w, now) for w in windows}
+
+    # === Prometheus exposition ===
+
+    def exposition(self, prefix: str = "payrail_http") -> str:
+        lines = [
+            f"# HELP {prefix}_requests_total Requests handled, by method, route and status.",
+            f"# TYPE {prefix}_requests_total counter",
+        ]
+        series = sorted(self._series.items())
+        for (method, route, status), s in series:
+            lines.append(
+                f'{prefix}_requests_total{{method="{method}",route="{_escape(route)}",status="{status}"}} {s.count}'
+            )
+        name = f"{prefix}_request_duration_seconds"
+        lines += [
+            f"# HELP {name} Request latency, by method, route and status.",
+            f"# TYPE {name} histogram",
+        ]
+        for (method, route, status), s in series:
+            labels = f'method="{method}",route="{_escape(route)}",status="{status}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BOUNDS_MS, s.bins):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound / 1000:g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {s.count}')
+            lines.append(f"{name}_sum{{{labels}}} {s.sum_ms / 1000:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {s.count}")
+        lines += [
+            f"# HELP {prefix}_metrics_start_time_seconds When this worker started collecting.",
+            f"# TYPE {prefix}_metrics_start_time_seconds gauge",
+            f"{prefix}_metrics_start_time_seconds {self.started_at:.3f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 2)
+
+
+# One collector per worker process
+request_metrics = RequestMetrics()
@@ -0,0 +1,163 @@
+"""Settlement files partitioned by date and provider, indexed by a manifest.
+
+Each (date, provider) pair has its own CSV per source: settlement_{date}_{provider}.csv
+is built from the ledger by the settlement generator, statement_{date}_{provider}.csv
+is the provider's own settlement report. Writers never touch each other's files,
+so partitions can be written and read independently.
+
+manifest.json maps each file name to its date, provider, source, row count,
+amount total, size and sha256. Entries are refreshed under the CSV's lock right
+after every write; an append only parses the bytes past the previous entry once
+the old prefix still hashes to the recorded checksum.
+"""
+
+import os
+import re
+import csv
+import glob
+import hashlib
+from datetime import datetime
+from typing import Optional
+
+from filelock import FileLock
+
+from shared.file_store import FileStore
+
+HASH_BLOCK_SIZE = 1024 * 1024
+SOURCE_PREFIXES = {"ledger": "settlement", "provider": "statement"}
+# settlement_{date}.csv without a provider is the pre-partitioning layout
+_NAME = re.compile(r"^(settlement|statement)_(\d{4}-\d{2}-\d{2})(?:_(.+))?\.csv$")
+
+
+def parse_name(file_name: str) -> Optional[dict]:
+    match = _NAME.match(file_name)
+    if not match:
+        return None
+    prefix, date, provider = match.groups()
+    source = "ledger" if prefix == "settlement" else "provider"
+    return {"date": date, "provider": provider, "source": source if provider else "legacy"}
+
+
+def _scan(path: str, prev: Optional[dict]) -> dict:
+    """Row count, amount total and sha256 of a CSV, resuming from prev when the file only grew."""
+    size = os.path.getsize(path)
+    digest = hashlib.sha256()
+    rows, total, start = 0, 0, 0
+    with open(path, "rb") as f:
+        if prev and 0 < prev.get("bytes", 0) <= size:
+            remaining = prev["bytes"]
+            while remaining:
+                chunk = f.read(min(HASH_BLOCK_SIZE, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+            if not remaining and digest.hexdigest() == prev.get("checksum"):
+                rows, total, start = prev.get("rows", 0), prev.get("total_amount", 0), prev["bytes"]
+            else:
+                digest = hashlib.sha256()
+
+        def lines():
+            for line in f:
+                digest.update(line)
+                yield line.decode()
+
+        f.seek(0)
+        if start:
+            header = next(csv.reader([f.readline().decode()]), [])
+            f.seek(start)
+            reader = csv.reader(lines())
+        else:
+            reader = csv.reader(lines())
+            header = next(reader, [])
+        amount_at = header.index("amount") if "amount" in header else None
+        for row in reader:
+            if not row:
+                continue
+            rows += 1
+            if amount_at is not None and amount_at < len(row) and row[amount_at]:
+                total += int(row[amount_at])
+    return {"rows": rows, "total_amount": total, "bytes": size, "checksum": digest.hexdigest()}
+
+
+class SettlementManifest:
+
+    def __init__(self, settlement_dir: str):
+        self.settlement_dir = settlement_dir
+        self.manifest_path = os.path.join(settlement_dir, "manifest.json")
+
+    def file_name(self, date: str, provider: str, source: str = "ledger") -> str:
+        return f"{SOURCE_PREFIXES[source]}_{date}_{provider}.csv"
+
+    def path(self, date: str, provider: str, source: str = "ledger") -> str:
+        return os.path.join(self.settlement_dir, self.file_name(date, provider, source))
+
+    def read(self) -> dict:
+        return FileStore.read_json(self.manifest_path, default={})
+
+    def record(self, file_name: str, prev: Optional[dict] = None) -> Optional[dict]:
+        """Re-describe one settlement file after a write; returns its manifest entry."""
+        info = parse_name(file_name)
+        path = os.path.join(self.settlement_dir, file_name)
+        if info is None:
+            return None
+        if prev is None:
+            prev = self.read().get(file_name)
+        with FileLock(f"{path}.lock"):
+            if not os.path.exists(path):
+                return None
+            entry = {
+                "file": file_name,
+                **info,
+                **_scan(path, prev),
+                "updated_at": datetime.utcnow().isoformat(),
+            }
+            FileStore.update_json_field(self.manifest_path, file_name, entry)
+        return entry
+
+    def refresh(self) -> int:
+        """Index settlement files that are missing from the manifest or changed size behind it."""
+        manifest = self.read()
+        updated = 0
+        for path in sorted(glob.glob(os.path.join(self.settlement_dir, "*.csv"))):
+            name = os.path.basename(path)
+            entry = manifest.get(name)
+            if entry is None or entry.get("bytes") != os.path.getsize(path):
+                if self.record(name, entry):
+                    updated += 1
+        return updated
+
+    def entries(self) -> list[dict]:
+        """All manifest entries, newest date first."""
+        return sorted(self.read().values(), key=lambda e: (e["date"], e["file"]), reverse=True)
+
+    def partitions(self, date: str, provider: Optional[str] = None) -> list[dict]:
+        """Settlement input for a day (or one provider of it), one entry per provider.
+
+        A provider's statement takes precedence over the file generated from
+        the ledger. Days with no partitioned files fall back to the legacy
+        single-file layout. Entries whose file size no longer matches are
+        re-described first, so checksums reflect what is on disk.
+        """
+        manifest = self.read()
+        chosen: dict[str, dict] = {}
+        legacy = []
+        for entry in manifest.values():
+            if entry["date"] != date:
+                continue
+            path = os.path.join(self.settlement_dir, entry["file"])
+            if not os.path.exists(path):
+                continue
+            if os.path.getsize(path) != entry.get("bytes"):
+                entry = self.record(entry["file"], entry) or entry
+            if entry["source"] == "legacy":
+                legacy.append(entry)
+                continue
+            if provider and entry["provider"] != provider:
+                continue
+            current = chosen.get(entry["provider"])
+            if current is None or entry["source"] == "provider":
+                chosen[entry["provider"]] = entry
+        if chosen:
+            return [chosen[p] for p in sorted(chosen)]
+        return legacy
@@ -0,0 +1,118 @@
+"""Per-stage timing spans for request handlers, keyed by correlation ID.
+
+Handlers wrap each stage in spans.span(operation, stage). The duration is
+added to that request's trace (looked up by correlation ID) and to a bounded
+sample of recent durations per (operation, stage), from which per-stage
+percentiles are reported. Both are kept in memory per worker: the trace table
+holds the last SPANS_MAX_TRACES correlation IDs and each stage keeps its last
+SPANS_STAGE_SAMPLES durations.
+"""
+
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Optional
+
+from shared.correlation import get_correlation_id
+from shared.stats import summarize
+
+SPANS_MAX_TRACES = int(os.environ.get("SPANS_MAX_TRACES", 10000))
+SPANS_STAGE_SAMPLES = int(os.environ.get("SPANS_STAGE_SAMPLES", 2048))
+
+
+class SpanRecorder:
+
+    def __init__(self, max_traces: int = SPANS_MAX_TRACES, stage_samples: int = SPANS_STAGE_SAMPLES):
+        self.max_traces = max_traces
+        self.stage_samples = stage_samples
+        self._traces: OrderedDict[str, dict] = OrderedDict()
+        self._stages: dict[tuple[str, str], deque] = {}
+        self._errors: dict[tuple[str, str], int] = {}
+
+    @contextmanager
+    def span(self, operation: str, stage: str):
+        """Time the enclosed block as one stage of operation; exceptions are recorded and re-raised."""
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.record(operation, stage, (time.perf_counter() - start) * 1000, error=error, started=start)
+
+    def record(self, operation: str, stage: str, duration_ms: float,
+               correlation_id: Optional[str] = None, error: Optional[str] = None,
+               started: Optional[float] = None):
+        cid = correlation_id or get_correlation_id()
+        started = time.perf_counter() - duration_ms / 1000 if started is None else started
+
+        trace = self._traces.get(cid)
+        if trace is None:
+            trace = self._traces[cid] = {
+                "correlation_id": cid,
+                "started_at": time.time() - (time.perf_counter() - started),
+                "_origin": started,
+                "spans": [],
+            }
+            if len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+        trace["spans"].append({
+            "operation": operation,
+            "stage": stage,
+            "offset_ms": round((started - trace["_origin"]) * 1000, 3),
+            "duration_ms": round(duration_ms, 3),
+            "error": error,
+        })
+
+        key = (operation, stage)
+        samples = self._stages.get(key)
+        if samples is None:
+            samples = self._stages[key] = deque(maxlen=self.stage_samples)
+        samples.append(duration_ms)
+        if error:
+            self._errors[key] = self._errors.get(key, 0) + 1
+
+    # === Queries ===
+
+    @staticmethod
+    def _public(trace: dict) -> dict:
+        spans = trace["spans"]
+        return {
+            "correlation_id": trace["correlation_id"],
+            "started_at": trace["started_at"],
+            "total_ms": round(sum(s["duration_ms"] for s in spans), 3),
+            "spans": list(spans),
+        }
+
+    def get(self, correlation_id: str) -> Optional[dict]:
+        trace = self._traces.get(correlation_id)
+        return self._public(trace) if trace is not None else None
+
+    def recent(self, limit: int = 50, operation: Optional[str] = None) -> list[dict]:
+        """Newest traces first, optionally only those that touched operation."""
+        results = []
+        for trace in reversed(self._traces.values()):
+            if operation and not any(s["operation"] == operation for s in trace["spans"]):
+                continue
+            results.append(self._public(trace))
+            if len(results) >= limit:
+                break
+        return results
+
+    def stage_summary(self, operation: Optional[str] = None) -> dict:
+        """Per operation, per stage: sample count, p50/p95/p99/max in ms, and error count."""
+        summary: dict[str, dict] = {}
+        for (op, stage), samples in self._stages.items():
+            if operation and op != operation:
+                continue
+            stats = {k: round(v, 3) if isinstance(v, float) else v for k, v in summarize(samples).items()}
+            stats["errors"] = self._errors.get((op, stage), 0)
+            summary.setdefault(op, {})[stage] = stats
+        return summary
+
+
+# One recorder per worker process
+spans = SpanRecorder()
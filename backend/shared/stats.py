@@ -0,0 +1,45 @@
+"""Small in-process statistics helpers (percentiles over bounded samples)."""
+
+import math
+from typing import Iterable, Optional, Sequence
+
+
+def percentile(values: Iterable[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile; pct in [0, 100]. Returns None for no samples."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values: Iterable[float]) -> dict:
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "p50": percentile(ordered, 50),
+        "p95": percentile(ordered, 95),
+        "p99": percentile(ordered, 99),
+        "max": ordered[-1] if ordered else None,
+    }
+
+
+def histogram_quantile(bounds: Sequence[float], counts: Sequence[int], pct: float) -> Optional[float]:
+    """Estimate a percentile from bucketed counts, interpolating linearly within the bucket.
+
+    counts has one more entry than bounds (the overflow bucket); samples there
+    report the highest bound, as a Prometheus histogram_quantile would.
+    """
+    total = sum(counts)
+    if not total:
+        return None
+    rank = pct / 100 * total
+    seen = 0
+    for i, count in enumerate(counts):
+        if count and seen + count >= rank:
+            if i >= len(bounds):
+                return bounds[-1]
+            low = bounds[i - 1] if i else 0.0
+            return low + (bounds[i] - low) * (rank - seen) / count
+        seen += count
+    return bounds[-1]
@@ -0,0 +1,230 @@
+"""Hash-sharded, time-bucketed key store with whole-bucket TTL eviction.
+
+Records are appended to <root>/<bucket>/shard_<NN>.jsonl, where the bucket is
+the UTC start of the record's creation window and the shard is crc32(key)
+modulo the shard count. Each process keeps a per-shard in-memory index of
+key -> (bucket, offset, length), so a lookup reads one line and an insert
+appends one. Expiry never rewrites files: once a bucket is older than the TTL
+its directory is removed in one step.
+"""
+
+import json
+import os
+import time
+import shutil
+import zlib
+import logging
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Optional
+from filelock import FileLock
+
+logger = logging.getLogger("payrail.ttl_store")
+
+_BUCKET_FORMAT = "%Y%m%dT%H%M%S"
+
+
+@lru_cache(maxsize=1024)
+def _bucket_start(bucket: str) -> float:
+    return datetime.strptime(bucket, _BUCKET_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+
+
+class _Shard:
+
+    def __init__(self, number: int, lock_path: str):
+        self.number = number
+        self.lock = FileLock(lock_path)
+        self.index: dict[str, tuple[str, int, int]] = {}
+        # bucket -> (inode, bytes indexed)
+        self.files: dict[str, tuple[Optional[int], int]] = {}
+        self.synced_at = 0.0
+
+
+class ShardedTTLStore:
+
+    def __init__(self, root: str, shards: int = 16, bucket_seconds: int = 3600, ttl_seconds: int = 86400):
+        self.root = root
+        self.bucket_seconds = bucket_seconds
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(root, exist_ok=True)
+        self.shards = self._load_layout(shards)
+        self._shards = [_Shard(n, os.path.join(root, f"shard_{n:02d}.lock")) for n in range(shards)]
+
+    # === Layout ===
+
+    def _load_layout(self, shards: int) -> int:
+        """Keys are placed by shard count, so an existing store keeps the count it was created with."""
+        path = os.path.join(self.root, "layout.json")
+        with FileLock(f"{path}.lock"):
+            try:
+                with open(path, "r") as f:
+                    existing = json.load(f)["shards"]
+            except FileNotFoundError:
+                with open(path, "w") as f:
+                    json.dump({"shards": shards}, f)
+                return shards
+        if existing != shards:
+            logger.warning(f"{self.root} was created with {existing} shards; ignoring configured {shards}")
+        return existing
+
+    def shard_of(self, key: str) -> int:
+        return zlib.crc32(key.encode()) % self.shards
+
+    def bucket_of(self, ts: float) -> str:
+        start = int(ts // self.bucket_seconds) * self.bucket_seconds
+        return datetime.fromtimestamp(start, timezone.utc).strftime(_BUCKET_FORMAT)
+
+    def _path(self, bucket: str, shard: int) -> str:
+        return os.path.join(self.root, bucket, f"shard_{shard:02d}.jsonl")
+
+    def _live_buckets(self, now: float) -> list[str]:
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        buckets = []
+        for name in names:
+            try:
+                start = _bucket_start(name)
+            except ValueError:
+                continue  # Lock files and anything else that is not a bucket
+            if start + self.bucket_seconds > now - self.ttl_seconds:
+                buckets.append(name)
+        return sorted(buckets)
+
+    # === Index maintenance ===
+
+    def _catch_up(self, shard: _Shard, bucket: str):
+        path = self._path(bucket, shard.number)
+        inode, end = shard.files.get(bucket, (None, 0))
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        if st.st_ino != inode or st.st_size < end:
+            inode, end = st.st_ino, 0
+        if st.st_size == end:
+            shard.files[bucket] = (inode, end)
+            return
+
+        with open(path, "rb") as f:
+            f.seek(end)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Partial trailing write, pick it up next time
+                try:
+                    key = json.loads(line)["key"]
+                    shard.index[key] = (bucket, end, len(line))
+                except (ValueError, KeyError, TypeError):
+                    logger.warning(f"Skipping corrupt line at {path}:{end}")
+                end += len(line)
+        shard.files[bucket] = (inode, end)
+
+    def _sync(self, shard: _Shard, now: float):
+        """Index new lines. Only the current and previous buckets still receive appends."""
+        if now - shard.synced_at > self.bucket_seconds:
+            # First use, or idle long enough that whole buckets may have been missed
+            for bucket in self._live_buckets(now):
+                self._catch_up(shard, bucket)
+        else:
+            self._catch_up(shard, self.bucket_of(now - self.bucket_seconds))
+            self._catch_up(shard, self.bucket_of(now))
+        shard.synced_at = now
+
+    def _read(self, shard: _Shard, loc: tuple[str, int, int]) -> Optional[dict]:
+        bucket, offset, length = loc
+        try:
+            with open(self._path(bucket, shard.number), "rb") as f:
+                f.seek(offset)
+                return json.loads(f.read(length))
+        except (FileNotFoundError, ValueError):
+            return None  # Bucket evicted underneath us
+
+    # === Public API ===
+
+    def get(self, key: str) -> Optional[dict]:
+        """Latest record for key, or None if absent or in an expired bucket."""
+        now = time.time()
+        shard = self._shards[self.shard_of(key)]
+        self._sync(shard, now)
+        loc = shard.index.get(key)
+        if loc is None:
+            return None
+        if _bucket_start(loc[0]) + self.bucket_seconds <= now - self.ttl_seconds:
+            return None
+        return self._read(shard, loc)
+
+    def put(self, key: str, record: dict, created_ts: Optional[float] = None) -> None:
+        """Append record under key, in the bucket for created_ts (default: now)."""
+        now = time.time()
+        bucket = self.bucket_of(created_ts if created_ts is not None else now)
+        shard = self._shards[self.shard_of(key)]
+        line = (json.dumps({**record, "key": key}, default=str) + "\n").encode()
+        path = self._path(bucket, shard.number)
+        with shard.lock:
+            self._sync(shard, now)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            inode, end = shard.files.get(bucket, (None, 0))
+            with open(path, "ab") as f:
+                offset = f.tell()
+                if offset > end:
+                    # Terminate a torn write so it cannot swallow this record
+                    f.write(b"\n")
+                    offset += 1
+                f.write(line)
+                if inode is None:
+                    inode = os.fstat(f.fileno()).st_ino
+            shard.index[key] = (bucket, offset, len(line))
+            shard.files[bucket] = (inode, offset + len(line))
+
+    def evict(self) -> list[str]:
+        """Drop every bucket older than the TTL; returns the removed bucket names."""
+        now = time.time()
+        live = set(self._live_buckets(now))
+        removed = []
+        for name in sorted(os.listdir(self.root)):
+            try:
+                _bucket_start(name)
+            except ValueError:
+                continue
+            if name not in live:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                removed.append(name)
+        for shard in self._shards:
+            expired = [b for b in shard.files if b not in live]
+            if expired:
+                gone = set(expired)
+                shard.index = {k: loc for k, loc in shard.index.items() if loc[0] not in gone}
+                for b in expired:
+                    del shard.files[b]
+        if removed:
+            logger.info(f"Evicted {len(removed)} expired buckets from {self.root}: {removed}")
+        return removed
+
+    def stats(self) -> dict:
+        now = time.time()
+        buckets = self._live_buckets(now)
+        shards = []
+        for shard in self._shards:
+            size = 0
+            files = 0
+            for bucket in buckets:
+                try:
+                    size += os.path.getsize(self._path(bucket, shard.number))
+                    files += 1
+                except FileNotFoundError:
+                    pass
+            shards.append({
+                "shard": shard.number,
+                "files": files,
+                "bytes": size,
+                "indexed_keys": len(shard.index),
+            })
+        return {
+            "root": self.root,
+            "bucket_seconds": self.bucket_seconds,
+            "ttl_seconds": self.ttl_seconds,
+            "buckets": buckets,
+            "total_bytes": sum(s["bytes"] for s in shards),
+            "shards": shards,
+        }
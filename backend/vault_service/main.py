@@ -2,10 +2,13 @@
 
 import os
 import uuid
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional
+from typing import Callable, Optional
 
+from cryptography.fernet import InvalidToken
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 
@@ -13,9 +16,12 @@ import sys
 sys.path.insert(0, "/app/shared")
 
 from shared.file_store import FileStore
+from shared.log_writer import BatchedLogWriter
 from shared.crypto import VaultCrypto
 from shared.correlation import get_correlation_id, set_correlation_id, generate_correlation_id
 from shared.middleware import CorrelationMiddleware
+from token_store import TokenStore, TokenWriteBatcher
+from reencryption import ReencryptionJob, VAULT_REENCRYPT_ON_ROTATE
 
 logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
 logger = logging.getLogger("vault-service")
@@ -29,8 +35,35 @@ TOKENS_PATH = os.path.join(VAULT_DIR, "tokens.json")
 CARDS_PATH = os.path.join(VAULT_DIR, "encrypted_cards.json")
 ACCESS_LOG_PATH = os.path.join(VAULT_DIR, "access_log.jsonl")
 KEYS_PATH = os.path.join(VAULT_DIR, "keys.json")
+REENCRYPT_CHECKPOINT_PATH = os.path.join(VAULT_DIR, "reencrypt_checkpoint.json")
+# Threads that encrypt/decrypt batch items off the event loop
+VAULT_CRYPTO_WORKERS = int(os.environ.get("VAULT_CRYPTO_WORKERS", min(4, os.cpu_count() or 1)))
+VAULT_BATCH_MAX_ITEMS = int(os.environ.get("VAULT_BATCH_MAX_ITEMS", 1000))
 
 crypto = VaultCrypto(KEYS_PATH)
+token_store = TokenStore(TOKENS_PATH, CARDS_PATH)
+# /tokenize and /tokenize/batch writes, group-committed off the event loop
+token_writer = TokenWriteBatcher(token_store)
+crypto_pool = ThreadPoolExecutor(max_workers=VAULT_CRYPTO_WORKERS, thread_name_prefix="vault-crypto")
+reencryption = ReencryptionJob(crypto, token_store, REENCRYPT_CHECKPOINT_PATH, crypto_pool)
+# The access log is an audit trail: a full queue makes callers wait rather than drop
+access_writer = BatchedLogWriter(ACCESS_LOG_PATH)
+
+
+@app.on_event("startup")
+async def startup():
+    access_writer.start()
+    app.state.reencryption = asyncio.create_task(reencryption.run_forever())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.reencryption.cancel()
+    await asyncio.gather(app.state.reencryption, return_exceptions=True)
+    await token_writer.close()
+    crypto_pool.shutdown(wait=True)
+    await access_writer.close()
+
 
 # BIN table for card brand detection
 BIN_BRANDS = {
@@ -50,15 +83,68 @@ def detect_brand(pan: str) -> str:
     return "unknown"
 
 
-def log_access(action: str, token: str, requester: str, purpose: str):
-    FileStore.append_jsonl(ACCESS_LOG_PATH, {
+def validate_pan(pan: str) -> Optional[str]:
+    if len(pan) < 13 or len(pan) > 19:
+        return "Invalid PAN length"
+    return None
+
+
+def build_card(pan: str, expiry: str, cardholder_name: Optional[str], encrypted_pan: str) -> dict:
+    return {
+        "encrypted_pan": encrypted_pan,
+        "bin": pan[:6],
+        "last_four": pan[-4:],
+        "expiry": expiry,
+        "card_brand": detect_brand(pan),
+        "cardholder_name": cardholder_name,
+        "created_at": datetime.utcnow().isoformat(),
+    }
+
+
+def _access_record(action: str, token: str, requester: str, purpose: str) -> dict:
+    return {
         "timestamp": datetime.utcnow().isoformat(),
         "action": action,
         "token": token,
         "requester": requester,
         "purpose": purpose,
         "correlation_id": get_correlation_id(),
-    })
+    }
+
+
+async def log_access(action: str, token: str, requester: str, purpose: str):
+    await access_writer.write(_access_record(action, token, requester, purpose))
+
+
+async def log_access_many(action: str, tokens: list[str], requester: str, purpose: str):
+    """Queue one line per token, as with log_access; they flush in the writer's batches."""
+    await access_writer.write_many([_access_record(action, token, requester, purpose) for token in tokens])
+
+
+def _apply_chunk(fn: Callable[[str], str], values: list[str]) -> list[tuple[bool, str]]:
+    results = []
+    for value in values:
+        try:
+            results.append((True, fn(value)))
+        except InvalidToken:
+            results.append((False, "Ciphertext could not be decrypted"))
+        except Exception as e:
+            results.append((False, f"{type(e).__name__}: {e}"))
+    return results
+
+
+async def run_in_crypto_pool(fn: Callable[[str], str], values: list[str]) -> list[tuple[bool, str]]:
+    """Apply fn to every value across the crypto pool, one chunk per worker.
+
+    Returns (ok, result or error message) per value, in input order.
+    """
+    if not values:
+        return []
+    loop = asyncio.get_running_loop()
+    size = -(-len(values) // VAULT_CRYPTO_WORKERS)
+    chunks = [values[i:i + size] for i in range(0, len(values), size)]
+    done = await asyncio.gather(*(loop.run_in_executor(crypto_pool, _apply_chunk, fn, c) for c in chunks))
+    return [result for chunk in done for result in chunk]
 
 
 # === Request/Response Models ===
@@ -102,6 +188,55 @@ class ChargeTokenResponse(BaseModel):
     card_brand: str
 
 
+class BatchTokenizeItem(BaseModel):
+    pan: str
+    expiry: str
+    cardholder_name: Optional[str] = None
+
+
+class BatchTokenizeRequest(BaseModel):
+    cards: list[BatchTokenizeItem]
+    requester: str = "api-gateway"
+    purpose: str = "payment"
+
+
+class BatchTokenizeResult(BaseModel):
+    index: int
+    ok: bool
+    token: Optional[str] = None
+    last_four: Optional[str] = None
+    card_brand: Optional[str] = None
+    error: Optional[str] = None
+
+
+class BatchTokenizeResponse(BaseModel):
+    results: list[BatchTokenizeResult]
+    succeeded: int
+    failed: int
+
+
+class BatchChargeTokenRequest(BaseModel):
+    tokens: list[str]
+    requester: str = "api-gateway"
+    purpose: str = "charge"
+
+
+class BatchChargeTokenResult(BaseModel):
+    index: int
+    token: str
+    ok: bool
+    pan: Optional[str] = None
+    expiry: Optional[str] = None
+    card_brand: Optional[str] = None
+    error: Optional[str] = None
+
+
+class BatchChargeTokenResponse(BaseModel):
+    results: list[BatchChargeTokenResult]
+    succeeded: int
+    failed: int
+
+
 class RotateKeysResponse(BaseModel):
     message: str
     total_keys: int
@@ -111,46 +246,68 @@ class RotateKeysResponse(BaseModel):
 
 @app.post("/tokenize", response_model=TokenizeResponse)
 async def tokenize(req: TokenizeRequest):
-    if len(req.pan) < 13 or len(req.pan) > 19:
-        raise HTTPException(status_code=400, detail="Invalid PAN length")
+    error = validate_pan(req.pan)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
 
     token = f"tok_{uuid.uuid4().hex[:24]}"
     encrypted_pan = crypto.encrypt(req.pan)
-    brand = detect_brand(req.pan)
-    last_four = req.pan[-4:]
+    card = build_card(req.pan, req.expiry, req.cardholder_name, encrypted_pan)
+    brand = card["card_brand"]
+    last_four = card["last_four"]
 
-    # Store token mapping
-    tokens = FileStore.read_json(TOKENS_PATH, default={})
-    tokens[token] = encrypted_pan
-    FileStore.write_json(TOKENS_PATH, tokens)
-
-    # Store card metadata
-    cards = FileStore.read_json(CARDS_PATH, default={})
-    cards[token] = {
-        "encrypted_pan": encrypted_pan,
-        "bin": req.pan[:6],
-        "last_four": last_four,
-        "expiry": req.expiry,
-        "card_brand": brand,
-        "cardholder_name": req.cardholder_name,
-        "created_at": datetime.utcnow().isoformat(),
-    }
-    FileStore.write_json(CARDS_PATH, cards)
+    # Store token mapping and card metadata, in one commit with concurrent tokenizations
+    await token_writer.put(token, encrypted_pan, card)
 
-    log_access("tokenize", token, req.requester, req.purpose)
+    await log_access("tokenize", token, req.requester, req.purpose)
     logger.info(f"Tokenized card ending {last_four} -> {token}")
 
     return TokenizeResponse(token=token, last_four=last_four, card_brand=brand)
 
 
+@app.post("/tokenize/batch", response_model=BatchTokenizeResponse)
+async def tokenize_batch(req: BatchTokenizeRequest):
+    """Tokenize many cards: parallel encryption, one store commit, one access-log append."""
+    if len(req.cards) > VAULT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {VAULT_BATCH_MAX_ITEMS} cards")
+
+    results = [BatchTokenizeResult(index=i, ok=False) for i in range(len(req.cards))]
+    valid = []
+    for i, item in enumerate(req.cards):
+        error = validate_pan(item.pan)
+        if error:
+            results[i].error = error
+        else:
+            valid.append(i)
+
+    encrypted = await run_in_crypto_pool(crypto.encrypt, [req.cards[i].pan for i in valid])
+    entries = []
+    for i, (ok, value) in zip(valid, encrypted):
+        if not ok:
+            results[i].error = value
+            continue
+        item = req.cards[i]
+        token = f"tok_{uuid.uuid4().hex[:24]}"
+        card = build_card(item.pan, item.expiry, item.cardholder_name, value)
+        entries.append((token, value, card))
+        results[i] = BatchTokenizeResult(
+            index=i, ok=True, token=token, last_four=card["last_four"], card_brand=card["card_brand"],
+        )
+
+    await token_writer.put_many(entries)
+    await log_access_many("tokenize", [token for token, _, _ in entries], req.requester, req.purpose)
+    logger.info(f"Batch tokenized {len(entries)} of {len(req.cards)} cards")
+
+    return BatchTokenizeResponse(results=results, succeeded=len(entries), failed=len(req.cards) - len(entries))
+
+
 @app.post("/detokenize", response_model=DetokenizeResponse)
 async def detokenize(req: DetokenizeRequest):
-    cards = FileStore.read_json(CARDS_PATH, default={})
-    if req.token not in cards:
+    card = token_store.get_card(req.token)
+    if card is None:
         raise HTTPException(status_code=404, detail="Token not found")
 
-    card = cards[req.token]
-    log_access("detokenize", req.token, req.requester, req.purpose)
+    await log_access("detokenize", req.token, req.requester, req.purpose)
 
     return DetokenizeResponse(
         token=req.token,
@@ -162,17 +319,14 @@ async def detokenize(req: DetokenizeRequest):
 
 @app.post("/charge-token", response_model=ChargeTokenResponse)
 async def charge_token(req: ChargeTokenRequest):
-    tokens = FileStore.read_json(TOKENS_PATH, default={})
-    cards = FileStore.read_json(CARDS_PATH, default={})
-
-    if req.token not in tokens:
+    found = token_store.get(req.token)
+    if found is None:
         raise HTTPException(status_code=404, detail="Token not found")
 
-    encrypted_pan = tokens[req.token]
+    encrypted_pan, card = found
     pan = crypto.decrypt(encrypted_pan)
-    card = cards[req.token]
 
-    log_access("charge-token", req.token, req.requester, req.purpose)
+    await log_access("charge-token", req.token, req.requester, req.purpose)
     logger.info(f"Charged token {req.token}")
 
     return ChargeTokenResponse(
@@ -182,26 +336,76 @@ async def charge_token(req: ChargeTokenRequest):
     )
 
 
+@app.post("/charge-token/batch", response_model=BatchChargeTokenResponse)
+async def charge_token_batch(req: BatchChargeTokenRequest):
+    """Resolve many tokens to PANs: parallel decryption, one access-log append."""
+    if len(req.tokens) > VAULT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {VAULT_BATCH_MAX_ITEMS} tokens")
+
+    results = [BatchChargeTokenResult(index=i, token=t, ok=False) for i, t in enumerate(req.tokens)]
+    found = []
+    for i, token in enumerate(req.tokens):
+        entry = token_store.get(token)
+        if entry is None:
+            results[i].error = "Token not found"
+        else:
+            found.append((i, entry))
+
+    decrypted = await run_in_crypto_pool(crypto.decrypt, [encrypted_pan for _, (encrypted_pan, _) in found])
+    charged = []
+    for (i, (_, card)), (ok, value) in zip(found, decrypted):
+        if not ok:
+            results[i].error = value
+            continue
+        results[i] = BatchChargeTokenResult(
+            index=i, token=req.tokens[i], ok=True,
+            pan=value, expiry=card["expiry"], card_brand=card["card_brand"],
+        )
+        charged.append(req.tokens[i])
+
+    await log_access_many("charge-token", charged, req.requester, req.purpose)
+    logger.info(f"Batch charged {len(charged)} of {len(req.tokens)} tokens")
+
+    return BatchChargeTokenResponse(results=results, succeeded=len(charged), failed=len(req.tokens) - len(charged))
+
+
 @app.post("/rotate-keys", response_model=RotateKeysResponse)
 async def rotate_keys():
     crypto.rotate_key()
-    import json
-    with open(KEYS_PATH, "r") as f:
-        data = json.load(f)
-    total = len(data["keys"])
+    total = crypto.key_count()
 
-    log_access("rotate-keys", "N/A", "admin", "key-rotation")
+    await log_access("rotate-keys", "N/A", "admin", "key-rotation")
     logger.info(f"Key rotated. Total keys: {total}")
+    if VAULT_REENCRYPT_ON_ROTATE:
+        reencryption.request()
 
     return RotateKeysResponse(message="Key rotated successfully", total_keys=total)
 
 
+@app.post("/reencrypt")
+async def start_reencryption():
+    """Start (or resume) re-encrypting stored PANs under the active key."""
+    reencryption.request()
+    await log_access("reencrypt", "N/A", "admin", "key-rotation")
+    return reencryption.status()
+
+
+@app.get("/reencrypt/status")
+async def reencryption_status():
+    return reencryption.status()
+
+
 @app.get("/health")
 async def health():
     return {"status": "healthy", "service": "vault-service"}
 
 
+@app.get("/metrics/log-writer")
+async def log_writer_stats():
+    return access_writer.stats()
+
+
 @app.get("/access-log")
 async def access_log(limit: int = 100):
-    logs = FileStore.read_jsonl(ACCESS_LOG_PATH)
-    return {"entries": logs[-limit:], "total": len(logs)}
+    logs = FileStore.tail_jsonl(ACCESS_LOG_PATH, limit)
+    return {"entries": logs, "total": FileStore.count_jsonl(ACCESS_LOG_PATH)}
@@ -0,0 +1,198 @@
+"""Background re-encryption of stored PANs under the active key, then old-key retirement."""
+
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import Executor
+from datetime import datetime
+from typing import Optional
+from filelock import FileLock, Timeout
+from cryptography.fernet import InvalidToken
+
+from shared.crypto import VaultCrypto
+from shared.file_store import FileStore
+from token_store import TokenStore
+
+logger = logging.getLogger("vault-service.reencryption")
+
+VAULT_REENCRYPT_CHUNK = int(os.environ.get("VAULT_REENCRYPT_CHUNK", 100))
+# Upper bound on tokens re-encrypted per second, leaving headroom for /charge-token
+VAULT_REENCRYPT_RATE = float(os.environ.get("VAULT_REENCRYPT_RATE", 500))
+# Tokens scanned between token store rewrites (each rewrite writes both files in full)
+VAULT_REENCRYPT_COMMIT_TOKENS = int(os.environ.get("VAULT_REENCRYPT_COMMIT_TOKENS", 5000))
+VAULT_REENCRYPT_ON_ROTATE = os.environ.get("VAULT_REENCRYPT_ON_ROTATE", "true").lower() == "true"
+VAULT_REENCRYPT_RETIRE_KEYS = os.environ.get("VAULT_REENCRYPT_RETIRE_KEYS", "true").lower() == "true"
+
+
+class ReencryptionJob:
+    """Walks the token store in token order and re-wraps each PAN under the active key.
+
+    Rewrapped ciphertexts are committed to the token store in batches of
+    commit_tokens scanned tokens, off the event loop, and progress (token
+    cursor plus counters) is checkpointed after each commit, so a restart
+    resumes from the last commit. If the key is rotated mid-run the walk
+    restarts against the new key. A completed pass means every stored
+    ciphertext uses the active key, so the older keys can be retired. Only one
+    vault worker runs a pass at a time (reencrypt.lock).
+    """
+
+    def __init__(self, crypto: VaultCrypto, token_store: TokenStore, checkpoint_path: str,
+                 pool: Executor, chunk_size: int = VAULT_REENCRYPT_CHUNK,
+                 rate: float = VAULT_REENCRYPT_RATE, retire_keys: bool = VAULT_REENCRYPT_RETIRE_KEYS,
+                 commit_tokens: int = VAULT_REENCRYPT_COMMIT_TOKENS):
+        self.crypto = crypto
+        self.token_store = token_store
+        self.checkpoint_path = checkpoint_path
+        self.pool = pool
+        self.chunk_size = chunk_size
+        self.commit_tokens = max(chunk_size, commit_tokens)
+        self.rate = rate
+        self.retire_keys = retire_keys
+        self._run_lock = FileLock(os.path.join(os.path.dirname(checkpoint_path), "reencrypt.lock"))
+        self._wake = asyncio.Event()
+        self._running = False
+
+    # === Checkpoint ===
+
+    def _load(self) -> dict:
+        return FileStore.read_json(self.checkpoint_path, default={})
+
+    def _save(self, state: dict):
+        state["updated_at"] = datetime.utcnow().isoformat()
+        FileStore.write_json(self.checkpoint_path, state)
+
+    def _fresh(self, target: str) -> dict:
+        return {
+            "status": "running",
+            "target_key_id": target,
+            "cursor": None,
+            "total": self.token_store.count(),
+            "scanned": 0,
+            "rewrapped": 0,
+            "unreadable": 0,
+            "retired_key_ids": [],
+            "started_at": datetime.utcnow().isoformat(),
+            "finished_at": None,
+        }
+
+    # === Control ===
+
+    def request(self):
+        """Ask the background loop to start (or resume) a pass."""
+        self._wake.set()
+
+    def status(self) -> dict:
+        state = self._load()
+        total = state.get("total") or 0
+        return {
+            **state,
+            "active": self._running,
+            "progress": round(min(state.get("scanned", 0) / total, 1.0), 4) if total else None,
+            "active_key_id": self.crypto.active_key_id(),
+            "key_ids": self.crypto.key_ids(),
+            "chunk_size": self.chunk_size,
+            "commit_tokens": self.commit_tokens,
+            "rate_limit": self.rate,
+        }
+
+    async def run_forever(self):
+        # Resume a pass interrupted by a restart
+        if self._load().get("status") == "running":
+            self._wake.set()
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Re-encryption pass failed: {e}")
+
+    # === Work ===
+
+    def _rewrap_chunk(self, chunk: list[tuple[str, str]]) -> tuple[dict[str, tuple[str, str]], int]:
+        updates, unreadable = {}, 0
+        for token, ciphertext in chunk:
+            try:
+                rewrapped = self.crypto.rewrap(ciphertext)
+            except InvalidToken:
+                unreadable += 1  # Decrypts under no key, so it pins none of them
+                continue
+            if rewrapped is not None:
+                updates[token] = (ciphertext, rewrapped)
+        return updates, unreadable
+
+    async def run_once(self) -> Optional[dict]:
+        """Run one pass to completion; returns the final checkpoint, or None if another worker holds it."""
+        try:
+            self._run_lock.acquire(timeout=0)
+        except Timeout:
+            logger.info("Re-encryption already running in another worker")
+            return None
+        self._running = True
+        try:
+            state = self._load()
+            if state.get("status") == "completed" and state.get("target_key_id") == self.crypto.active_key_id():
+                return state  # Already done for this key; later writes use it anyway
+            while True:
+                target = self.crypto.active_key_id()
+                if state.get("status") != "running" or state.get("target_key_id") != target:
+                    state = self._fresh(target)
+                    self._save(state)
+                    logger.info(f"Re-encryption started: {state['total']} tokens -> key {target}")
+                if await self._walk(state, target):
+                    break
+                # Rotated mid-run: the new key becomes the target, start over
+                logger.info("Active key changed during re-encryption, restarting against it")
+
+            if self.retire_keys:
+                state["retired_key_ids"] = self.crypto.retire_keys(target)
+            state["status"] = "completed"
+            state["finished_at"] = datetime.utcnow().isoformat()
+            self._save(state)
+            logger.info(
+                f"Re-encryption completed: {state['rewrapped']} rewrapped, {state['unreadable']} unreadable, "
+                f"retired keys {state['retired_key_ids']}"
+            )
+            return state
+        finally:
+            self._running = False
+            self._run_lock.release()
+
+    async def _walk(self, state: dict, target: str) -> bool:
+        """Process chunks from the checkpoint cursor; False if the active key changed."""
+        loop = asyncio.get_running_loop()
+        cursor = state["cursor"]
+        pending: dict[str, tuple[str, str]] = {}
+        pending_scanned = pending_unreadable = 0
+
+        async def commit():
+            nonlocal pending, pending_scanned, pending_unreadable
+            if pending:
+                # Rewrites both store files; run it off the loop so /charge-token keeps being served
+                state["rewrapped"] += await loop.run_in_executor(
+                    self.pool, self.token_store.replace_ciphertexts, pending
+                )
+            state["unreadable"] += pending_unreadable
+            state["scanned"] += pending_scanned
+            state["cursor"] = cursor
+            self._save(state)
+            pending, pending_scanned, pending_unreadable = {}, 0, 0
+
+        while True:
+            if self.crypto.active_key_id() != target:
+                return False
+            chunk = self.token_store.tokens_after(cursor, self.chunk_size)
+            if not chunk:
+                await commit()
+                return True
+            started = time.monotonic()
+            updates, unreadable = await loop.run_in_executor(self.pool, self._rewrap_chunk, chunk)
+            pending.update(updates)
+            pending_unreadable += unreadable
+            pending_scanned += len(chunk)
+            cursor = chunk[-1][0]
+            if pending_scanned >= self.commit_tokens:
+                await commit()
+            # Pace to the rate limit; the sleep also yields to request handlers
+            await asyncio.sleep(max(0.0, len(chunk) / self.rate - (time.monotonic() - started)))
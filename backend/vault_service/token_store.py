@@ -0,0 +1,201 @@
+"""In-memory token index over tokens.json and encrypted_cards.json."""
+
+import os
+import asyncio
+import logging
+from contextlib import contextmanager
+from bisect import bisect_right, insort
+from typing import Optional
+from filelock import FileLock
+
+from shared.file_store import FileStore
+
+logger = logging.getLogger("vault-service.token_store")
+
+
+class TokenStore:
+    """Token -> encrypted PAN and card metadata, served from memory.
+
+    Both files are loaded once and reloaded only when either one's
+    (inode, size, mtime_ns) changes, so a lookup costs two stats and two dict
+    gets however many cards the vault holds. Writers serialize on a store lock
+    and record the signature of the files they wrote, so a worker does not
+    reload its own writes. While a write runs in a worker thread, readers
+    use the in-memory state (already the newer one) instead of reloading
+    half-written files.
+    """
+
+    def __init__(self, tokens_path: str, cards_path: str):
+        self.tokens_path = tokens_path
+        self.cards_path = cards_path
+        self._lock = FileLock(os.path.join(os.path.dirname(cards_path), "token_store.lock"))
+        self._tokens: dict[str, str] = {}
+        self._cards: dict[str, dict] = {}
+        self._signature: Optional[tuple] = None
+        # Tokens in sorted order, built on demand for cursor walks
+        self._sorted: Optional[list[str]] = None
+        self._writing = False
+        self.reloads = 0
+
+    @staticmethod
+    def _file_signature(path: str) -> Optional[tuple]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _current_signature(self) -> tuple:
+        return self._file_signature(self.tokens_path), self._file_signature(self.cards_path)
+
+    def _refresh(self):
+        if self._writing:
+            return
+        signature = self._current_signature()
+        if signature == self._signature:
+            return
+        # Signature first: a write landing mid-load just triggers another reload
+        self._tokens = FileStore.read_json(self.tokens_path, default={})
+        self._cards = FileStore.read_json(self.cards_path, default={})
+        self._signature = signature
+        self._sorted = None
+        self.reloads += 1
+        logger.info(f"Token index loaded: {len(self._tokens)} tokens")
+
+    def invalidate(self):
+        self._signature = None
+
+    def get(self, token: str) -> Optional[tuple[str, dict]]:
+        """(encrypted_pan, card metadata) for token, or None if unknown."""
+        self._refresh()
+        encrypted_pan = self._tokens.get(token)
+        if encrypted_pan is None:
+            return None
+        return encrypted_pan, self._cards[token]
+
+    def get_card(self, token: str) -> Optional[dict]:
+        self._refresh()
+        return self._cards.get(token)
+
+    def put(self, token: str, encrypted_pan: str, card: dict) -> None:
+        self.put_many([(token, encrypted_pan, card)])
+
+    def put_many(self, entries: list[tuple[str, str, dict]]) -> None:
+        """Add (token, encrypted_pan, card) entries with one rewrite of each file."""
+        if not entries:
+            return
+        with self._writer():
+            for token, encrypted_pan, card in entries:
+                if self._sorted is not None and token not in self._tokens:
+                    insort(self._sorted, token)
+                self._tokens[token] = encrypted_pan
+                self._cards[token] = card
+            self._commit()
+
+    def replace_ciphertexts(self, updates: dict[str, tuple[str, str]]) -> int:
+        """Swap token -> (old, new) ciphertexts in one commit.
+
+        A token is only updated if it still holds old, so a concurrent write
+        is never overwritten. Returns the number of tokens updated.
+        """
+        if not updates:
+            return 0
+        with self._writer():
+            replaced = 0
+            for token, (old, new) in updates.items():
+                if self._tokens.get(token) != old:
+                    continue
+                self._tokens[token] = new
+                card = self._cards.get(token)
+                if card is not None:
+                    card["encrypted_pan"] = new
+                replaced += 1
+            if replaced:
+                self._commit()
+            return replaced
+
+    @contextmanager
+    def _writer(self):
+        """Hold the store lock with readers kept on the in-memory state.
+
+        Writes block on the lock and rewrite both files, so callers on the
+        event loop run them in a thread.
+        """
+        with self._lock:
+            self._refresh()
+            self._writing = True
+            try:
+                yield
+            finally:
+                self._writing = False
+
+    def _commit(self):
+        """Write both files; caller holds the store lock."""
+        try:
+            FileStore.write_json(self.tokens_path, self._tokens)
+            FileStore.write_json(self.cards_path, self._cards)
+        except Exception:
+            self.invalidate()
+            raise
+        self._signature = self._current_signature()
+
+    def tokens_after(self, cursor: Optional[str], limit: int) -> list[tuple[str, str]]:
+        """Up to limit (token, encrypted_pan) pairs in token order, after cursor."""
+        self._refresh()
+        if self._sorted is None:
+            self._sorted = sorted(self._tokens)
+        start = bisect_right(self._sorted, cursor) if cursor else 0
+        return [(token, self._tokens[token]) for token in self._sorted[start:start + limit]]
+
+    def count(self) -> int:
+        self._refresh()
+        return len(self._tokens)
+
+
+class TokenWriteBatcher:
+    """Coalesces concurrent token store writes into shared put_many commits.
+
+    Every commit rewrites both files, so one commit per /tokenize call costs
+    O(N) each. Writes that arrive while a commit is running in a worker thread
+    wait and go out together in the next one. Callers return only after their
+    entries are on disk.
+    """
+
+    def __init__(self, store: TokenStore):
+        self.store = store
+        self._pending: list[tuple[list[tuple[str, str, dict]], asyncio.Future]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def put(self, token: str, encrypted_pan: str, card: dict) -> None:
+        await self.put_many([(token, encrypted_pan, card)])
+
+    async def put_many(self, entries: list[tuple[str, str, dict]]) -> None:
+        if not entries:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((entries, future))
+        if self._task is None:
+            self._task = asyncio.create_task(self._drain())
+        await future
+
+    async def _drain(self):
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    await asyncio.to_thread(self.store.put_many, [e for entries, _ in batch for e in entries])
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_result(None)
+        finally:
+            self._task = None
+
+    async def close(self):
+        """Wait for queued writes to be committed."""
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
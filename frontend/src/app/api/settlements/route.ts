@@ -2,8 +2,13 @@ import { NextRequest, NextResponse } from "next/server";
 
 const API = process.env.INTERNAL_API_URL || "http://api-gateway:8026";
 
-export async function GET() {
-  const res = await fetch(`${API}/audit/settlements`, {
+export async function GET(request: NextRequest) {
+  const file = request.nextUrl.searchParams.get("file");
+  const limit = request.nextUrl.searchParams.get("limit") || "100";
+  const url = file
+    ? `${API}/audit/settlements/${encodeURIComponent(file)}?limit=${limit}`
+    : `${API}/audit/settlements`;
+  const res = await fetch(url, {
     headers: { "X-Merchant-Id": "m_001" },
     cache: "no-store",
   });
@@ -76,7 +76,11 @@ export default function ReconciliationPage() {
           {/* Mismatches Table */}
           {(r.mismatches || []).length > 0 && (
             <div>
-              <h3 className="text-sm font-medium text-gray-500 mb-2">Mismatches</h3>
+              <h3 className="text-sm font-medium text-gray-500 mb-2">
+                Mismatches
+                {r.mismatches_total != null && r.mismatches_total > r.mismatches.length &&
+                  ` (first ${r.mismatches.length} of ${r.mismatches_total})`}
+              </h3>
               <div className="overflow-x-auto">
                 <table className="w-full text-sm">
                   <thead className="bg-gray-50">
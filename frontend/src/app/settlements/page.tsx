@@ -7,6 +7,19 @@ import { formatCurrency, formatDate } from "@/lib/constants";
 export default function SettlementsPage() {
   const [data, setData] = useState<any>({ settlements: [] });
   const [loading, setLoading] = useState(true);
+  const [rows, setRows] = useState<Record<string, any[]>>({});
+
+  const toggleRows = (file: string) => {
+    if (rows[file]) {
+      const { [file]: _, ...rest } = rows;
+      setRows(rest);
+      return;
+    }
+    fetch(`/api/settlements?file=${encodeURIComponent(file)}&limit=500`)
+      .then((r) => r.json())
+      .then((d) => setRows((prev) => ({ ...prev, [file]: d.data || [] })))
+      .catch(() => {});
+  };
 
   useEffect(() => {
     fetch("/api/settlements")
@@ -20,7 +33,7 @@ export default function SettlementsPage() {
     <div>
       <h1 className="text-2xl font-bold mb-6">
         Settlement Viewer
-        <Tooltip text="Bank-style settlement files generated from captured payments." />
+        <Tooltip text="Bank-style settlement files per day and provider: generated from captured payments, or the provider's own statement." />
       </h1>
 
       {(data.settlements || []).length === 0 && !loading && (
@@ -34,37 +47,51 @@ export default function SettlementsPage() {
           <div className="px-6 py-4 border-b flex items-center justify-between">
             <div>
               <h2 className="text-lg font-semibold">{s.file}</h2>
-              <p className="text-xs text-gray-500">{s.rows} rows | Total: {formatCurrency(s.total_amount)}</p>
+              <p className="text-xs text-gray-500">
+                {s.provider || "all providers"} | {s.source === "provider" ? "provider statement" : s.source} | {s.rows} rows | Total: {formatCurrency(s.total_amount)}
+              </p>
+              <p className="text-xs text-gray-400 font-mono" title={s.checksum}>sha256 {String(s.checksum || "").slice(0, 16)}</p>
             </div>
+            <button
+              onClick={() => toggleRows(s.file)}
+              className="text-sm text-blue-600 hover:underline"
+            >
+              {rows[s.file] ? "Hide rows" : "View rows"}
+            </button>
           </div>
-          <div className="overflow-x-auto">
-            <table className="w-full text-sm">
-              <thead className="bg-gray-50">
-                <tr>
-                  <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Payment ID</th>
-                  <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Provider Ref</th>
-                  <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Amount</th>
-                  <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Currency</th>
-                  <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Type</th>
-                  <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Status</th>
-                  <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Settled At</th>
-                </tr>
-              </thead>
-              <tbody className="divide-y divide-gray-200">
-                {(s.data || []).map((row: any, i: number) => (
-                  <tr key={i} className="hover:bg-gray-50">
-                    <td className="px-6 py-3 font-mono text-xs">{row.payment_id}</td>
-                    <td className="px-6 py-3 font-mono text-xs text-gray-500">{row.provider_ref}</td>
-                    <td className="px-6 py-3">{formatCurrency(parseInt(row.amount) || 0, row.currency)}</td>
-                    <td className="px-6 py-3">{row.currency}</td>
-                    <td className="px-6 py-3 text-xs">{row.type}</td>
-                    <td className="px-6 py-3 text-xs">{row.status}</td>
-                    <td className="px-6 py-3 text-xs text-gray-500">{row.settled_at}</td>
+          {rows[s.file] && (
+            <div className="overflow-x-auto">
+              <table className="w-full text-sm">
+                <thead className="bg-gray-50">
+                  <tr>
+                    <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Payment ID</th>
+                    <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Provider Ref</th>
+                    <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Amount</th>
+                    <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Currency</th>
+                    <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Type</th>
+                    <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Status</th>
+                    <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Settled At</th>
                   </tr>
-                ))}
-              </tbody>
-            </table>
-          </div>
+                </thead>
+                <tbody className="divide-y divide-gray-200">
+                  {rows[s.file].map((row: any, i: number) => (
+                    <tr key={i} className="hover:bg-gray-50">
+                      <td className="px-6 py-3 font-mono text-xs">{row.payment_id}</td>
+                      <td className="px-6 py-3 font-mono text-xs text-gray-500">{row.provider_ref}</td>
+                      <td className="px-6 py-3">{formatCurrency(parseInt(row.amount) || 0, row.currency)}</td>
+                      <td className="px-6 py-3">{row.currency}</td>
+                      <td className="px-6 py-3 text-xs">{row.type}</td>
+                      <td className="px-6 py-3 text-xs">{row.status}</td>
+                      <td className="px-6 py-3 text-xs text-gray-500">{row.settled_at}</td>
+                    </tr>
+                  ))}
+                </tbody>
+              </table>
+              {rows[s.file].length < s.rows && (
+                <p className="px-6 py-3 text-xs text-gray-500">Showing first {rows[s.file].length} of {s.rows} rows</p>
+              )}
+            </div>
+          )}
         </div>
       ))}
     </div>
@@ -68,14 +68,35 @@ export interface ProviderHealth {
   total_requests: number;
   last_failure_at?: string;
   last_success_at?: string;
+  opened_at?: string;
+  trip_reason?: string;
+  window?: ProviderWindowStats;
   can_execute: boolean;
 }
 
+export interface ProviderWindowStats {
+  mode: string;
+  window_seconds: number;
+  buckets: number;
+  requests: number;
+  errors: number;
+  error_rate: number;
+  p50_ms?: number;
+  p95_ms?: number;
+  p99_ms?: number;
+}
+
 export interface Settlement {
   file: string;
+  date: string;
+  provider: string | null;
+  source: "ledger" | "provider" | "legacy";
   rows: number;
   total_amount: number;
-  data: Record<string, any>[];
+  bytes: number;
+  checksum: string;
+  updated_at: string;
+  data?: Record<string, any>[];
 }
 
 export interface ReconciliationReport {
@@ -95,6 +116,11 @@ export interface ReconciliationReport {
     diff?: number;
     issue: string;
   }>;
+  totals_by_currency?: Record<string, { ledger: number; settlement: number }>;
+  ledger_totals_by_provider?: Record<string, number>;
+  mismatches_total?: number;
+  mismatches_file?: string;
+  settlement_files?: string[];
   generated_at: string;
 }
 
@@ -0,0 +1,136 @@
+"""Benchmark the gateway middleware stack: pure ASGI layers vs the previous BaseHTTPMiddleware layers."""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+sys.path.insert(0, "/app")
+
+# The metrics writer reads DATA_DIR at import time, so point it at a scratch directory first
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="payrail-middleware-bench-")
+
+import httpx
+from fastapi import FastAPI
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from shared.correlation import set_correlation_id, generate_correlation_id
+from shared.middleware import (
+    CorrelationMiddleware, RBACMiddleware, MetricsMiddleware, metrics_writer, observe_request,
+)
+from shared.stats import percentile
+
+
+# === The previous stack, kept here as the baseline ===
+
+class LegacyCorrelationMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        cid = request.headers.get("X-Correlation-Id", generate_correlation_id())
+        set_correlation_id(cid)
+        response = await call_next(request)
+        response.headers["X-Correlation-Id"] = cid
+        return response
+
+
+class LegacyRBACMiddleware(BaseHTTPMiddleware):
+    EXEMPT_PATHS = {"/health", "/docs", "/openapi.json", "/redoc"}
+
+    async def dispatch(self, request: Request, call_next):
+        if request.url.path in self.EXEMPT_PATHS or request.url.path.startswith("/webhooks/"):
+            return await call_next(request)
+        if request.method == "GET":
+            return await call_next(request)
+        if not request.headers.get("X-Merchant-Id") and request.method in ("POST", "PUT", "PATCH", "DELETE"):
+            return JSONResponse(status_code=401, content={"error": "X-Merchant-Id header required"})
+        return await call_next(request)
+
+
+class LegacyMetricsMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        start = time.perf_counter()
+        response = await call_next(request)
+        # Same recording as the ASGI layer, so only the middleware mechanics differ
+        await observe_request(request.scope, response.status_code, start)
+        return response
+
+
+def build_app(stack: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/payment-intents/{payment_id}")
+    async def get_payment(payment_id: str):
+        return {"payment_id": payment_id, "status": "authorized", "amount": 1000}
+
+    @app.post("/payment-intents/{payment_id}/capture")
+    async def capture(payment_id: str):
+        return {"payment_id": payment_id, "status": "captured"}
+
+    if stack == "asgi":
+        layers = (MetricsMiddleware, RBACMiddleware, CorrelationMiddleware)
+    elif stack == "base":
+        layers = (LegacyMetricsMiddleware, LegacyRBACMiddleware, LegacyCorrelationMiddleware)
+    else:
+        layers = ()
+    for layer in layers:
+        app.add_middleware(layer)
+    return app
+
+
+async def run(stack: str, requests: int, concurrency: int) -> dict:
+    app = build_app(stack)
+    transport = httpx.ASGITransport(app=app)
+    latencies: list[float] = []
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            while not queue.empty():
+                i = queue.get_nowait()
+                start = time.perf_counter()
+                if i % 4 == 0:
+                    r = await client.post(f"/payment-intents/pi_{i}/capture", headers={"X-Merchant-Id": "m_1"})
+                else:
+                    r = await client.get(f"/payment-intents/pi_{i}")
+                latencies.append((time.perf_counter() - start) * 1000)
+                assert r.status_code == 200, r.status_code
+                if stack != "none":
+                    assert r.headers["X-Correlation-Id"]
+
+        # Warm up routing and the metrics series before timing
+        for _ in range(50):
+            await client.get("/payment-intents/pi_warm")
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "rps": requests / elapsed,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    metrics_writer.start()
+    print(f"{'stack':>6} {'req/s':>9} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+    for stack in ("none", "base", "asgi"):
+        # Best of N rounds to damp scheduler noise
+        results = [await run(stack, args.requests, args.concurrency) for _ in range(args.rounds)]
+        best = max(results, key=lambda r: r["rps"])
+        print(f"{stack:>6} {best['rps']:>9.0f} {best['p50']:>9.3f} {best['p99']:>9.3f}")
+    await metrics_writer.close()
+    print(f"(python {sys.version.split()[0]}, {args.concurrency} concurrent, in-process ASGI transport)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+"""Benchmark reconciliation engines on a synthetic settlement day: streaming merge-join vs NumPy columnar."""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+sys.path.insert(0, "/app")
+
+# Reconciliation reads DATA_DIR at import time, so point it at a scratch directory first
+_DATA_DIR = tempfile.mkdtemp(prefix="payrail-recon-bench-")
+os.environ["DATA_DIR"] = _DATA_DIR
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from shared.file_store import FileStore
+import reconciliation
+
+DATE = "2026-03-01"
+CURRENCIES = ["USD", "USD", "USD", "EUR", "GBP"]
+PROVIDERS = ["providerA", "providerB"]
+
+
+def seed(rows: int, mismatch_rate: float, rng: random.Random):
+    """Write a ledger and per-provider settlement partitions for DATE with a sprinkling of each kind of mismatch."""
+    ledger_path = reconciliation.LEDGER_PATH
+    os.makedirs(os.path.dirname(ledger_path), exist_ok=True)
+    headers = ["payment_id", "provider_ref", "amount", "currency", "type", "status", "settled_at", "provider"]
+    ledger, settlement = [], {p: [] for p in PROVIDERS}
+    for i in range(rows):
+        pid = f"pi_{rng.getrandbits(48):012x}"
+        amount = rng.randint(100, 500000)
+        currency = rng.choice(CURRENCIES)
+        provider = rng.choice(PROVIDERS)
+        ts = f"{DATE}T{i * 86400 // rows // 3600:02d}:00:00"
+        r = rng.random()
+        if r >= mismatch_rate / 3:  # else: missing from ledger
+            ledger.append({
+                "type": "payment.captured", "ref": pid, "amount": amount, "currency": currency,
+                "provider": provider, "timestamp": ts,
+            })
+        if not mismatch_rate / 3 <= r < 2 * mismatch_rate / 3:  # else: missing from settlement
+            settled = amount - rng.randint(1, 500) if 2 * mismatch_rate / 3 <= r < mismatch_rate else amount
+            settlement[provider].append({
+                "payment_id": pid, "provider_ref": f"txn_{i}", "amount": settled, "currency": currency,
+                "type": "payment.captured", "status": "settled", "settled_at": ts, "provider": provider,
+            })
+        if len(ledger) >= 50000:
+            FileStore.append_jsonl_many(ledger_path, ledger)
+            ledger = []
+    FileStore.append_jsonl_many(ledger_path, ledger)
+    for provider, partition in settlement.items():
+        FileStore.write_csv(reconciliation.settlements.path(DATE, provider), headers, partition)
+        reconciliation.settlements.record(reconciliation.settlements.file_name(DATE, provider))
+
+
+def run(engine: str, chunk_size: int, ingest_workers: int) -> tuple[float, dict, bytes]:
+    job = reconciliation.ReconciliationJob(chunk_size=chunk_size, engine=engine, ingest_workers=ingest_workers)
+    start = time.perf_counter()
+    report = job.reconcile(DATE)
+    elapsed = time.perf_counter() - start
+    with open(os.path.join(reconciliation.RECON_DIR, report["mismatches_file"]), "rb") as f:
+        mismatches = f.read()
+    return elapsed, report, mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--mismatch-rate", type=float, default=0.001)
+    parser.add_argument("--chunk-size", type=int, default=reconciliation.RECON_CHUNK_SIZE)
+    parser.add_argument("--ingest-workers", type=int, default=reconciliation.RECON_INGEST_WORKERS,
+                        help="1 reads the settlement partitions inline")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    seed(args.rows, args.mismatch_rate, random.Random(42))
+    print(f"seeded {args.rows} payments in {time.perf_counter() - start:.1f}s")
+
+    results = {}
+    for engine in ("stream", "columnar"):
+        elapsed, report, mismatches = run(engine, args.chunk_size, args.ingest_workers)
+        results[engine] = (report, mismatches)
+        print(f"{engine:>9}: {elapsed:7.2f}s  matched={report['matched']} "
+              f"mismatches={report['mismatches_total']}")
+
+    strip = lambda r: {k: v for k, v in r.items() if k != "generated_at"}
+    same = (strip(results["stream"][0]) == strip(results["columnar"][0])
+            and results["stream"][1] == results["columnar"][1])
+    print(f"reports identical: {same}")
+    print(json.dumps(strip(results["columnar"][0])["totals_by_currency"]))
+    print(f"(python {sys.version.split()[0]}, data in {_DATA_DIR})")
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
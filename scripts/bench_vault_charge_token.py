@@ -0,0 +1,95 @@
+"""Benchmark /charge-token latency against vault size, cached index vs full-file reads."""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+sys.path.insert(0, "/app")
+
+# The vault reads DATA_DIR at import time, so point it at a scratch directory first
+_DATA_DIR = tempfile.mkdtemp(prefix="payrail-vault-bench-")
+os.environ["DATA_DIR"] = _DATA_DIR
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["VAULT_CIPHER_SUITE"] = "fernet"  # The legacy path below only understands Fernet
+
+from cryptography.fernet import Fernet, MultiFernet
+from shared.file_store import FileStore
+import main as vault
+
+
+def seed(size: int, ciphertext: str) -> list[str]:
+    """Write a vault of size tokens; they share one ciphertext to keep seeding fast."""
+    tokens, cards = {}, {}
+    for i in range(size):
+        token = f"tok_{i:024x}"
+        tokens[token] = ciphertext
+        cards[token] = {
+            "encrypted_pan": ciphertext,
+            "bin": "411111",
+            "last_four": "1111",
+            "expiry": "12/30",
+            "card_brand": "visa",
+            "cardholder_name": None,
+            "created_at": "2026-02-01T00:00:00",
+        }
+    FileStore.write_json(vault.TOKENS_PATH, tokens)
+    FileStore.write_json(vault.CARDS_PATH, cards)
+    return list(tokens)
+
+
+def legacy_charge(token: str) -> str:
+    """The previous lookup: both files and the key ring re-read for every call."""
+    tokens = FileStore.read_json(vault.TOKENS_PATH, default={})
+    cards = FileStore.read_json(vault.CARDS_PATH, default={})
+    with open(vault.KEYS_PATH, "r") as f:
+        keys = json.load(f)["keys"]
+    mf = MultiFernet([Fernet((k if isinstance(k, str) else k["key"]).encode()) for k in keys])
+    # Strip the "<suite>:<key id>:" tag; the payload is a plain Fernet token
+    pan = mf.decrypt(tokens[token].rsplit(":", 1)[-1].encode()).decode()
+    return pan + cards[token]["expiry"]
+
+
+def bench(fn, tokens: list[str], calls: int) -> float:
+    """Mean microseconds per call over random tokens."""
+    sample = [random.choice(tokens) for _ in range(calls)]
+    start = time.perf_counter()
+    for token in sample:
+        fn(token)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="100,1000,10000,50000")
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--legacy-calls", type=int, default=20)
+    args = parser.parse_args()
+
+    # Extra keys make the legacy key-ring rebuild cost visible
+    for _ in range(3):
+        vault.crypto.rotate_key()
+    ciphertext = vault.crypto.encrypt("4111111111111111")
+
+    loop = asyncio.new_event_loop()
+
+    def cached(token: str):
+        return loop.run_until_complete(vault.charge_token(vault.ChargeTokenRequest(token=token)))
+
+    print(f"{'tokens':>8} {'charge-token (us)':>18} {'legacy (us)':>12} {'index reloads':>14}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        tokens = seed(size, ciphertext)
+        cached(tokens[0])  # Load the index once, as the first request after a write would
+        reloads = vault.token_store.reloads
+        current = bench(cached, tokens, args.calls)
+        legacy = bench(legacy_charge, tokens, args.legacy_calls)
+        print(f"{size:>8} {current:>18.1f} {legacy:>12.1f} {vault.token_store.reloads - reloads:>14}")
+    loop.close()
+    print(f"(python {sys.version.split()[0]}, {os.cpu_count()} cpu, data in {_DATA_DIR})")
+
+
+if __name__ == "__main__":
+    main()
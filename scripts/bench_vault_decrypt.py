@@ -0,0 +1,51 @@
+"""Benchmark vault decrypt cost against key ring size: untagged MultiFernet vs key-ID-tagged ciphertexts."""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+sys.path.insert(0, "/app")
+
+from shared.crypto import VaultCrypto
+
+PAN = "4111111111111111"
+
+
+def bench(fn, value: str, calls: int) -> float:
+    """Mean microseconds per call."""
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn(value)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ring-sizes", default="1,4,16,64")
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'keys':>5} {'legacy oldest (us)':>19} {'fernet tagged (us)':>19} {'aesgcm tagged (us)':>19}")
+    for size in (int(s) for s in args.ring_sizes.split(",")):
+        row = []
+        for suite in ("fernet", "aesgcm"):
+            keys_path = os.path.join(tempfile.mkdtemp(prefix="payrail-decrypt-bench-"), "keys.json")
+            crypto = VaultCrypto(keys_path, suite=suite)
+            oldest = crypto.encrypt(PAN)
+            for _ in range(size - 1):
+                crypto.rotate_key()
+            if suite == "fernet":
+                # An untagged token under the oldest key: MultiFernet tries every newer key first
+                legacy = oldest.rsplit(":", 1)[-1]
+                assert crypto.decrypt(legacy) == PAN
+                row.append(bench(crypto.decrypt, legacy, args.calls))
+            # Tagged ciphertext under the oldest key still costs one lookup and one decrypt
+            assert crypto.decrypt(oldest) == PAN
+            row.append(bench(crypto.decrypt, oldest, args.calls))
+        print(f"{size:>5} {row[0]:>19.1f} {row[1]:>19.1f} {row[2]:>19.1f}")
+    print(f"(python {sys.version.split()[0]}, {os.cpu_count()} cpu)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""Rebuild the ledger ref index from the ledger JSONL files."""
+
+import os
+import sys
+sys.path.insert(0, "/app/shared")
+
+from shared.ledger_index import LedgerIndex
+
+DATA_DIR = os.environ.get("DATA_DIR", "/app/data")
+LEDGER_DIR = os.path.join(DATA_DIR, "ledger")
+
+
+def rebuild():
+    index = LedgerIndex(
+        os.path.join(LEDGER_DIR, "ref_index.jsonl"),
+        {
+            "payment": os.path.join(LEDGER_DIR, "payments.jsonl"),
+            "refund": os.path.join(LEDGER_DIR, "refunds.jsonl"),
+            "dispute": os.path.join(LEDGER_DIR, "disputes.jsonl"),
+        },
+    )
+    index.rebuild()
+    print(f"Ledger index rebuilt at {index.index_path}")
+
+
+if __name__ == "__main__":
+    rebuild()
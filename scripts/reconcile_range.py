@@ -0,0 +1,45 @@
+"""Reconcile a range of days, optionally split per provider, e.g. to backfill after an incident.
+
+Run inside the ledger-jobs container:
+    python scripts/reconcile_range.py 2026-02-01 2026-02-28 --providers providerA,providerB
+"""
+
+import os
+import sys
+import json
+import argparse
+sys.path.insert(0, "/app")
+
+from reconciliation_runner import ReconciliationRunner, RECON_WORKERS
+from reconciliation import RECON_ENGINE
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("start_date")
+    parser.add_argument("end_date", nargs="?", help="Defaults to start_date")
+    parser.add_argument("--providers", default="", help="Comma-separated; omit to reconcile whole days")
+    parser.add_argument("--workers", type=int, default=RECON_WORKERS)
+    parser.add_argument("--engine", choices=["stream", "columnar"], default=RECON_ENGINE)
+    parser.add_argument("--force", action="store_true", help="Reconcile partitions even if their inputs are unchanged")
+    args = parser.parse_args()
+
+    providers = [p for p in args.providers.split(",") if p] or None
+    runner = ReconciliationRunner(workers=args.workers, engine=args.engine)
+    summary = runner.run(args.start_date, args.end_date or args.start_date, providers, force=args.force)
+
+    for row in summary["results"]:
+        label = f"{row['date']} {row['provider'] or 'all'}"
+        if row["status"] == "error":
+            print(f"{label:<24} error: {row['error']}")
+            continue
+        mismatches = row["mismatched"] + row["missing_from_settlement"] + row["missing_from_ledger"]
+        print(f"{label:<24} {row['status']:<17} matched={row['matched']:<8} mismatches={mismatches:<6}"
+              f"{' (unchanged)' if row['skipped'] else ''}")
+    print(json.dumps({k: summary[k] for k in ("status", "reconciled", "skipped", "failed", "diff", "elapsed_seconds")}))
+    print(f"Summary written under {os.path.join(os.environ.get('DATA_DIR', '/app/data'), 'reconciliation', 'runs')}")
+    sys.exit(1 if summary["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,14 +8,18 @@ import json
 import os
 import random
 import csv
+import shutil
 import hashlib
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 import sys
 sys.path.insert(0, "/app/shared")
 
+from shared.ttl_store import ShardedTTLStore
+from shared.settlement_manifest import SettlementManifest
+
 SEED = int(os.environ.get("SEED", 42))
 DATA_DIR = os.environ.get("DATA_DIR", "/app/data")
 rng = random.Random(SEED)
@@ -281,8 +285,8 @@ def seed_all():
                 "metadata": {**payment, "state": "settled", "provider_ref": provider_ref},
             })
 
-    _write_json("idempotency/payments_store.json", payments)
-    _write_json("idempotency/idempotency_keys.json", idempotency_keys)
+    _write_record_log("idempotency/payments_store.jsonl", payments)
+    _write_idempotency_keys(idempotency_keys)
     _write_jsonl("ledger/payments.jsonl", ledger_entries)
     print(f"  Payments: {len(payments)} with {len(ledger_entries)} ledger entries")
 
@@ -325,7 +329,7 @@ def seed_all():
             "metadata": refund,
         })
 
-    _write_json("idempotency/refunds_store.json", refunds)
+    _write_record_log("idempotency/refunds_store.jsonl", refunds)
     _write_jsonl("ledger/refunds.jsonl", refund_ledger)
     print(f"  Refunds: {len(refunds)}")
 
@@ -364,10 +368,15 @@ def seed_all():
             "metadata": dispute,
         })
 
-    _write_json("idempotency/disputes_store.json", disputes)
+    _write_record_log("idempotency/disputes_store.jsonl", disputes)
     _write_jsonl("ledger/disputes.jsonl", dispute_ledger)
     print(f"  Disputes: {len(disputes)}")
 
+    # Ledger files were rewritten; the ref index is rebuilt on next lookup
+    index_path = os.path.join(DATA_DIR, "ledger", "ref_index.jsonl")
+    if os.path.exists(index_path):
+        os.unlink(index_path)
+
     # === Provider States ===
     for pid in ["providerA", "providerB"]:
         _write_json(f"providers/{pid}_state.json", {
@@ -402,6 +411,7 @@ def seed_all():
             "type": e["type"],
             "status": "settled",
             "settled_at": e["timestamp"],
+            "provider": e["provider"],
         })
 
     # Inject a settlement mismatch for demo
@@ -409,13 +419,17 @@ def seed_all():
         mismatch_row = rng.choice(settlement_rows)
         mismatch_row["amount"] = int(mismatch_row["amount"]) - rng.randint(100, 500)
 
-    csv_path = os.path.join(DATA_DIR, "settlement", "settlement_2026-02-09.csv")
-    headers = ["payment_id", "provider_ref", "amount", "currency", "type", "status", "settled_at"]
-    with open(csv_path, "w", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=headers)
-        writer.writeheader()
-        writer.writerows(settlement_rows)
-    print(f"  Settlement CSV: {len(settlement_rows)} rows (1 mismatch injected)")
+    # One partition per provider, indexed in the settlement manifest
+    manifest = SettlementManifest(os.path.join(DATA_DIR, "settlement"))
+    headers = ["payment_id", "provider_ref", "amount", "currency", "type", "status", "settled_at", "provider"]
+    for provider in sorted({r["provider"] for r in settlement_rows}):
+        csv_path = manifest.path("2026-02-09", provider)
+        with open(csv_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=headers)
+            writer.writeheader()
+            writer.writerows(r for r in settlement_rows if r["provider"] == provider)
+        manifest.record(os.path.basename(csv_path))
+    print(f"  Settlement CSVs: {len(settlement_rows)} rows (1 mismatch injected)")
 
     # === Reconciliation Report ===
     # Build quick reconciliation
@@ -495,5 +509,31 @@ def _write_jsonl(rel_path: str, records: list):
             f.write(json.dumps(rec, default=str) + "\n")
 
 
+def _write_record_log(rel_path: str, records: dict):
+    # Replace (not truncate) so running services see a new file and re-index it
+    path = os.path.join(DATA_DIR, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        for record_id, data in records.items():
+            f.write(json.dumps({"id": record_id, "data": data}, default=str) + "\n")
+    os.replace(tmp, path)
+
+
+def _write_idempotency_keys(keys: dict):
+    root = os.path.join(DATA_DIR, "idempotency", "keys")
+    shutil.rmtree(root, ignore_errors=True)
+    store = ShardedTTLStore(
+        root,
+        shards=int(os.environ.get("IDEMPOTENCY_SHARDS", 16)),
+        bucket_seconds=int(os.environ.get("IDEMPOTENCY_BUCKET_MINUTES", 60)) * 60,
+        ttl_seconds=int(os.environ.get("IDEMPOTENCY_TTL_HOURS", 24)) * 3600,
+    )
+    # Bucketed by creation time, so keys older than the TTL are evicted on the next pass
+    for key, stored in keys.items():
+        created = datetime.fromisoformat(stored["created_at"]).replace(tzinfo=timezone.utc)
+        store.put(key, stored, created_ts=created.timestamp())
+
+
 if __name__ == "__main__":
     seed_all()